@@ -0,0 +1,300 @@
+import os
+import re
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+
+from benchmarks.semantic_layer_benchmark import load_csv, load_synthetic
+from sql_agent.semantic_layer import SEMANTIC_LAYER_PATH
+
+# Answer-quality and latency regression benchmark over a gold question set.
+# Each gold entry is a question and the SQL that answers it (gold_questions.json). Questions go
+# through orchestration_service.generate_sql_query against a local SQLite copy of the loans data,
+# and the SQL in each response is executed and compared with the result of the expected SQL
+# (execution accuracy: same rows, column order and row order ignored unless the gold SQL sorts,
+# numbers rounded to 2 decimals).
+# Modes, each run in its own process because the service reads its configuration at import:
+#   agent      semantic layer off: every question goes through the LLM agent
+#   fast_path  semantic layer on: metric questions are answered from pre-aggregates, no LLM call
+#   cached     agent mode with warm caches: one unmeasured pass over the warm-up questions
+#              (warmup_questions.json) fills the schema cache and the harvested few-shot library,
+#              then the measured pass over the gold set reuses them. The warm-up questions must
+#              not overlap the gold set, otherwise the gold answers would be retrieved as few-shot
+#              examples; overlapping ones are dropped from the warm-up.
+# Per question and per mode the report has: correct or not, LLM calls, tokens and wall-clock time.
+#
+# The LLM settings come from sql_agent/credentials.env. With --mock-llm, a local mock answers
+# with the gold SQL, which checks the pipeline and measures its overhead (accuracy is then 100%
+# by construction).
+# Tokens are what the service reports (get_openai_callback). The agent streams its LLM calls, and
+# streamed responses carry usage only when AZURE_OPENAI_STREAM_USAGE=true (the mock honours it and
+# the benchmark sets it); against a deployment without it the token columns are 0 and the report
+# says so in "token_counts".
+#
+# Run it from the src folder:
+#   python -m benchmarks.gold_eval --output eval.json
+#   python -m benchmarks.gold_eval --modes agent,fast_path --baseline eval.json --max-accuracy-drop 0
+
+GOLD_PATH = os.path.join(os.path.dirname(__file__), "gold_questions.json")
+WARMUP_PATH = os.path.join(os.path.dirname(__file__), "warmup_questions.json")
+MODES = ("agent", "fast_path", "cached")
+DEFAULT_CSV = os.path.join(os.path.dirname(__file__), "..", "..", "Fabric", "loansclean.csv.zip")
+
+
+def build_database(path: str, csv_path: str, rows: int) -> str:
+    """Create the SQLite copy of the loans data with the semantic-layer pre-aggregates."""
+    connection = sqlite3.connect(path)
+    source = "synthetic"
+    if csv_path:
+        try:
+            load_csv(connection, csv_path)
+            source = os.path.basename(csv_path)
+        except (OSError, ValueError) as e:
+            print("Could not load {} ({}); using {} synthetic rows".format(csv_path, e, rows))
+    if source == "synthetic":
+        load_synthetic(connection, rows)
+    with open(SEMANTIC_LAYER_PATH, encoding="utf-8") as f:
+        for aggregate in json.load(f).get("pre_aggregates", []):
+            connection.execute("CREATE TABLE {} AS {}".format(aggregate["table"], aggregate["build_sql"]))
+    connection.commit()
+    connection.close()
+    return source
+
+
+def _normalize_value(value):
+    if isinstance(value, float):
+        value = round(value, 2)
+        return int(value) if value.is_integer() else value
+    return value
+
+
+def normalize_rows(rows: list, ordered: bool) -> list:
+    """Rows as comparable tuples: rounded numbers, column order ignored, row order ignored unless ordered."""
+    normalized = [tuple(sorted((_normalize_value(value) for value in row), key=repr)) for row in rows]
+    return normalized if ordered else sorted(normalized, key=repr)
+
+
+def extract_sql(sql_response: dict) -> str:
+    """The SQL statement from a /generate-sql/ response dictionary."""
+    sql_statement = re.sub(r'^SQL Statement:\s*', '', sql_response.get("SqlStatement", ""))
+    return sql_statement.replace("```sql", "").replace("```", "").strip().rstrip(";")
+
+
+def count_llm_calls(runs: list) -> int:
+    """Number of LLM runs in a tree of traced runs."""
+    return sum((run.run_type == "llm") + count_llm_calls(run.child_runs or []) for run in runs)
+
+
+def results_match(connection, generated_sql: str, expected_sql: str) -> tuple:
+    ordered = "ORDER BY" in expected_sql.upper() and "LIMIT" not in expected_sql.upper()
+    expected = normalize_rows(connection.execute(expected_sql).fetchall(), ordered)
+    try:
+        generated = normalize_rows(connection.execute(generated_sql).fetchall(), ordered)
+    except sqlite3.Error as e:
+        return False, "generated SQL failed: {}".format(e)
+    return generated == expected, "" if generated == expected else "result differs"
+
+
+def _question_key(question: str) -> str:
+    return re.sub(r"[^a-z0-9]+", " ", question.lower()).strip()
+
+
+def disjoint_warmup(warmup: list, gold: list) -> list:
+    """The warm-up entries whose question is not also a gold question (case and punctuation ignored)."""
+    gold_questions = {_question_key(entry["question"]) for entry in gold}
+    kept = [entry for entry in warmup if _question_key(entry["question"]) not in gold_questions]
+    if len(kept) < len(warmup):
+        print("Dropped {} warm-up question(s) that are in the gold set".format(len(warmup) - len(kept)))
+    return kept
+
+
+def run_mode(mode: str, database_path: str, gold: list, mock_llm: bool, warmup: list = None) -> dict:
+    """Run the gold set in this process with the configuration of one mode (cached mode warms up on warmup)."""
+    warmup = disjoint_warmup(warmup or [], gold)
+    work_dir = tempfile.mkdtemp(prefix="gold_eval_")
+    os.environ.update({
+        "DB_BACKEND": "sqlite",
+        "SQLITE_DATABASE_PATH": database_path,
+        "SCHEMA_CACHE_DIR": work_dir,
+        "SEMANTIC_LAYER_ENABLED": "true" if mode == "fast_path" else "false",
+        "FEW_SHOT_HARVEST": "true" if mode == "cached" else "false",
+        "FEW_SHOT_HARVEST_PATH": os.path.join(work_dir, "harvested_examples.jsonl"),
+        # Usage of the streamed agent calls, for the token columns
+        "AZURE_OPENAI_STREAM_USAGE": "true",
+    })
+
+    mock = None
+    if mock_llm:
+        from benchmarks.mock_openai import MockOpenAIServer
+        mock = MockOpenAIServer(answers={entry["question"]: entry["expected_sql"] for entry in gold + warmup}).start()
+        os.environ.update({"AZURE_OPENAI_ENDPOINT": mock.url, "AZURE_OPENAI_API_KEY": "mock",
+                           "AZURE_OPENAI_API_VERSION": "2024-02-01", "GPT35_DEPLOYMENT_NAME": "mock"})
+
+    # Imported after the environment is set: the service reads it at import time
+    from langchain_core.tracers.context import collect_runs
+    from orchestration_service import generate_sql_query
+
+    def ask(question: str) -> tuple:
+        start = time.perf_counter()
+        with collect_runs() as run_collector:
+            response = generate_sql_query(question)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        return json.loads(response.body), elapsed_ms, count_llm_calls(run_collector.traced_runs)
+
+    if mode == "cached":
+        for entry in warmup:
+            try:
+                ask(entry["question"])
+            except Exception as e:
+                print("Warm-up failed for {!r}: {}".format(entry["question"], e))
+
+    connection = sqlite3.connect(database_path)
+    results = []
+    for entry in gold:
+        result = {"question": entry["question"], "correct": False, "llm_calls": 0, "total_tokens": 0,
+                  "wall_ms": 0.0, "sql": "", "error": ""}
+        try:
+            sql_response, result["wall_ms"], result["llm_calls"] = ask(entry["question"])
+            result["total_tokens"] = sql_response.get("PromptTokensInt", 0) + sql_response.get("CompletionTokensInt", 0)
+            result["sql"] = extract_sql(sql_response)
+            result["correct"], result["error"] = results_match(connection, result["sql"], entry["expected_sql"])
+        except Exception as e:
+            result["error"] = "{}: {}".format(type(e).__name__, e)
+        result["wall_ms"] = round(result["wall_ms"], 1)
+        results.append(result)
+    connection.close()
+    if mock is not None:
+        mock.stop()
+
+    wall = [result["wall_ms"] for result in results]
+    return {
+        "summary": {
+            "questions": len(results),
+            "execution_accuracy": round(sum(result["correct"] for result in results) / len(results), 3) if results else 0.0,
+            "llm_calls_per_question": round(statistics.mean(result["llm_calls"] for result in results), 2) if results else 0.0,
+            "tokens_per_question": round(statistics.mean(result["total_tokens"] for result in results), 1) if results else 0.0,
+            "wall_ms_p50": round(statistics.median(wall), 1) if wall else 0.0,
+            "wall_ms_total": round(sum(wall), 1),
+            "warmup_questions": len(warmup) if mode == "cached" else 0,
+            "token_counts": "reported" if any(result["total_tokens"] for result in results) else
+                            "unavailable (the LLM endpoint returned no usage for streamed calls)",
+        },
+        "questions": results,
+    }
+
+
+def print_summary(report: dict, baseline: dict = None) -> None:
+    print()
+    print("{:<10} {:>9} {:>10} {:>10} {:>12} {:>12}".format("mode", "accuracy", "llm calls", "tokens", "p50 ms", "total ms"))
+    for mode, mode_report in report["modes"].items():
+        summary = mode_report["summary"]
+        print("{:<10} {:>9} {:>10} {:>10} {:>12} {:>12}".format(
+            mode, summary["execution_accuracy"], summary["llm_calls_per_question"], summary["tokens_per_question"],
+            summary["wall_ms_p50"], summary["wall_ms_total"]))
+        if not summary["tokens_per_question"] and summary["llm_calls_per_question"]:
+            print("{:<10} token usage was not reported by the LLM endpoint".format(""))
+        previous = (baseline or {}).get("modes", {}).get(mode)
+        if previous:
+            before = previous["summary"]
+            print("{:<10} {:>+9.3f} {:>+10.2f} {:>+10.1f} {:>+12.1f} {:>+12.1f}".format(
+                "  change", summary["execution_accuracy"] - before["execution_accuracy"],
+                summary["llm_calls_per_question"] - before["llm_calls_per_question"],
+                summary["tokens_per_question"] - before["tokens_per_question"],
+                summary["wall_ms_p50"] - before["wall_ms_p50"],
+                summary["wall_ms_total"] - before["wall_ms_total"]))
+
+
+def accuracy_regressions(report: dict, baseline: dict, max_drop: float) -> list:
+    """Modes whose execution accuracy dropped by more than max_drop against the baseline."""
+    regressions = []
+    for mode, mode_report in report["modes"].items():
+        previous = baseline.get("modes", {}).get(mode)
+        if previous and previous["summary"]["execution_accuracy"] - mode_report["summary"]["execution_accuracy"] > max_drop:
+            regressions.append(mode)
+    return regressions
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Execution accuracy and latency of generate_sql_query over a gold set.")
+    parser.add_argument("--gold", default=GOLD_PATH, help="Gold question set (JSON list of question/expected_sql)")
+    parser.add_argument("--warmup", default=WARMUP_PATH,
+                        help="Warm-up questions of the cached mode (JSON list, disjoint from the gold set)")
+    parser.add_argument("--modes", default=",".join(MODES), help="Comma-separated modes: " + ", ".join(MODES))
+    parser.add_argument("--csv", default=DEFAULT_CSV, help="CSV or zipped CSV export of the loans table")
+    parser.add_argument("--rows", type=int, default=50000, help="Synthetic rows when the CSV cannot be loaded")
+    parser.add_argument("--mock-llm", action="store_true", help="Answer with a local mock LLM that returns the gold SQL")
+    parser.add_argument("--output", default="gold_eval_report.json", help="Where to write the JSON report")
+    parser.add_argument("--baseline", help="Previous report to compare against")
+    parser.add_argument("--max-accuracy-drop", type=float, default=0.0,
+                        help="With --baseline, exit with status 1 when accuracy drops by more than this")
+    # Internal: run one mode in this process and write its results to a file
+    parser.add_argument("--run-mode", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--database", help=argparse.SUPPRESS)
+    parser.add_argument("--mode-output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    with open(args.gold, encoding="utf-8") as f:
+        gold = json.load(f)
+
+    if args.run_mode:
+        with open(args.warmup, encoding="utf-8") as f:
+            warmup = json.load(f)
+        with open(args.mode_output, "w", encoding="utf-8") as f:
+            json.dump(run_mode(args.run_mode, args.database, gold, args.mock_llm, warmup), f)
+        return
+
+    modes = [mode for mode in args.modes.split(",") if mode]
+    work_dir = tempfile.mkdtemp(prefix="gold_eval_")
+    database_path = os.path.join(work_dir, "loans.db")
+    data_source = build_database(database_path, args.csv, args.rows)
+
+    report = {"commit": _git_commit(), "python": platform.python_version(), "data": data_source,
+              "gold_set": os.path.basename(args.gold), "mock_llm": args.mock_llm, "modes": {}}
+    src_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for mode in modes:
+        mode_output = os.path.join(work_dir, mode + ".json")
+        command = [sys.executable, "-m", "benchmarks.gold_eval", "--gold", args.gold, "--warmup", args.warmup, "--run-mode", mode,
+                   "--database", database_path, "--mode-output", mode_output]
+        if args.mock_llm:
+            command.append("--mock-llm")
+        print("Running mode {}...".format(mode))
+        if subprocess.run(command, cwd=src_dir).returncode != 0:
+            print("Mode {} failed".format(mode))
+            continue
+        with open(mode_output, encoding="utf-8") as f:
+            report["modes"][mode] = json.load(f)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_summary(report, baseline)
+    print("Report written to {}".format(args.output))
+
+    if baseline is not None:
+        regressions = accuracy_regressions(report, baseline, args.max_accuracy_drop)
+        if regressions:
+            print("Execution accuracy dropped for: {}".format(", ".join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+import os
+import sys
+import json
+import math
+import time
+import socket
+import sqlite3
+import asyncio
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+
+import httpx
+import psutil
+
+from benchmarks.mock_openai import MockOpenAIServer
+from benchmarks.semantic_layer_benchmark import load_synthetic
+
+# Load test for the /generate-sql/ endpoint.
+# The service runs either in-process (httpx ASGI transport, no network) or under uvicorn with
+# one or more workers. The LLM is replaced by the mock server in mock_openai.py and the database
+# by a SQLite file with a synthetic loans table, so a run measures the service itself: request
+# handling, the FastAPI threadpool, agent construction, schema reflection and the DB round trip.
+# Each concurrency level runs a fixed number of requests and records latency percentiles,
+# throughput, errors, LLM calls per request, and CPU and memory of every server process.
+#
+# Finding the bottleneck: raise one limit at a time and compare reports.
+#   --llm-latency-ms    model wait; when it dominates, throughput ~ concurrency / latency
+#   --threadpool-size   FastAPI runs the sync endpoint on the anyio threadpool (default 40 threads)
+#   DB_POOL_SIZE        connections per engine (see db_backends.py)
+#
+# Requires httpx and psutil (pip install httpx psutil). Run it from the src folder:
+#   python -m benchmarks.load_benchmark --concurrency 1,4,16,32 --requests 200 --output report.json
+#   python -m benchmarks.load_benchmark --mode uvicorn --workers 4 --compare report.json
+
+DEFAULT_PROMPT = "Average credit score of applicants by their ownership type"
+
+
+def percentile(values: list, q: float) -> float:
+    """Nearest-rank percentile (q in 0..100) of a list of numbers."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def prepare_environment(args, mock_url: str) -> dict:
+    """Environment for the service under test: mock LLM, SQLite stand-in, no side effects."""
+    database_path = os.path.join(tempfile.mkdtemp(prefix="load_benchmark_"), "loans.db")
+    connection = sqlite3.connect(database_path)
+    load_synthetic(connection, args.rows)
+    connection.commit()
+    connection.close()
+
+    environment = {
+        "AZURE_OPENAI_ENDPOINT": mock_url,
+        "AZURE_OPENAI_API_KEY": "mock",
+        "AZURE_OPENAI_API_VERSION": os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-01"),
+        "GPT35_DEPLOYMENT_NAME": "mock",
+        "DB_BACKEND": "sqlite",
+        "SQLITE_DATABASE_PATH": database_path,
+        # Exercise the agent path; the semantic layer would answer the default prompt directly
+        "SEMANTIC_LAYER_ENABLED": "true" if args.semantic_layer else "false",
+        "FEW_SHOT_HARVEST": "false",
+        "SCHEMA_CACHE_DIR": os.path.dirname(database_path),
+    }
+    os.environ.update(environment)
+    return environment
+
+
+class ProcessSampler:
+    """Samples CPU time and peak RSS of the server processes while a level runs."""
+
+    def __init__(self, pids: list, interval: float = 0.2):
+        self.processes = [psutil.Process(pid) for pid in pids]
+        self.interval = interval
+        self.peak_rss = {process.pid: 0 for process in self.processes}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="process-sampler", daemon=True)
+
+    def _cpu_seconds(self) -> dict:
+        times = {}
+        for process in self.processes:
+            cpu = process.cpu_times()
+            times[process.pid] = cpu.user + cpu.system
+        return times
+
+    def _sample_rss(self) -> None:
+        for process in self.processes:
+            self.peak_rss[process.pid] = max(self.peak_rss[process.pid], process.memory_info().rss)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._sample_rss()
+
+    def __enter__(self):
+        self._start_cpu = self._cpu_seconds()
+        self._start_wall = time.perf_counter()
+        self._sample_rss()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self._sample_rss()
+        wall = time.perf_counter() - self._start_wall
+        end_cpu = self._cpu_seconds()
+        self.workers = [
+            {
+                "pid": pid,
+                "cpu_percent": round((end_cpu[pid] - self._start_cpu[pid]) / wall * 100, 1),
+                "peak_rss_mb": round(self.peak_rss[pid] / 2 ** 20, 1),
+            }
+            for pid in sorted(end_cpu)
+        ]
+
+
+async def run_level(client: httpx.AsyncClient, url: str, prompt: str, concurrency: int, request_count: int) -> dict:
+    """Send request_count requests with at most `concurrency` in flight."""
+    latencies = []
+    errors = {}
+    remaining = iter(range(request_count))
+
+    async def worker():
+        for _ in remaining:
+            start = time.perf_counter()
+            try:
+                response = await client.post(url, json={"prompt": prompt})
+                status = response.status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if status == 200:
+                latencies.append(elapsed_ms)
+            else:
+                errors[str(status)] = errors.get(str(status), 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - start
+
+    return {
+        "concurrency": concurrency,
+        "requests": request_count,
+        "succeeded": len(latencies),
+        "errors": errors,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 1),
+            "p95": round(percentile(latencies, 95), 1),
+            "p99": round(percentile(latencies, 99), 1),
+            "max": round(max(latencies), 1) if latencies else 0.0,
+        },
+    }
+
+
+def find_saturation(levels: list, min_gain: float = 0.1):
+    """First concurrency level whose throughput gain over the previous level is below min_gain."""
+    for previous, current in zip(levels, levels[1:]):
+        if previous["throughput_rps"] and current["throughput_rps"] < previous["throughput_rps"] * (1 + min_gain):
+            return current["concurrency"]
+    return None
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_uvicorn(workers: int, environment: dict) -> tuple:
+    """Start the service under uvicorn and wait until it answers."""
+    port = _free_port()
+    src_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=src_dir, env=dict(os.environ, **environment),
+    )
+    base_url = "http://127.0.0.1:{}".format(port)
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        try:
+            if httpx.get(base_url + "/openapi.json", timeout=1).status_code == 200:
+                break
+        except httpx.HTTPError:
+            time.sleep(0.5)
+    else:
+        server.terminate()
+        raise RuntimeError("uvicorn did not start within 120 seconds")
+
+    parent = psutil.Process(server.pid)
+    pids = [child.pid for child in parent.children()] if workers > 1 else [server.pid]
+    return server, base_url, pids
+
+
+async def sweep(args, environment: dict, mock: MockOpenAIServer) -> list:
+    server = None
+    if args.mode == "uvicorn":
+        server, base_url, pids = start_uvicorn(args.workers, environment)
+        client = httpx.AsyncClient(base_url=base_url, timeout=args.timeout)
+    else:
+        # Imported after the environment is prepared: the service reads it at import time
+        from main import app
+        import anyio.to_thread
+        if args.threadpool_size:
+            anyio.to_thread.current_default_thread_limiter().total_tokens = args.threadpool_size
+        pids = [os.getpid()]
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://service", timeout=args.timeout)
+
+    levels = []
+    try:
+        # Warm-up: imports, first engine, first schema reflection
+        await run_level(client, "/generate-sql/", args.prompt, 1, args.warmup)
+        for concurrency in args.concurrency:
+            calls_before = mock.call_count
+            with ProcessSampler(pids) as sampler:
+                level = await run_level(client, "/generate-sql/", args.prompt, concurrency, args.requests)
+            level["llm_calls_per_request"] = round((mock.call_count - calls_before) / args.requests, 2)
+            level["workers"] = sampler.workers
+            levels.append(level)
+            print("c={:<4} rps={:<8} p50={:<8} p95={:<8} p99={:<8} errors={}".format(
+                concurrency, level["throughput_rps"], level["latency_ms"]["p50"],
+                level["latency_ms"]["p95"], level["latency_ms"]["p99"], sum(level["errors"].values())))
+    finally:
+        await client.aclose()
+        if server is not None:
+            server.terminate()
+            server.wait()
+    return levels
+
+
+def compare_reports(previous: dict, current: dict) -> None:
+    """Print throughput and latency changes per concurrency level against a previous report."""
+    previous_levels = {level["concurrency"]: level for level in previous.get("levels", [])}
+    print()
+    print("{:>6} {:>12} {:>12} {:>9} {:>12} {:>12} {:>9}".format(
+        "conc", "rps before", "rps now", "change", "p95 before", "p95 now", "change"))
+    for level in current["levels"]:
+        before = previous_levels.get(level["concurrency"])
+        if before is None:
+            continue
+
+        def change(old, new):
+            return "{:+.1f}%".format((new - old) / old * 100) if old else "n/a"
+
+        print("{:>6} {:>12} {:>12} {:>9} {:>12} {:>12} {:>9}".format(
+            level["concurrency"], before["throughput_rps"], level["throughput_rps"],
+            change(before["throughput_rps"], level["throughput_rps"]),
+            before["latency_ms"]["p95"], level["latency_ms"]["p95"],
+            change(before["latency_ms"]["p95"], level["latency_ms"]["p95"])))
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the /generate-sql/ endpoint against a mock LLM and SQLite.")
+    parser.add_argument("--mode", choices=("inprocess", "uvicorn"), default="inprocess")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes (uvicorn mode)")
+    parser.add_argument("--concurrency", default="1,2,4,8,16,32", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per concurrency level")
+    parser.add_argument("--warmup", type=int, default=3, help="Warm-up requests before the sweep")
+    parser.add_argument("--llm-latency-ms", type=float, default=200.0, help="Simulated latency of each LLM call")
+    parser.add_argument("--threadpool-size", type=int, default=0, help="anyio threadpool size (inprocess mode)")
+    parser.add_argument("--rows", type=int, default=50000, help="Rows in the synthetic loans table")
+    parser.add_argument("--prompt", default=DEFAULT_PROMPT)
+    parser.add_argument("--semantic-layer", action="store_true", help="Leave the semantic layer fast path enabled")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Client timeout per request in seconds")
+    parser.add_argument("--output", default="load_benchmark_report.json", help="Where to write the JSON report")
+    parser.add_argument("--compare", help="Previous JSON report to compare against")
+    args = parser.parse_args()
+    args.concurrency = [int(level) for level in args.concurrency.split(",") if level.strip()]
+
+    with MockOpenAIServer(latency_ms=args.llm_latency_ms) as mock:
+        environment = prepare_environment(args, mock.url)
+        levels = asyncio.run(sweep(args, environment, mock))
+
+    report = {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "settings": {
+            "mode": args.mode,
+            "workers": args.workers if args.mode == "uvicorn" else 1,
+            "requests_per_level": args.requests,
+            "llm_latency_ms": args.llm_latency_ms,
+            "threadpool_size": args.threadpool_size or "default",
+            "db_pool_size": os.getenv("DB_POOL_SIZE", "default"),
+            "rows": args.rows,
+            "prompt": args.prompt,
+            "semantic_layer": args.semantic_layer,
+        },
+        "levels": levels,
+        "saturation_concurrency": find_saturation(levels),
+    }
+    # Stable key order and one field per line, so two reports diff cleanly
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write("\n")
+    print("Report written to {} (throughput saturates at concurrency {})".format(
+        args.output, report["saturation_concurrency"] or "not reached"))
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare_reports(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
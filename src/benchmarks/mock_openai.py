@@ -0,0 +1,149 @@
+import json
+import time
+import threading
+import itertools
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Mock Azure OpenAI chat-completions server for local benchmarks.
+# It plays a scripted openai-tools agent conversation so the whole service pipeline runs
+# without a model deployment:
+#   1. no tool result in the conversation yet  -> call sql_db_query with a fixed SQL statement
+#   2. a tool result is present                -> return a Final Answer with the SQL and an explanation
+# Every call sleeps for a configurable latency, so LLM wait time can be modelled.
+# With answers={question: sql}, the SQL of the matching question is used instead of the default
+# one, so an evaluation run with a gold set exercises the pipeline end to end (see gold_eval.py).
+# Both plain JSON and streamed (server-sent events) responses are supported, because the
+# agent executor streams its planning calls. Streamed responses end with a usage chunk when the
+# request asks for it (stream_options.include_usage), as the OpenAI API does; like the API, the mock
+# rejects stream_options on a request that is not streamed.
+#
+# Point the service at it with:
+#   AZURE_OPENAI_ENDPOINT=http://127.0.0.1:<port>  AZURE_OPENAI_API_KEY=mock
+
+DEFAULT_SQL = "SELECT home_ownership, AVG(credit_score) AS avg_credit_score FROM loans GROUP BY home_ownership"
+
+
+class MockOpenAIServer:
+    """Threaded HTTP server that answers /chat/completions with a scripted agent run."""
+
+    def __init__(self, sql_statement: str = DEFAULT_SQL, latency_ms: float = 0.0, host: str = "127.0.0.1", port: int = 0,
+                 answers: dict = None):
+        self.sql_statement = sql_statement
+        self.answers = answers or {}
+        self.latency_ms = latency_ms
+        self.call_count = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def start(self) -> "MockOpenAIServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def sql_for(self, messages: list) -> str:
+        """The scripted SQL for a conversation: the answer of the question it contains, else the default."""
+        user_text = " ".join(str(message.get("content") or "") for message in messages if message.get("role") == "user")
+        for question, sql_statement in self.answers.items():
+            if question in user_text:
+                return sql_statement
+        return self.sql_statement
+
+    def reply(self, messages: list) -> dict:
+        """Return the next assistant message for a conversation (tool call or final answer)."""
+        with self._lock:
+            self.call_count += 1
+            call_id = next(self._ids)
+        sql_statement = self.sql_for(messages)
+        if not any(message.get("role") == "tool" for message in messages):
+            return {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [{
+                    "id": "call_{}".format(call_id),
+                    "type": "function",
+                    "function": {"name": "sql_db_query", "arguments": json.dumps({"query": sql_statement})},
+                }],
+            }
+        result = [message for message in messages if message.get("role") == "tool"][-1].get("content", "")
+        return {
+            "role": "assistant",
+            "content": "Final Answer: {}\n\nExplanation:\nI queried the loans table. "
+                       "I used the following query:\n\n```sql\n{}\n```".format(str(result)[:200], sql_statement),
+        }
+
+    def _handler_class(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                # Keep benchmark output readable
+                pass
+
+            def _send(self, status: int, body: bytes, content_type: str = "application/json"):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if not self.path.split("?")[0].endswith("/chat/completions"):
+                    self._send(404, b'{"error": {"message": "not found"}}')
+                    return
+                if payload.get("stream_options") and not payload.get("stream"):
+                    self._send(400, b'{"error": {"message": "stream_options is only allowed when stream is true"}}')
+                    return
+                if mock.latency_ms:
+                    time.sleep(mock.latency_ms / 1000)
+
+                message = mock.reply(payload.get("messages", []))
+                finish_reason = "tool_calls" if message.get("tool_calls") else "stop"
+                prompt_tokens = sum(len(str(m.get("content") or "")) for m in payload.get("messages", [])) // 4
+                completion_tokens = len(json.dumps(message)) // 4
+                base = {"id": "chatcmpl-mock", "created": int(time.time()), "model": payload.get("model", "mock")}
+
+                if not payload.get("stream"):
+                    body = dict(base, object="chat.completion", choices=[
+                        {"index": 0, "message": message, "finish_reason": finish_reason}
+                    ], usage={"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                              "total_tokens": prompt_tokens + completion_tokens})
+                    self._send(200, json.dumps(body).encode("utf-8"))
+                    return
+
+                # Streamed: one chunk with the whole delta, then the finish reason
+                delta = dict(message)
+                if "tool_calls" in delta:
+                    delta["tool_calls"] = [dict(call, index=index) for index, call in enumerate(delta["tool_calls"])]
+                chunks = [
+                    dict(base, object="chat.completion.chunk", choices=[{"index": 0, "delta": delta, "finish_reason": None}]),
+                    dict(base, object="chat.completion.chunk", choices=[{"index": 0, "delta": {}, "finish_reason": finish_reason}]),
+                ]
+                if (payload.get("stream_options") or {}).get("include_usage"):
+                    chunks.append(dict(base, object="chat.completion.chunk", choices=[], usage={
+                        "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                        "total_tokens": prompt_tokens + completion_tokens}))
+                body = "".join("data: {}\n\n".format(json.dumps(chunk)) for chunk in chunks) + "data: [DONE]\n\n"
+                self._send(200, body.encode("utf-8"), content_type="text/event-stream")
+
+        return Handler
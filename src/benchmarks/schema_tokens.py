@@ -0,0 +1,94 @@
+import os
+import json
+import time
+import argparse
+import tempfile
+
+from sqlalchemy import create_engine
+
+from benchmarks.gold_eval import DEFAULT_CSV, build_database
+from sql_agent.compact_schema import count_tokens
+from sql_agent.sql_sandbox import ReadOnlySQLDatabase
+
+# Schema tokens: full rendering (CREATE TABLE DDL + sample rows, what sql_db_schema returns by
+# default) vs. the compact rendering (SCHEMA_RENDERING=compact, see sql_agent/compact_schema.py),
+# on the same database. Tokens are counted with tiktoken for --model.
+# Per table and in total, the report has the tokens of both renderings and the saving, plus the
+# time to render all tables compactly cold and from the cache.
+# Without --url, a SQLite copy of the loans data is built (as in gold_eval.py).
+#
+# Run it from the src folder:
+#   python -m benchmarks.schema_tokens
+#   python -m benchmarks.schema_tokens --url "sqlite:///path/to/database.db" --output schema_tokens.json
+
+
+def make_database(url: str, rendering: str) -> ReadOnlySQLDatabase:
+    # The sandbox reads SCHEMA_RENDERING when it is created
+    os.environ["SCHEMA_RENDERING"] = rendering
+    return ReadOnlySQLDatabase(create_engine(url))
+
+
+def measure(url: str, model: str) -> dict:
+    full_db = make_database(url, "full")
+    compact_db = make_database(url, "compact")
+    tables = {}
+    for table_name in full_db.get_usable_table_names():
+        full_tokens = count_tokens(full_db.get_table_info([table_name]), model)
+        compact_tokens = count_tokens(compact_db.get_table_info([table_name]), model)
+        tables[table_name] = {"full_tokens": full_tokens, "compact_tokens": compact_tokens}
+
+    # All tables in one call, as when the agent asks for several schemas at once
+    all_tables = full_db.get_usable_table_names()
+    full_total = count_tokens(full_db.get_table_info(all_tables), model)
+    cold_db = make_database(url, "compact")
+    start = time.perf_counter()
+    compact_text = cold_db.get_table_info(all_tables)
+    cold_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    cold_db.get_table_info(all_tables)
+    cached_ms = (time.perf_counter() - start) * 1000
+    compact_total = count_tokens(compact_text, model)
+
+    return {
+        "model": model,
+        "tables": tables,
+        "full_tokens": full_total,
+        "compact_tokens": compact_total,
+        "saving_pct": round(100.0 * (full_total - compact_total) / full_total, 1) if full_total else 0.0,
+        "compact_render_ms": {"cold": round(cold_ms, 2), "cached": round(cached_ms, 2)},
+        "compact_sample": compact_text[:2000],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Schema tokens of the full vs. compact rendering.")
+    parser.add_argument("--url", help="SQLAlchemy URL of the database to measure (default: local loans copy)")
+    parser.add_argument("--csv", default=DEFAULT_CSV, help="CSV or zipped CSV export of the loans table")
+    parser.add_argument("--rows", type=int, default=1000, help="Synthetic rows when the CSV cannot be loaded")
+    parser.add_argument("--model", default="gpt-4", help="Model whose tokenizer is used")
+    parser.add_argument("--output", help="Where to write the JSON report")
+    args = parser.parse_args()
+
+    url = args.url
+    if not url:
+        database_path = os.path.join(tempfile.mkdtemp(prefix="schema_tokens_"), "loans.db")
+        build_database(database_path, args.csv, args.rows)
+        url = "sqlite:///" + database_path
+
+    report = measure(url, args.model)
+    for table_name, counts in sorted(report["tables"].items()):
+        print("{:<30} full {:>6}  compact {:>6}".format(table_name, counts["full_tokens"], counts["compact_tokens"]))
+    print("{:<30} full {:>6}  compact {:>6}  saving {}%".format(
+        "all tables", report["full_tokens"], report["compact_tokens"], report["saving_pct"]))
+    print("Compact rendering: {} ms cold, {} ms cached".format(
+        report["compact_render_ms"]["cold"], report["compact_render_ms"]["cached"]))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print("Report written to {}".format(args.output))
+
+
+if __name__ == "__main__":
+    main()
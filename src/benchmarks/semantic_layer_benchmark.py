@@ -0,0 +1,118 @@
+import io
+import csv
+import json
+import time
+import random
+import sqlite3
+import zipfile
+import argparse
+import statistics
+
+from sql_agent.semantic_layer import SemanticLayer, SEMANTIC_LAYER_PATH
+
+# Local benchmark: base-table scan vs. semantic-layer pre-aggregate.
+# Builds a SQLite stand-in for the loans table (synthetic rows, or a CSV/zipped CSV export),
+# creates the pre-aggregates declared in semantic_layer.json from their build_sql, then times
+# the SQL the router produces with and without the pre-aggregates.
+#
+# Run it from the src folder:
+#   python -m benchmarks.semantic_layer_benchmark --rows 500000
+#   python -m benchmarks.semantic_layer_benchmark --csv ../Fabric/loansclean.csv.zip
+
+DEFAULT_QUESTIONS = [
+    "Average credit score of applicants by their ownership type",
+    "How many loans per state",
+    "Total loan amount by ownership type and state",
+    "Average loan amount",
+]
+
+
+def _convert(value: str):
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    return value if value != "" else None
+
+
+def load_csv(connection, path: str) -> int:
+    """Load a CSV file (or the first CSV inside a zip) into a table named loans."""
+    if path.endswith(".zip"):
+        with zipfile.ZipFile(path) as archive:
+            names = [name for name in archive.namelist() if name.endswith(".csv") and not name.startswith("__MACOSX")]
+            if not names:
+                raise ValueError("No CSV file found in {}".format(path))
+            text = archive.read(names[0]).decode("utf-8-sig")
+    else:
+        with open(path, encoding="utf-8-sig") as f:
+            text = f.read()
+
+    reader = csv.reader(io.StringIO(text))
+    header = [column.strip().lower().replace(" ", "_") for column in next(reader)]
+    connection.execute("CREATE TABLE loans ({})".format(", ".join('"{}"'.format(column) for column in header)))
+    rows = ([_convert(value) for value in row] for row in reader)
+    connection.executemany("INSERT INTO loans VALUES ({})".format(", ".join("?" * len(header))), rows)
+    return connection.execute("SELECT COUNT(*) FROM loans").fetchone()[0]
+
+
+def load_synthetic(connection, row_count: int, seed: int = 7) -> int:
+    """Create a synthetic loans table with the columns used by semantic_layer.json."""
+    generator = random.Random(seed)
+    states = ["AK", "AL", "AZ", "CA", "CO", "FL", "GA", "IL", "MA", "NY", "OH", "PA", "TX", "WA"]
+    ownership = ["RENT", "MORTGAGE", "OWN", "OTHER"]
+    connection.execute("CREATE TABLE loans (loan_id INTEGER, home_ownership TEXT, state TEXT, "
+                       "credit_score INTEGER, loan_amount REAL)")
+    rows = ((i, generator.choice(ownership), generator.choice(states), generator.randint(550, 850),
+             round(generator.uniform(1000, 40000), 2)) for i in range(row_count))
+    connection.executemany("INSERT INTO loans VALUES (?, ?, ?, ?, ?)", rows)
+    return row_count
+
+
+def time_query(connection, sql: str, repeat: int) -> list:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        connection.execute(sql).fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark semantic-layer pre-aggregates against base-table scans.")
+    parser.add_argument("--csv", help="CSV or zipped CSV export of the loans table (default: synthetic data)")
+    parser.add_argument("--rows", type=int, default=500000, help="Synthetic rows when --csv is not given")
+    parser.add_argument("--repeat", type=int, default=20, help="Executions per query")
+    parser.add_argument("--config", default=SEMANTIC_LAYER_PATH, help="Semantic layer config")
+    args = parser.parse_args()
+
+    with open(args.config, encoding="utf-8") as f:
+        config = json.load(f)
+    routed_layer = SemanticLayer(config)
+    base_layer = SemanticLayer(dict(config, pre_aggregates=[]))
+
+    connection = sqlite3.connect(":memory:")
+    row_count = load_csv(connection, args.csv) if args.csv else load_synthetic(connection, args.rows)
+    for aggregate in config.get("pre_aggregates", []):
+        connection.execute("CREATE TABLE {} AS {}".format(aggregate["table"], aggregate["build_sql"]))
+    print("loans rows: {}".format(row_count))
+    print()
+    print("{:<60} {:>12} {:>12} {:>9} {:>11}".format("question", "base p50 ms", "pre-agg p50", "speedup", "route ms"))
+
+    for question in DEFAULT_QUESTIONS:
+        start = time.perf_counter()
+        routed = routed_layer.route(question)
+        route_ms = (time.perf_counter() - start) * 1000
+        base = base_layer.route(question)
+        if routed is None or base is None:
+            print("{:<60} not routed".format(question[:60]))
+            continue
+
+        base_p50 = statistics.median(time_query(connection, base.sql_statement, args.repeat))
+        routed_p50 = statistics.median(time_query(connection, routed.sql_statement, args.repeat))
+        print("{:<60} {:>12.2f} {:>12.2f} {:>8.1f}x {:>11.3f}".format(
+            question[:60], base_p50, routed_p50, base_p50 / routed_p50 if routed_p50 else float("inf"), route_ms))
+
+
+if __name__ == "__main__":
+    main()
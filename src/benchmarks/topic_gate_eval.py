@@ -0,0 +1,155 @@
+import os
+import sys
+import json
+import time
+import pickle
+import argparse
+import tempfile
+import statistics
+
+from sqlalchemy import MetaData, Table, create_engine
+
+from benchmarks.gold_eval import DEFAULT_CSV, GOLD_PATH, build_database
+from sql_agent.column_profiler import profile_table
+from sql_agent.semantic_layer import SemanticLayer
+from sql_agent.sql_sandbox import ReadOnlySQLDatabase
+from sql_agent.topic_gate import TopicGate, build_vocabulary, load_classifier
+
+# False-reject measurement of the topic gate (sql_agent/topic_gate.py) on a labeled question set.
+# Labeled questions come from topic_questions.json ({"question", "on_topic"}) plus every gold
+# question (gold_questions.json, all on topic). The gate's vocabulary is built from a SQLite copy
+# of the loans data (as in gold_eval.py), its column statistics and the semantic layer, the way
+# the service builds it.
+# The report has the false-reject rate (on-topic questions the gate would answer with "I don't
+# know"), the false-accept rate (off-topic questions that would still reach the agent), the
+# misclassified questions and the gate's latency per question.
+# --max-false-reject fails the run (exit code 1) above a rate, so it can guard a deployment that
+# switches TOPIC_GATE to enforce. --train-model trains a small scikit-learn classifier on the
+# labeled set (for TOPIC_GATE_MODEL_PATH; needs scikit-learn) and --model evaluates one. A model
+# evaluated on the set it was trained on is optimistic; label a held-out set with --labels.
+#
+# Run it from the src folder:
+#   python -m benchmarks.topic_gate_eval
+#   python -m benchmarks.topic_gate_eval --labels my_questions.json --max-false-reject 0.02
+#   python -m benchmarks.topic_gate_eval --extra-terms "borrow,borrowed,lend,lent,money,applicant,rent,mortgage"
+
+LABELS_PATH = os.path.join(os.path.dirname(__file__), "topic_questions.json")
+
+
+def load_labeled_questions(labels_path: str, gold_path: str) -> list:
+    with open(labels_path, encoding="utf-8") as f:
+        labeled = json.load(f)
+    if gold_path and os.path.exists(gold_path):
+        with open(gold_path, encoding="utf-8") as f:
+            labeled.extend({"question": entry["question"], "on_topic": True} for entry in json.load(f))
+    return labeled
+
+
+def build_gate(url: str, classifier=None, threshold: float = 0.5, extra_terms: list = ()) -> TopicGate:
+    engine = create_engine(url)
+    db = ReadOnlySQLDatabase(engine)
+    # Reflect every table, as after the warm-up
+    db.get_table_info()
+    # Profiled here instead of with profile_database, which would overwrite the schema cache
+    metadata = MetaData()
+    column_stats = {"tables": {name: profile_table(engine, Table(name, metadata, autoload_with=engine))
+                               for name in db.get_usable_table_names()}}
+    return TopicGate(build_vocabulary(db, column_stats, SemanticLayer.from_file(), extra_terms),
+                     classifier=classifier, threshold=threshold)
+
+
+def evaluate(gate: TopicGate, labeled: list) -> dict:
+    false_rejects = []
+    false_accepts = []
+    latencies_us = []
+    for entry in labeled:
+        start = time.perf_counter()
+        verdict = gate.check(entry["question"])
+        latencies_us.append((time.perf_counter() - start) * 1e6)
+        if entry["on_topic"] and not verdict.on_topic:
+            false_rejects.append({"question": entry["question"], "reason": verdict.reason})
+        elif not entry["on_topic"] and verdict.on_topic:
+            false_accepts.append({"question": entry["question"], "reason": verdict.reason,
+                                  "matched_terms": verdict.matched_terms})
+
+    on_topic = sum(1 for entry in labeled if entry["on_topic"])
+    off_topic = len(labeled) - on_topic
+    latencies_us.sort()
+    return {
+        "questions": len(labeled),
+        "on_topic": on_topic,
+        "off_topic": off_topic,
+        "false_reject_rate": round(len(false_rejects) / on_topic, 4) if on_topic else 0.0,
+        "false_accept_rate": round(len(false_accepts) / off_topic, 4) if off_topic else 0.0,
+        "false_rejects": false_rejects,
+        "false_accepts": false_accepts,
+        "latency_us": {"p50": round(statistics.median(latencies_us), 1),
+                       "p99": round(latencies_us[int(0.99 * (len(latencies_us) - 1))], 1)},
+        "classifier": gate.classifier is not None,
+    }
+
+
+def train_model(labeled: list, path: str) -> None:
+    """Train a character n-gram logistic regression on the labeled questions and pickle it."""
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.pipeline import make_pipeline
+
+    model = make_pipeline(TfidfVectorizer(analyzer="char_wb", ngram_range=(2, 4), sublinear_tf=True),
+                          LogisticRegression(class_weight="balanced", max_iter=1000))
+    model.fit([entry["question"] for entry in labeled], [int(entry["on_topic"]) for entry in labeled])
+    with open(path, "wb") as f:
+        pickle.dump(model, f)
+    print("Topic classifier written to {}".format(path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="False-reject rate of the topic gate on a labeled question set.")
+    parser.add_argument("--labels", default=LABELS_PATH, help="Labeled questions (JSON list of question/on_topic)")
+    parser.add_argument("--gold", default=GOLD_PATH, help="Gold question set, added as on-topic questions ('' to skip)")
+    parser.add_argument("--url", help="SQLAlchemy URL of the database (default: local loans copy)")
+    parser.add_argument("--csv", default=DEFAULT_CSV, help="CSV or zipped CSV export of the loans table")
+    parser.add_argument("--rows", type=int, default=1000, help="Synthetic rows when the CSV cannot be loaded")
+    parser.add_argument("--extra-terms", default="", help="Comma-separated domain words (TOPIC_GATE_EXTRA_TERMS)")
+    parser.add_argument("--model", help="Pickled classifier to evaluate with the gate (TOPIC_GATE_MODEL_PATH)")
+    parser.add_argument("--threshold", type=float, default=0.5, help="Classifier probability to accept a question")
+    parser.add_argument("--train-model", help="Train a classifier on the labeled set and write it here")
+    parser.add_argument("--max-false-reject", type=float, help="Fail when the false-reject rate is higher")
+    parser.add_argument("--output", help="Where to write the JSON report")
+    args = parser.parse_args()
+
+    labeled = load_labeled_questions(args.labels, args.gold)
+    if args.train_model:
+        train_model(labeled, args.train_model)
+
+    url = args.url
+    if not url:
+        database_path = os.path.join(tempfile.mkdtemp(prefix="topic_gate_"), "loans.db")
+        build_database(database_path, args.csv, args.rows)
+        url = "sqlite:///" + database_path
+
+    classifier = load_classifier(args.model) if args.model else None
+    report = evaluate(build_gate(url, classifier, args.threshold,
+                                   [term.strip() for term in args.extra_terms.split(",") if term.strip()]), labeled)
+    print("{} questions ({} on topic, {} off topic)".format(report["questions"], report["on_topic"], report["off_topic"]))
+    print("False rejects: {:.1%}  False accepts: {:.1%}  Latency p50 {} us, p99 {} us".format(
+        report["false_reject_rate"], report["false_accept_rate"],
+        report["latency_us"]["p50"], report["latency_us"]["p99"]))
+    for entry in report["false_rejects"]:
+        print("  rejected (on topic): {} [{}]".format(entry["question"], entry["reason"]))
+    for entry in report["false_accepts"]:
+        print("  accepted (off topic): {} [{}]".format(entry["question"], ", ".join(entry["matched_terms"]) or entry["reason"]))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print("Report written to {}".format(args.output))
+
+    if args.max_false_reject is not None and report["false_reject_rate"] > args.max_false_reject:
+        print("False-reject rate {:.1%} is above {:.1%}".format(report["false_reject_rate"], args.max_false_reject))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
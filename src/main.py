@@ -1,10 +1,38 @@
+import os
+import hmac
+import uuid
 import logging
 
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from typing import Optional
+
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse
+from pydantic import BaseModel, Field
 
 # Import the generate_sql_query function using an absolute import
-from orchestration_service import generate_sql_query
+from orchestration_service import generate_sql_query, generate_sql_query_v2
+
+# v2 response contract: typed fields, orjson encoding and paginated results
+from sql_agent.response_v2 import FastJSONResponse, ResultPage, SqlResponseV2
+from sql_agent.result_spool import ExpiredCursorError, InvalidCursorError, get_result_spool
+
+# Per-process service metrics (request memory, intermediate step sizes)
+from sql_agent.metrics import get_metrics
+
+# Structured, queue-based logging with request-id correlation
+from sql_agent.logging_config import request_id_var, setup_logging
+
+# Background warm-up of connections, schema, tokens and caches; shared database runtime
+from sql_agent.warmup import get_warmup_scheduler
+from sql_agent.runtime import get_runtime_pool, reset_runtime
+from sql_agent.data_sources import get_data_source
+
+# Asynchronous job mode for long-running questions
+from sql_agent.job_queue import JobQueueFull, get_job_runner, job_response
+
+# Opt-in sampling profiler for single requests and for the whole process
+from sql_agent.profiling import (PROFILE_FORMATS, get_continuous_profiler, get_profile_store, profile_request,
+                                 stop_continuous_profiler)
 
 
 # from fastapi import FastAPI
@@ -12,9 +40,25 @@ from orchestration_service import generate_sql_query
 # from .orchestration_service import generate_sql_query
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+setup_logging()
 logger = logging.getLogger(__name__)
 
+# Warm up the instance in the background at startup (see sql_agent/warmup.py)
+warmup_enabled = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+
+# Profiling surfaces (X-Profile header, /admin/profile...) exist only when enabled, and callers
+# must send PROFILING_ADMIN_TOKEN in the X-Admin-Token header. Profiles expose code paths and
+# timings, so profiling stays off when it is enabled without a token.
+profiling_enabled = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+profiling_admin_token = os.getenv("PROFILING_ADMIN_TOKEN")
+if profiling_enabled and not profiling_admin_token:
+    logger.error("PROFILING_ENABLED is set without PROFILING_ADMIN_TOKEN; profiling stays disabled")
+    profiling_enabled = False
+
+# Rows per page of the v2 results (the request can ask for up to MAX_RESULT_PAGE_SIZE)
+result_page_size = int(os.getenv("RESULT_PAGE_SIZE", "100"))
+MAX_RESULT_PAGE_SIZE = 1000
+
 # Cardinal rule: Keep the endpoint logic separate from the FastAPI application instance.
 # Use this class only to define the FastAPI application instance and the endpoints and receive requests.
 
@@ -28,8 +72,24 @@ logger = logging.getLogger(__name__)
 #   Extensibility: Add more attributes to the request body in the future, without changing 
 #   the endpoint's signature.
 class UserPrompt(BaseModel):
-    # The model has a single attribute 'prompt' which is a string
+    # The model has a 'prompt' attribute which is a string
     prompt: str
+    # Optional conversation session id. Send the same id with follow-up questions
+    # ("now only for 2021") so the agent can refine the previous query.
+    session_id: Optional[str] = None
+    # Optional name of a declared data source (see sql_agent/data_sources.py).
+    # Without it, the question runs against the configured database.
+    data_source: Optional[str] = None
+
+# Request body of POST /generate-sql/jobs. When webhook_url is set, the finished job
+# (same body as GET /jobs/{job_id}) is POSTed there.
+class JobRequest(UserPrompt):
+    webhook_url: Optional[str] = None
+
+# Request body of POST /v2/generate-sql. page_size is the number of result rows in the
+# response (0: none); the rest is read with GET /v2/results.
+class V2Request(UserPrompt):
+    page_size: int = Field(default=result_page_size, ge=0, le=MAX_RESULT_PAGE_SIZE)
 
 logger.info("**** Starting FastAPI application")
 
@@ -38,6 +98,42 @@ logger.info("**** Starting FastAPI application")
 # and routes them to the appropriate endpoint.
 app = FastAPI()
 
+# Every request gets an id: the caller's X-Request-ID header, or a new one.
+# All log records written while handling the request carry it, and it is returned
+# in the X-Request-ID response header so clients can quote it.
+@app.middleware("http")
+async def request_id_middleware(request: Request, call_next):
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    token = request_id_var.set(request_id)
+    try:
+        response = await call_next(request)
+    finally:
+        request_id_var.reset(token)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+def profiling_allowed(request: Request) -> bool:
+    """Whether this request may use the profiling surfaces."""
+    if not profiling_enabled or not profiling_admin_token:
+        return False
+    return hmac.compare_digest(request.headers.get("X-Admin-Token", ""), profiling_admin_token)
+
+def require_profiling(request: Request) -> None:
+    if not profiling_enabled:
+        raise HTTPException(status_code=404, detail="Profiling is disabled.")
+    if not profiling_allowed(request):
+        raise HTTPException(status_code=403, detail="Invalid admin token.")
+
+def profile_response(profiler, profile_format: str):
+    """Render a profile as speedscope JSON or collapsed stacks."""
+    try:
+        profile = profiler.export(profile_format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if profile_format == "collapsed":
+        return PlainTextResponse(profile, headers={"X-Profile-Id": profiler.profile_id})
+    return JSONResponse(content=profile, headers={"X-Profile-Id": profiler.profile_id})
+
 # Log endpoint registration
 logger.info("**** Registering /generate-sql/ endpoint")
 
@@ -46,38 +142,207 @@ logger.info("**** Registering /generate-sql/ endpoint")
 # @app.post("/generate-sql/")
 # def generate_sql(user_prompt: UserPrompt):
 @app.post("/generate-sql/")
-def generate_sql(user_prompt: UserPrompt):
+def generate_sql(user_prompt: UserPrompt, request: Request, response: Response):
     """
     Generate SQL query based on user prompt.
     Parameters:
     - user_prompt (UserPrompt): The user prompt provided in the request body as a JSON object.
     Returns:
     - dict: A JSON response containing the generated SQL query.
+    With an "X-Profile: 1" header (when profiling is enabled), the call runs under the sampling
+    profiler and the X-Profile-Id response header names the profile (GET /admin/profiles/{id}).
     """
     logger.info("**** Entered generate_sql endpoint with user_prompt: %s", user_prompt)
 
     try:
         # Call the generate_sql_query function with the prompt from the request body
-        SqlResponse = generate_sql_query(user_prompt.prompt)
-        logger.info("Generated SQL query: %s", SqlResponse)
+        if request.headers.get("X-Profile") and profiling_allowed(request):
+            with profile_request() as profiler:
+                response.headers["X-Profile-Id"] = profiler.profile_id
+                SqlResponse = generate_sql_query(user_prompt.prompt, session_id=user_prompt.session_id,
+                                                 data_source=user_prompt.data_source)
+        else:
+            SqlResponse = generate_sql_query(user_prompt.prompt, session_id=user_prompt.session_id,
+                                             data_source=user_prompt.data_source)
+        logger.debug("Generated SQL query: %s", SqlResponse)
         # Return the generated SQL query in a JSON response
         return {"SqlResponse": SqlResponse}
     except ValueError as e:
         logger.error("ValueError in generate_sql: %s", str(e))
         # If a ValueError occurs, return a 400 Bad Request
         raise HTTPException(status_code=400, detail=str(e))
+    except TimeoutError as e:
+        logger.error("TimeoutError in generate_sql: %s", str(e))
+        # The caller stopped waiting for a coalesced request (COALESCE_WAIT_TIMEOUT_SECONDS)
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         logger.error("Exception in generate_sql: %s", str(e))
         # For all other exceptions, return a 500 Internal Server Error
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/v2/generate-sql", response_model=SqlResponseV2, response_class=FastJSONResponse)
+def generate_sql_v2(v2_request: V2Request):
+    """
+    Generate SQL query based on user prompt, with the v2 response contract.
+    Parameters:
+    - v2_request (V2Request): The prompt, optional session id and data source, and the page size.
+    Returns:
+    - SqlResponseV2: Typed answer fields and the first page of the query result; its next_cursor
+      is passed to GET /v2/results for the following pages.
+    """
+    logger.info("**** Entered generate_sql_v2 endpoint with prompt: %s", v2_request.prompt)
+    try:
+        return generate_sql_query_v2(v2_request.prompt, session_id=v2_request.session_id,
+                                     data_source=v2_request.data_source, page_size=v2_request.page_size)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except TimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        logger.error("Exception in generate_sql_v2: %s", str(e))
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/v2/results", response_model=ResultPage, response_class=FastJSONResponse)
+def get_result_page(cursor: str, page_size: int = Query(default=result_page_size, ge=1, le=MAX_RESULT_PAGE_SIZE)):
+    """
+    Return the next page of a v2 query result.
+    Parameters:
+    - cursor (str): The next_cursor of the previous page.
+    Returns:
+    - ResultPage: The rows; next_cursor is None on the last page. 410 once the result has
+      expired (RESULT_SPOOL_TTL_SECONDS), 400 for a cursor this service did not issue.
+    """
+    try:
+        return get_result_spool().read_cursor(cursor, page_size)
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ExpiredCursorError as e:
+        raise HTTPException(status_code=410, detail=str(e))
+
+@app.post("/generate-sql/jobs", status_code=202)
+def submit_generate_sql_job(job_request: JobRequest, request: Request):
+    """
+    Queue a question and return right away; it runs on the job worker pool.
+    Parameters:
+    - job_request (JobRequest): The prompt, an optional session id and an optional webhook URL.
+    Returns:
+    - dict: The job id, its status and the URL to poll.
+    """
+    logger.info("**** Entered submit_generate_sql_job with prompt: %s", job_request.prompt)
+    try:
+        # Unknown data sources are rejected now rather than when the job runs
+        get_data_source(job_request.data_source)
+        job = get_job_runner(generate_sql_query).submit(
+            job_request.prompt, session_id=job_request.session_id, webhook_url=job_request.webhook_url,
+            data_source=job_request.data_source)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return {"job_id": job.job_id, "status": job.status, "status_url": str(request.url_for("get_job", job_id=job.job_id))}
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    """
+    Return the state of a job.
+    Returns:
+    - dict: status (queued, running, succeeded, failed), timestamps, and the SqlResponse or the error.
+    """
+    job = get_job_runner(generate_sql_query).store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job_response(job)
+
+@app.get("/metrics")
+def metrics():
+    """
+    Return the service metrics of this worker process.
+    Returns:
+    - dict: Counters, value summaries (count, sum, avg, max, last), process memory and the
+      per-data-source runtimes (requests, idle time, schema memory, pooled connections).
+    """
+    return dict(get_metrics().snapshot(), runtime_pool=get_runtime_pool().stats())
+
+@app.post("/admin/profile")
+def profile_generate_sql(user_prompt: UserPrompt, request: Request, format: str = "speedscope"):
+    """
+    Run one /generate-sql/ call under the sampling profiler and return its profile.
+    Parameters:
+    - format (str): speedscope (JSON for https://www.speedscope.app) or collapsed (flamegraph.pl).
+    Returns:
+    - The profile; the X-Profile-Id header names it. Errors of the call itself are part of the profile.
+    """
+    require_profiling(request)
+    if format not in PROFILE_FORMATS:
+        raise HTTPException(status_code=400, detail="Use one of: " + ", ".join(PROFILE_FORMATS))
+    with profile_request() as profiler:
+        try:
+            generate_sql_query(user_prompt.prompt, session_id=user_prompt.session_id,
+                               data_source=user_prompt.data_source)
+        except Exception as e:
+            logger.warning("Profiled request failed: %s", e)
+    return profile_response(profiler, format)
+
+@app.get("/admin/profiles/{profile_id}")
+def get_profile(profile_id: str, request: Request, format: str = "speedscope"):
+    """
+    Return a recent request profile (PROFILING_KEEP are kept per worker process).
+    """
+    require_profiling(request)
+    profiler = get_profile_store().get(profile_id)
+    if profiler is None:
+        raise HTTPException(status_code=404, detail="Profile not found.")
+    return profile_response(profiler, format)
+
+@app.get("/admin/profile/continuous")
+def get_continuous_profile(request: Request, format: str = "collapsed", reset: bool = False):
+    """
+    Return the samples of the continuous profiler since it started (or was last reset).
+    Parameters:
+    - reset (bool): Clear the samples after returning them.
+    """
+    require_profiling(request)
+    profiler = get_continuous_profiler()
+    if profiler is None:
+        raise HTTPException(status_code=404, detail="Continuous profiling is disabled (PROFILING_CONTINUOUS).")
+    profile = profile_response(profiler, format)
+    if reset:
+        profiler.reset()
+    return profile
+
+@app.get("/ready")
+def ready():
+    """
+    Readiness probe: route traffic to this instance only once the warm-up has finished.
+    Returns:
+    - JSONResponse: 200 with the warm-up status when ready, 503 while warming up.
+    """
+    if not warmup_enabled:
+        return {"status": "ready", "warmup": "disabled"}
+    warmup_status = get_warmup_scheduler().status()
+    if warmup_status["state"] == "ready":
+        return {"status": "ready", "warmup": warmup_status}
+    return JSONResponse(status_code=503, content={"status": "warming_up", "warmup": warmup_status})
+
 @app.on_event("shutdown")
 async def shutdown_event():
-    print("Application shutdown")
+    logger.info("Application shutdown")
+    if warmup_enabled:
+        # Stops the background upkeep and saves the recent question log for the next instance
+        get_warmup_scheduler().stop()
+    get_job_runner(generate_sql_query).shutdown()
+    stop_continuous_profiler()
+    reset_runtime()
 
 @app.on_event("startup")
 async def startup_event():
-    print("**** Starting the API")
+    logger.info("**** Starting the API")
+    if warmup_enabled:
+        # Runs on a background thread: the server accepts requests (and probes) immediately
+        get_warmup_scheduler().start()
+    if profiling_enabled:
+        # Starts the low-rate sampler when PROFILING_CONTINUOUS is on
+        get_continuous_profiler()
 
     # try:
     #     # Call the generate_sql_query function with the prompt from the request body
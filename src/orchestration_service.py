@@ -1,18 +1,43 @@
+import os
 import logging
 
+from fastapi.responses import JSONResponse
+
 # # Import the sql_flow_function from the sql_flow_service module
 # from .sql_agent.sql_agent_service import sql_flow_function
 # from .sql_agent.prompts import MSSQL_AGENT_PREFIX
 
 # Use absolute imports instead of relative imports
-from sql_agent.sql_agent_service import sql_flow_function
+from sql_agent.sql_agent_service import SqlAnswer, answer_question, build_sql_response
+from sql_agent.response_v2 import SqlResponseV2, build_v2_response
 from sql_agent.prompts import MSSQL_AGENT_PREFIX
 
+# Single-flight coalescing of identical in-flight questions
+from sql_agent.single_flight import get_single_flight
+from sql_agent.question_log import normalize_question
+from sql_agent.profiling import current_profile
+
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging (structured, queue-based; see sql_agent/logging_config.py)
+from sql_agent.logging_config import setup_logging
+setup_logging()
 logger = logging.getLogger(__name__)
 
+# Identical standalone questions asked at the same time share one agent run (see
+# sql_agent/single_flight.py). Off by default (COALESCE_REQUESTS=true turns it on).
+# The shared runs execute on the coalescer's own pool while each caller keeps its request thread
+# blocked waiting, so a coalesced run holds two threads. The pool defaults to the size of the
+# request threadpool (anyio's default limiter, 40 threads): there are never more leaders than
+# request threads, so a larger pool would sit idle.
+# COALESCE_WAIT_TIMEOUT_SECONDS bounds how long a caller waits (0 = until the run finishes).
+# A run is cancelled once every caller has left, and a caller only leaves by timing out: a client
+# that disconnects does not stop its request thread. So without a timeout, runs are never
+# cancelled and always finish. Cancellation also waits for the run's next LLM or tool call; a
+# query or model call already in progress completes first.
+coalesce_requests = os.getenv("COALESCE_REQUESTS", "false").lower() == "true"
+coalesce_wait_timeout = float(os.getenv("COALESCE_WAIT_TIMEOUT_SECONDS", "0")) or None
+coalesce_max_workers = int(os.getenv("COALESCE_MAX_WORKERS", "40"))
+
 # This is a an orchestrator class. It's a design pattern used to manage and coordinate
 # the flow of data and control between different components or services in an application. 
 # It provides:
@@ -21,24 +46,47 @@ logger = logging.getLogger(__name__)
 #   - A clear separation of concerns between different parts of the application.
 #   - A way to improve code readability, maintainability, and scalability.
 
+def answer_prompt(prompt: str, session_id: str = None, data_source: str = None) -> SqlAnswer:
+    """Answer a prompt, sharing the run with identical standalone questions in flight."""
+    # Session follow-ups depend on (and update) their session, so they are never coalesced.
+    # Profiled requests run on their own, so the profile holds their own samples.
+    if coalesce_requests and not session_id and current_profile() is None:
+        key = (data_source or "default", normalize_question(prompt))
+        return get_single_flight(coalesce_max_workers).do(
+            key, answer_question, prompt, data_source=data_source, timeout=coalesce_wait_timeout)
+    return answer_question(prompt, session_id=session_id, data_source=data_source)
+
 # This function takes a natural language prompt as input and generates an SQL query.
 # It leverages the nl2sql_function to perform the conversion from natural language to SQL.
 # The generated SQL query is returned as a string.
-def generate_sql_query(prompt: str) -> str:
+def generate_sql_query(prompt: str, session_id: str = None, data_source: str = None) -> JSONResponse:
     """
-    Generate an SQL query based on a natural language prompt.
+    Generate an SQL query based on a natural language prompt (v1 response contract).
 
     Parameters:
     - prompt (str): The natural language prompt provided by the user.
+    - session_id (str): Optional conversation session id. Follow-up questions in the
+      same session reuse the previous query instead of re-planning.
+    - data_source (str): Optional name of a declared data source (see sql_agent/data_sources.py).
 
     Returns:
-    - str: The generated SQL query as a string.
+    - JSONResponse: The SqlResponseModel body (see readme.md).
     """
 
     logger.info("Entered generate_sql_query with prompt: %s", prompt)
 
-    # Call the sql_flow_function with the provided prompt and return the result
-    SqlResponse = sql_flow_function(prompt)
-    logger.info("Generated SQL query: %s", SqlResponse)
+    SqlResponse = JSONResponse(content=build_sql_response(answer_prompt(prompt, session_id, data_source)))
+    logger.debug("Generated SQL query: %s", SqlResponse)
     return SqlResponse
+
+def generate_sql_query_v2(prompt: str, session_id: str = None, data_source: str = None,
+                          page_size: int = 100) -> SqlResponseV2:
+    """
+    Answer a prompt with the v2 response contract: typed fields and the first page of the query result.
+
+    Parameters:
+    - page_size (int): Rows in the first result page; the page's next_cursor leads to the rest.
+    """
+    logger.info("Entered generate_sql_query_v2 with prompt: %s", prompt)
+    return build_v2_response(answer_prompt(prompt, session_id, data_source), data_source, page_size)
   
\ No newline at end of file
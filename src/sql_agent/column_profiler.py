@@ -0,0 +1,143 @@
+import os
+import time
+import logging
+import argparse
+
+from dotenv import load_dotenv
+from sqlalchemy import MetaData, Table, distinct, func, inspect, select
+from sqlalchemy.sql import sqltypes
+
+from sql_agent.db_connection import create_read_only_engine, get_database_name
+from sql_agent.schema_cache import save_cache
+
+logger = logging.getLogger(__name__)
+
+# Offline profiling job for filter grounding.
+# Before answering, the agent often ran exploratory SELECT DISTINCT queries to discover valid
+# filter values (state codes, ownership types, ...). This job computes, once, per column:
+#   - row count, null ratio and cardinality (distinct count)
+#   - min/max for numeric and date/time columns
+#   - the top-K most frequent values for low-cardinality columns
+# The result is written next to the reflected schema in the schema cache, and the agent reads
+# it through the sql_db_column_values tool without touching the database at question time.
+#
+# Run it from the src folder:
+#   python -m sql_agent.column_profiler --top-k 25 --max-distinct 100
+
+_ORDERABLE_TYPES = (sqltypes.Integer, sqltypes.Numeric, sqltypes.Float,
+                    sqltypes.Date, sqltypes.DateTime, sqltypes.Time)
+_UNGROUPABLE_TYPES = (sqltypes.LargeBinary, sqltypes.JSON)
+# Dialects whose unbounded character types are large objects: SQL Server TEXT / NTEXT / XML and
+# (N)VARCHAR(MAX), Oracle CLOB. Elsewhere (SQLite TEXT, PostgreSQL text, DuckDB VARCHAR) an
+# unbounded string is an ordinary column, and its distinct count decides whether values are kept.
+_LOB_DIALECTS = ("mssql", "oracle")
+
+
+def _is_groupable(column_type, dialect_name: str = None) -> bool:
+    if isinstance(column_type, _UNGROUPABLE_TYPES):
+        return False
+    if dialect_name in _LOB_DIALECTS and isinstance(column_type, sqltypes.String):
+        # Large objects cannot (or should not) be grouped
+        return not (isinstance(column_type, sqltypes.Text) or column_type.length is None or column_type.length > 4000)
+    return True
+
+
+def profile_table(engine, table: Table, top_k: int = 20, max_distinct: int = 50) -> dict:
+    """
+    Profile every column of one table.
+
+    Parameters:
+    - engine (Engine): SQLAlchemy engine.
+    - table (Table): The reflected table.
+    - top_k (int): Number of most frequent values stored for low-cardinality columns.
+    - max_distinct (int): Columns with at most this many distinct values are treated as low-cardinality.
+
+    Returns:
+    - dict: {"row_count": int, "columns": {column_name: profile}}
+    """
+    with engine.connect() as connection:
+        row_count = connection.execute(select(func.count()).select_from(table)).scalar() or 0
+        columns = {}
+        for column in table.columns:
+            profile = {"type": str(column.type)}
+            try:
+                groupable = _is_groupable(column.type, engine.dialect.name)
+                aggregates = [func.count(column)]
+                if groupable:
+                    aggregates.append(func.count(distinct(column)))
+                orderable = isinstance(column.type, _ORDERABLE_TYPES)
+                if orderable:
+                    aggregates.extend([func.min(column), func.max(column)])
+
+                values = connection.execute(select(*aggregates).select_from(table)).one()
+                non_null = values[0] or 0
+                profile["null_ratio"] = round(1 - non_null / row_count, 4) if row_count else 0.0
+                if groupable:
+                    profile["cardinality"] = values[1]
+                if orderable:
+                    profile["min"], profile["max"] = values[-2], values[-1]
+
+                # Value dictionary for low-cardinality columns
+                if groupable and values[1] is not None and values[1] <= max_distinct:
+                    frequency = func.count().label("frequency")
+                    top_values = connection.execute(
+                        select(column, frequency)
+                        .where(column.isnot(None))
+                        .group_by(column)
+                        .order_by(frequency.desc())
+                        .limit(top_k)
+                    ).all()
+                    profile["top_values"] = [[value, count] for value, count in top_values]
+            except Exception as e:
+                # One odd column type must not fail the whole job
+                logger.warning("Could not profile %s.%s: %s", table.name, column.name, e)
+                connection.rollback()
+            columns[column.name] = profile
+    return {"row_count": row_count, "columns": columns}
+
+
+def profile_database(engine, database: str, tables: list = None, top_k: int = 20, max_distinct: int = 50) -> dict:
+    """
+    Profile the tables of a database and store the result in the schema cache.
+
+    Parameters:
+    - engine (Engine): SQLAlchemy engine.
+    - database (str): Name used for the cache files.
+    - tables (list): Tables to profile. Defaults to every table in the default schema.
+    - top_k (int): Number of most frequent values stored for low-cardinality columns.
+    - max_distinct (int): Cardinality threshold for storing a value dictionary.
+
+    Returns:
+    - dict: The column statistics that were saved.
+    """
+    inspector = inspect(engine)
+    table_names = tables or inspector.get_table_names()
+    metadata = MetaData()
+
+    schema = {}
+    stats = {"generated_at": time.time(), "top_k": top_k, "max_distinct": max_distinct, "tables": {}}
+    for table_name in table_names:
+        logger.info("Profiling table %s", table_name)
+        table = Table(table_name, metadata, autoload_with=engine)
+        schema[table_name] = {column.name: str(column.type) for column in table.columns}
+        stats["tables"][table_name] = profile_table(engine, table, top_k=top_k, max_distinct=max_distinct)
+
+    save_cache(database, "schema", {"generated_at": stats["generated_at"], "tables": schema})
+    save_cache(database, "column_stats", stats)
+    return stats
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    # Same credentials file as the service
+    load_dotenv(os.path.join(os.path.dirname(__file__), 'credentials.env'))
+
+    parser = argparse.ArgumentParser(description="Precompute column statistics and value dictionaries.")
+    parser.add_argument("--tables", nargs="*", help="Tables to profile (default: all)")
+    parser.add_argument("--top-k", type=int, default=20, help="Values stored per low-cardinality column")
+    parser.add_argument("--max-distinct", type=int, default=50, help="Cardinality threshold for value dictionaries")
+    args = parser.parse_args()
+
+    profile_database(create_read_only_engine(), get_database_name(),
+                     tables=args.tables, top_k=args.top_k, max_distinct=args.max_distinct)
@@ -0,0 +1,81 @@
+import logging
+from typing import Optional
+
+from langchain_core.callbacks import CallbackManagerForToolRun
+from langchain_core.pydantic_v1 import Field
+from langchain_core.tools import BaseTool
+
+from sql_agent.schema_cache import load_cache
+
+logger = logging.getLogger(__name__)
+
+# Agent tool over the precomputed column statistics (see column_profiler.py).
+# It answers "which values can I filter on?" from the schema cache, so the agent does not
+# need exploratory SELECT DISTINCT queries. It never touches the database.
+
+
+def load_column_stats(database: str) -> Optional[dict]:
+    """Load the column statistics for a database from the schema cache."""
+    return load_cache(database, "column_stats")
+
+
+def describe_column(table: str, column: str, profile: dict) -> str:
+    """Render one column profile as a single compact line."""
+    parts = ["{}.{} ({})".format(table, column, profile.get("type", "?"))]
+    if "cardinality" in profile:
+        parts.append("{} distinct".format(profile["cardinality"]))
+    if "null_ratio" in profile:
+        parts.append("{:.1%} null".format(profile["null_ratio"]))
+    if profile.get("min") is not None:
+        parts.append("min {} / max {}".format(profile["min"], profile["max"]))
+    if profile.get("top_values"):
+        parts.append("values: " + ", ".join("{!r} ({})".format(value, count) for value, count in profile["top_values"]))
+    return "; ".join(parts)
+
+
+class ColumnStatsLookupTool(BaseTool):
+    """Tool for looking up precomputed column statistics and valid filter values."""
+
+    name: str = "sql_db_column_values"
+    description: str = (
+        "Input is a comma-separated list of columns written as table.column, or a table name for all of its columns. "
+        "Output is precomputed statistics for each column: distinct count, null ratio, min/max and, for "
+        "low-cardinality columns, the valid values with their frequency. "
+        "Use this tool instead of SELECT DISTINCT queries to find the exact values to filter on."
+    )
+    column_stats: dict = Field(default_factory=dict, exclude=True)
+
+    def _resolve_table(self, name: str) -> Optional[str]:
+        # Case-insensitive, with or without a schema prefix (dbo.loans -> loans)
+        table_lookup = {table.lower(): table for table in self.column_stats.get("tables", {})}
+        name = name.lower()
+        return table_lookup.get(name) or table_lookup.get(name.split(".")[-1])
+
+    def _run(self, tool_input: str, run_manager: Optional[CallbackManagerForToolRun] = None) -> str:
+        tables = self.column_stats.get("tables", {})
+        lines = []
+        for item in (part.strip() for part in tool_input.split(",")):
+            item = item.replace("[", "").replace("]", "").replace('"', "").replace("`", "")
+            if not item:
+                continue
+
+            # A bare table name (optionally schema-qualified) returns every column
+            table_name = self._resolve_table(item)
+            if table_name is not None:
+                lines.extend(describe_column(table_name, column, profile)
+                             for column, profile in tables[table_name]["columns"].items())
+                continue
+
+            table_part, _, column_part = item.rpartition(".")
+            table_name = self._resolve_table(table_part) if table_part else None
+            if table_name is None:
+                lines.append("{}: no statistics available (unknown table).".format(item))
+                continue
+            columns = tables[table_name]["columns"]
+            column_lookup = {name.lower(): name for name in columns}
+            column_name = column_lookup.get(column_part.lower())
+            if column_name is None:
+                lines.append("{}: no statistics available (unknown column).".format(item))
+            else:
+                lines.append(describe_column(table_name, column_name, columns[column_name]))
+        return "\n".join(lines) or "No columns requested."
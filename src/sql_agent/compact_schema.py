@@ -0,0 +1,161 @@
+import hashlib
+import logging
+import threading
+from decimal import Decimal
+
+from sqlalchemy import select
+from sqlalchemy import types as sqltypes
+from tiktoken import encoding_for_model
+
+logger = logging.getLogger(__name__)
+
+# Compact schema rendering for the agent context (SCHEMA_RENDERING=compact).
+# The toolkit's schema tool (sql_db_schema) returns the full CREATE TABLE DDL of every table the
+# agent inspects, followed by sample rows. Most of those tokens are verbose type names,
+# constraints, defaults and long sample values the model does not need to write a query. The
+# compact rendering keeps what query writing depends on:
+#   TABLE loans (loan_id int PK, home_ownership str, state str, credit_score int, loan_amount dec)
+#     FK customer_id -> customers.id
+#     e.g. home_ownership: RENT | OWN | MORTGAGE; state: CA | TX
+#   - short type codes (int, dec, float, str, date, ts, bool, ...)
+#   - primary keys and foreign-key relationships only (no nullability, defaults or checks)
+#   - sample values per text/date/boolean column, deduplicated and truncated
+#   - identifiers quoted the dialect's way when they need it (e.g., [Loan Amount] on SQL Server)
+# Renderings are cached per table and schema version: the fingerprint of the reflected columns,
+# types and keys. A changed table gets a new fingerprint and is rendered again.
+# benchmarks/schema_tokens.py measures the token savings against the full rendering.
+
+# Most specific first: Float is a Numeric, DateTime is not a Date
+_TYPE_CODES = (
+    (sqltypes.Boolean, "bool"),
+    (sqltypes.Integer, "int"),
+    (sqltypes.Float, "float"),
+    (sqltypes.Numeric, "dec"),
+    (sqltypes.DateTime, "ts"),
+    (sqltypes.Date, "date"),
+    (sqltypes.Time, "time"),
+    (sqltypes.String, "str"),
+    (sqltypes.LargeBinary, "bin"),
+    (sqltypes.Uuid, "uuid"),
+    (sqltypes.JSON, "json"),
+)
+
+# Sample values are not shown for these codes: a few numbers say little about a column.
+# Numeric values of columns with other types (e.g., untyped SQLite columns) are skipped too.
+_NO_SAMPLE_CODES = {"int", "float", "dec", "bin", "uuid"}
+
+
+def short_type(column_type) -> str:
+    """Short type code of a SQLAlchemy column type (e.g., NVARCHAR(255) -> str)."""
+    for type_class, code in _TYPE_CODES:
+        if isinstance(column_type, type_class):
+            return code
+    return type(column_type).__name__.lower()
+
+
+def table_fingerprint(table) -> str:
+    """Schema version of a reflected table: a hash of its columns, types and keys."""
+    parts = [table.name]
+    for column in table.columns:
+        parts.append("{}:{}:{}".format(column.name, short_type(column.type), column.primary_key))
+        parts.extend(sorted(foreign_key.target_fullname for foreign_key in column.foreign_keys))
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def _truncate(value, max_chars: int) -> str:
+    text = " ".join(str(value).split())
+    return text if len(text) <= max_chars else text[:max_chars - 1] + "…"
+
+
+def sample_values(rows: list, column_name: str, max_values: int = 3, max_chars: int = 20) -> list:
+    """Distinct, truncated, non-empty, non-numeric values of one column, in first-seen order."""
+    values = []
+    for row in rows:
+        value = row.get(column_name)
+        if value is None or value == "" or isinstance(value, (int, float, Decimal)):
+            continue
+        text = _truncate(value, max_chars)
+        if text not in values:
+            values.append(text)
+        if len(values) == max_values:
+            break
+    return values
+
+
+def render_table(table, rows: list, quote=lambda name: name, max_values: int = 3, max_chars: int = 20) -> str:
+    """
+    Render one reflected table compactly.
+
+    Parameters:
+    - table (Table): A reflected SQLAlchemy table.
+    - rows (list): Sample rows as dictionaries (may be empty).
+    - quote (callable): Quotes identifiers that need it, e.g. the dialect's identifier preparer.
+
+    Returns:
+    - str: The table line, its foreign keys and its sample values.
+    """
+    columns = []
+    relationships = []
+    samples = []
+    for column in table.columns:
+        if isinstance(column.type, sqltypes.NullType):
+            # Untyped columns are left out, as in the full rendering
+            continue
+        code = short_type(column.type)
+        columns.append("{} {}{}".format(quote(column.name), code, " PK" if column.primary_key else ""))
+        for foreign_key in sorted(column.foreign_keys, key=lambda key: key.target_fullname):
+            relationships.append("{} -> {}".format(quote(column.name), foreign_key.target_fullname))
+        if code not in _NO_SAMPLE_CODES and not column.primary_key:
+            values = sample_values(rows, column.name, max_values, max_chars)
+            if values:
+                samples.append("{}: {}".format(quote(column.name), " | ".join(values)))
+
+    lines = ["TABLE {} ({})".format(quote(table.name), ", ".join(columns))]
+    if relationships:
+        lines.append("  FK " + ", ".join(relationships))
+    if samples:
+        lines.append("  e.g. " + "; ".join(samples))
+    return "\n".join(lines)
+
+
+class CompactSchemaRenderer:
+    """Renders and caches compact table descriptions for one SQLDatabase."""
+
+    def __init__(self, max_values: int = 3, max_chars: int = 20):
+        self.max_values = max_values
+        self.max_chars = max_chars
+        # (table name, fingerprint) -> rendering
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _sample_rows(self, db, table) -> list:
+        sample_count = getattr(db, "_sample_rows_in_table_info", 3)
+        if not sample_count:
+            return []
+        try:
+            # Built by us, so it is read-only by construction; runs through the sandbox
+            return db._execute(select(table).limit(sample_count), fetch="all")
+        except Exception as e:
+            logger.warning("Could not read sample rows of %s: %s", table.name, e)
+            return []
+
+    def render(self, db, tables: list) -> str:
+        """Render the given reflected tables, reusing cached renderings of unchanged tables."""
+        quote = db._engine.dialect.identifier_preparer.quote
+        renderings = []
+        for table in tables:
+            key = (table.name, table_fingerprint(table))
+            with self._lock:
+                rendering = self._cache.get(key)
+            if rendering is None:
+                rendering = render_table(table, self._sample_rows(db, table), quote,
+                                         self.max_values, self.max_chars)
+                with self._lock:
+                    self._cache[key] = rendering
+            renderings.append(rendering)
+        return "\n\n".join(renderings)
+
+
+def count_tokens(text: str, model: str = "gpt-4") -> int:
+    """Number of tokens of a text for a model, with tiktoken (as in sql_agent_service.py)."""
+    return len(encoding_for_model(model).encode(text))
@@ -0,0 +1,99 @@
+import os
+import json
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+from sql_agent.db_backends import BACKENDS, get_backend
+from sql_agent.replica_routing import get_replica_urls
+
+logger = logging.getLogger(__name__)
+
+# Named data sources, so one process can serve several databases.
+# A request may carry a data_source name; without one it goes to the "default" data source,
+# which is the database configured through the environment (DB_BACKEND, SQL_SERVER_DATABASE, ...).
+# Other data sources are declared in a JSON file (DATA_SOURCES_PATH), for example:
+#   {
+#       "contoso":  {"backend": "azure_sql", "database": "contoso-db",
+#                    "replica_urls": ["mssql+pyodbc://...contoso-replica..."]},
+#       "fabrikam": {"backend": "azure_sql_token", "database": "fabrikam-db"},
+#       "local":    {"backend": "sqlite", "database": "/data/local.db"}
+#   }
+# Server names and credentials still come from the backend's environment variables; the entry
+# only selects the backend, the database on it and, optionally, readable replicas (see
+# replica_routing.py; the default data source uses REPLICA_URLS). Only declared data sources
+# can be used, so a caller cannot point the service at an arbitrary database.
+# Each data source gets its own engine and schema cache in the runtime pool (runtime.py).
+
+DEFAULT_DATA_SOURCE = "default"
+
+
+@dataclass(frozen=True)
+class DataSource:
+    """A backend, a database on it and its readable replicas."""
+    name: str
+    backend_name: str
+    database: Optional[str] = None
+    replica_urls: tuple = ()
+
+    @property
+    def backend(self):
+        return get_backend(self.backend_name)
+
+    @property
+    def is_default(self) -> bool:
+        return self.name == DEFAULT_DATA_SOURCE
+
+    def database_name(self) -> str:
+        """Name used to key the caches (schema, column statistics) of this data source."""
+        return self.backend.database_name(self.database)
+
+
+def load_data_sources(path: str) -> dict:
+    """Read the data source declarations from a JSON file."""
+    with open(path, "r", encoding="utf-8") as f:
+        declarations = json.load(f)
+    data_sources = {}
+    for name, declaration in declarations.items():
+        backend_name = declaration.get("backend") or get_backend().name
+        if backend_name not in BACKENDS:
+            raise ValueError("Data source '{}' uses the unknown backend '{}'.".format(name, backend_name))
+        data_sources[name] = DataSource(name, backend_name, declaration.get("database"),
+                                        tuple(declaration.get("replica_urls", ())))
+    return data_sources
+
+
+_data_sources = None
+_data_sources_lock = threading.Lock()
+
+
+def get_data_sources() -> dict:
+    """Return the declared data sources by name, including "default"."""
+    global _data_sources
+    with _data_sources_lock:
+        if _data_sources is None:
+            path = os.getenv("DATA_SOURCES_PATH")
+            data_sources = load_data_sources(path) if path else {}
+            data_sources[DEFAULT_DATA_SOURCE] = DataSource(DEFAULT_DATA_SOURCE, get_backend().name,
+                                                           replica_urls=tuple(get_replica_urls()))
+            logger.info("Data sources: %s", ", ".join(sorted(data_sources)))
+            _data_sources = data_sources
+        return _data_sources
+
+
+def get_data_source(name: str = None) -> DataSource:
+    """
+    Resolve a data source name.
+
+    Parameters:
+    - name (str): A declared data source. None selects the default data source.
+
+    Returns:
+    - DataSource: Raises ValueError for names that are not declared.
+    """
+    data_sources = get_data_sources()
+    name = name or DEFAULT_DATA_SOURCE
+    if name not in data_sources:
+        raise ValueError("Unknown data source '{}'.".format(name))
+    return data_sources[name]
@@ -0,0 +1,344 @@
+import os
+import struct
+import logging
+import importlib.util
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.pool import StaticPool
+
+from sql_agent.file_sources import create_file_engine, file_sources_changed, get_file_source_paths
+from sql_agent.token_cache import get_token_provider
+
+logger = logging.getLogger(__name__)
+
+# Registry of database backends, selected by configuration (DB_BACKEND).
+# Each backend knows:
+#   - how to build its connection URL and which login to use,
+#   - the fastest DBAPI driver that is installed for it,
+#   - its connection pool defaults,
+#   - dialect hints that are added to the agent prompt.
+# Backends:
+#   azure_sql        Azure SQL with SQL login (user name and password)
+#   azure_sql_token  Azure SQL with an Entra ID access token (DefaultAzureCredential)
+#   fabric           Fabric SQL endpoint with an Entra ID access token
+#   postgresql       PostgreSQL (psycopg 3, psycopg2 or pg8000, whichever is installed first)
+#   sqlite           SQLite file, handy for local testing
+#   duckdb           Local CSV/Parquet files mounted in DuckDB (see file_sources.py)
+# Pool settings can be overridden with DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT and DB_POOL_RECYCLE.
+# The database can be passed explicitly (see data_sources.py) so one backend configuration serves
+# several databases on the same server; it defaults to the configured one. A replica URL
+# (replica_routing.py) only moves the engine to another host, port or database: the driver, the
+# read-only login and the token injection stay the backend's.
+
+BACKENDS = {}
+
+# Connection option for access tokens, as defined in msodbcsql.h
+SQL_COPT_SS_ACCESS_TOKEN = 1256
+
+
+def register_backend(backend_class):
+    """Class decorator that adds a backend to the registry under its name."""
+    BACKENDS[backend_class.name] = backend_class()
+    return backend_class
+
+
+def _first_installed(candidates: tuple) -> str:
+    for module_name in candidates:
+        if importlib.util.find_spec(module_name) is not None:
+            return module_name
+    # Nothing installed: return the preferred driver so the error names it
+    return candidates[0]
+
+
+class DatabaseBackend:
+    """Base class for a database backend."""
+
+    name = ""
+    # DBAPI modules in order of preference (fastest first)
+    driver_candidates = ()
+    pool_options = {"pool_size": 5, "max_overflow": 10, "pool_timeout": 30, "pool_recycle": 1800, "pool_pre_ping": True}
+    dialect_hints = ""
+    # Whether the server routes ApplicationIntent=ReadOnly connections to a readable secondary
+    supports_application_intent = False
+
+    def select_driver(self) -> str:
+        """Return the DBAPI driver to use: DB_DRIVER if set, else the fastest installed one."""
+        return os.getenv("DB_DRIVER") or _first_installed(self.driver_candidates)
+
+    def database_name(self, database: str = None) -> str:
+        raise NotImplementedError
+
+    def build_url(self, read_only: bool = True, database: str = None) -> URL:
+        raise NotImplementedError
+
+    def engine_options(self, url: URL = None) -> dict:
+        options = dict(self.pool_options)
+        for option, variable in (("pool_size", "DB_POOL_SIZE"), ("max_overflow", "DB_MAX_OVERFLOW"),
+                                 ("pool_timeout", "DB_POOL_TIMEOUT"), ("pool_recycle", "DB_POOL_RECYCLE")):
+            if os.getenv(variable) and option in options:
+                options[option] = int(os.environ[variable])
+        return options
+
+    def configure_engine(self, engine) -> None:
+        """Hook for backend-specific engine events (e.g., token injection)."""
+
+    def engine_is_stale(self) -> bool:
+        """True when a long-lived engine must be recreated (e.g., its data files were rebuilt)."""
+        return False
+
+    def create_engine(self, read_only: bool = True, database: str = None, application_intent: str = None,
+                      replica_url: str = None):
+        url = self.build_url(read_only, database)
+        if replica_url:
+            url = at_replica(url, replica_url)
+        if application_intent:
+            # Read-replica routing (see replica_routing.py)
+            if not self.supports_application_intent:
+                raise ValueError("The {} backend does not support ApplicationIntent.".format(self.name))
+            url = url.update_query_dict({"ApplicationIntent": application_intent})
+        engine = create_engine(url, **self.engine_options(url))
+        self.configure_engine(engine)
+        return engine
+
+
+def at_replica(url: URL, replica_url: str) -> URL:
+    """
+    Point a backend URL at a replica, keeping the backend's driver and login.
+
+    Parameters:
+    - url (URL): The URL built by the backend.
+    - replica_url (str): SQLAlchemy URL of the replica; its host, port, database and query options are used,
+      its user name and password are not.
+
+    Returns:
+    - URL: The backend URL on the replica's server.
+    """
+    replica = make_url(replica_url)
+    if replica.get_backend_name() != url.get_backend_name():
+        raise ValueError("Replica {} is not a {} database.".format(
+            replica.render_as_string(hide_password=True), url.get_backend_name()))
+    if replica.username:
+        logger.warning("The login of replica %s is ignored; replicas use the backend's read-only login.",
+                       replica.render_as_string(hide_password=True))
+    url = url.set(host=replica.host or url.host, port=replica.port or url.port,
+                  database=replica.database or url.database)
+    return url.update_query_dict(dict(replica.query)) if replica.query else url
+
+
+def get_db_credentials(read_only: bool = True) -> tuple:
+    """
+    Resolve the SQL login used by the service.
+
+    Parameters:
+    - read_only (bool): When True, prefer the low-privilege login defined by
+      SQL_SERVER_READONLY_USERNAME / SQL_SERVER_READONLY_PASSWORD.
+
+    Returns:
+    - tuple: (username, password)
+    """
+    if read_only and os.getenv("SQL_SERVER_READONLY_USERNAME"):
+        return os.environ["SQL_SERVER_READONLY_USERNAME"], os.environ["SQL_SERVER_READONLY_PASSWORD"]
+
+    if read_only:
+        # Fall back to the main login, but make it visible: the sandbox still blocks
+        # writes, yet the database itself no longer enforces it.
+        logger.warning("SQL_SERVER_READONLY_USERNAME is not set. Agent queries will run with the main SQL login.")
+
+    return os.environ["SQL_SERVER_USERNAME"], os.environ["SQL_SERVER_PASSWORD"]
+
+
+_MSSQL_HINTS = """
+- Use TOP n (not LIMIT) to limit rows. Wrap identifiers that contain spaces in square brackets.
+- Use YEAR(), MONTH(), DATEPART() and CONVERT() for dates; string concatenation uses +.
+"""
+
+
+@register_backend
+class AzureSqlBackend(DatabaseBackend):
+    """Azure SQL Database with a SQL login."""
+
+    name = "azure_sql"
+    driver_candidates = ("pyodbc",)
+    dialect_hints = _MSSQL_HINTS
+    supports_application_intent = True
+    default_odbc_driver = "ODBC Driver 17 for SQL Server"
+
+    def database_name(self, database: str = None) -> str:
+        return database or os.environ["SQL_SERVER_DATABASE"]
+
+    def build_url(self, read_only: bool = True, database: str = None) -> URL:
+        username, password = get_db_credentials(read_only)
+
+        # Configuration for the database connection
+        db_config = {
+            'drivername': 'mssql+' + self.select_driver(),
+            'username': username + '@' + os.environ["SQL_SERVER_NAME"],
+            'password': password,
+            'host': os.environ["SQL_SERVER_NAME"],
+            'port': 1433,
+            'database': self.database_name(database),
+            'query': {'driver': os.getenv("SQL_ODBC_DRIVER", self.default_odbc_driver)},
+        }
+
+        # Create a URL object for connecting to the database
+        return URL.create(**db_config)
+
+
+def get_sql_access_token(scope: str) -> str:
+    """Return a cached Entra ID access token for the SQL endpoint (see token_cache.py)."""
+    return get_token_provider(scope).get_token()
+
+
+def pack_access_token(token: str) -> bytes:
+    """Pack an access token into the structure expected by SQL_COPT_SS_ACCESS_TOKEN."""
+    raw_token = token.encode("utf-16-le")
+    return struct.pack(f"<I{len(raw_token)}s", len(raw_token), raw_token)
+
+
+@register_backend
+class AzureSqlTokenBackend(AzureSqlBackend):
+    """Azure SQL Database with an Entra ID (managed identity / DefaultAzureCredential) token."""
+
+    name = "azure_sql_token"
+    default_odbc_driver = "ODBC Driver 18 for SQL Server"
+    default_scope = "https://database.windows.net/.default"
+    # Recycle connections well before the token (about 60 minutes) expires
+    pool_options = dict(DatabaseBackend.pool_options, pool_recycle=2400)
+
+    def token_scope(self) -> str:
+        return os.getenv("SQL_TOKEN_SCOPE", self.default_scope)
+
+    def build_url(self, read_only: bool = True, database: str = None) -> URL:
+        return URL.create(
+            'mssql+' + self.select_driver(),
+            host=os.environ["SQL_SERVER_NAME"],
+            port=1433,
+            database=self.database_name(database),
+            query={'driver': os.getenv("SQL_ODBC_DRIVER", self.default_odbc_driver)},
+        )
+
+    def configure_engine(self, engine) -> None:
+        scope = self.token_scope()
+
+        @event.listens_for(engine, "do_connect")
+        def provide_token(dialect, conn_rec, cargs, cparams):
+            # remove the "Trusted_Connection" parameter that SQLAlchemy adds
+            cargs[0] = cargs[0].replace(";Trusted_Connection=Yes", "")
+            # apply the token to keyword arguments
+            cparams["attrs_before"] = {SQL_COPT_SS_ACCESS_TOKEN: pack_access_token(get_sql_access_token(scope))}
+
+
+@register_backend
+class FabricBackend(AzureSqlTokenBackend):
+    """Microsoft Fabric SQL analytics endpoint / warehouse with an Entra ID token."""
+
+    name = "fabric"
+    default_scope = "https://fabric.microsoft.com/.default"
+
+
+@register_backend
+class PostgresBackend(DatabaseBackend):
+    """PostgreSQL (including Azure Database for PostgreSQL)."""
+
+    name = "postgresql"
+    # psycopg 3 first: binary protocol and server-side prepared statements
+    driver_candidates = ("psycopg", "psycopg2", "pg8000")
+    dialect_hints = """
+- Use LIMIT n to limit rows. Wrap identifiers that contain upper case or spaces in double quotes.
+- Use EXTRACT(YEAR FROM col) or date_trunc() for dates and ILIKE for case-insensitive matching.
+"""
+
+    def database_name(self, database: str = None) -> str:
+        return database or os.environ["POSTGRES_DATABASE"]
+
+    def build_url(self, read_only: bool = True, database: str = None) -> URL:
+        username = os.getenv("POSTGRES_READONLY_USERNAME") if read_only else None
+        password = os.getenv("POSTGRES_READONLY_PASSWORD") if username else None
+        return URL.create(
+            'postgresql+' + self.select_driver(),
+            username=username or os.environ["POSTGRES_USERNAME"],
+            password=password or os.environ.get("POSTGRES_PASSWORD"),
+            host=os.getenv("POSTGRES_HOST", "localhost"),
+            port=int(os.getenv("POSTGRES_PORT", "5432")),
+            database=self.database_name(database),
+        )
+
+
+@register_backend
+class SqliteBackend(DatabaseBackend):
+    """SQLite database file, mainly for local development and tests."""
+
+    name = "sqlite"
+    driver_candidates = ("pysqlite",)
+    pool_options = {"pool_size": 5, "max_overflow": 10, "pool_pre_ping": False}
+    dialect_hints = """
+- Use LIMIT n to limit rows. Dates are stored as text; use strftime('%Y', col) to extract parts of a date.
+"""
+
+    def select_driver(self) -> str:
+        # pysqlite ships with Python (the module is sqlite3)
+        return os.getenv("DB_DRIVER", "pysqlite")
+
+    def database_name(self, database: str = None) -> str:
+        # For SQLite, the database is the path of the file
+        return os.path.splitext(os.path.basename(database or os.environ["SQLITE_DATABASE_PATH"]))[0]
+
+    def build_url(self, read_only: bool = True, database: str = None) -> URL:
+        return URL.create('sqlite+' + self.select_driver(), database=database or os.environ["SQLITE_DATABASE_PATH"])
+
+    def engine_options(self, url: URL = None) -> dict:
+        if url is not None and (url.database in (None, "", ":memory:") or url.query.get("mode") == "memory"):
+            # Every connection to :memory: is a new, empty database: share a single one across threads
+            return {"poolclass": StaticPool, "connect_args": {"check_same_thread": False}}
+        return super().engine_options(url)
+
+
+@register_backend
+class DuckDbBackend(DatabaseBackend):
+    """Local CSV/Parquet files mounted in an embedded DuckDB database."""
+
+    name = "duckdb"
+    driver_candidates = ("duckdb_engine",)
+    dialect_hints = """
+- Use LIMIT n to limit rows. Wrap identifiers that contain spaces in double quotes.
+- Use date_part('year', col) or strftime() for dates and ILIKE for case-insensitive matching.
+"""
+
+    def database_name(self, database: str = None) -> str:
+        return "file_sources"
+
+    def create_engine(self, read_only: bool = True, database: str = None, application_intent: str = None,
+                      replica_url: str = None):
+        if database or application_intent or replica_url:
+            raise ValueError("The duckdb backend only serves FILE_SOURCE_PATHS; it has no other databases or replicas.")
+        # DuckDB is columnar and vectorized in-process; the file is opened read-only
+        return create_file_engine()
+
+    def engine_is_stale(self) -> bool:
+        # A changed source file means the DuckDB file is rebuilt by the next create_engine
+        return file_sources_changed()
+
+
+def get_backend(name: str = None) -> DatabaseBackend:
+    """
+    Return the configured backend.
+
+    Parameters:
+    - name (str): Backend name. Defaults to DB_BACKEND, then duckdb when FILE_SOURCE_PATHS
+      is set, then azure_sql_token when no SQL user name is set, then azure_sql.
+
+    Returns:
+    - DatabaseBackend: The registered backend.
+    """
+    name = name or os.getenv("DB_BACKEND")
+    if not name:
+        if get_file_source_paths():
+            name = "duckdb"
+        elif not os.getenv("SQL_SERVER_USERNAME"):
+            name = "azure_sql_token"
+        else:
+            name = "azure_sql"
+    if name not in BACKENDS:
+        raise ValueError("Unknown DB_BACKEND '{}'. Available backends: {}".format(name, ", ".join(sorted(BACKENDS))))
+    return BACKENDS[name]
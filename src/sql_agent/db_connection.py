@@ -0,0 +1,42 @@
+import logging
+
+from sql_agent.db_backends import get_backend
+
+logger = logging.getLogger(__name__)
+
+# This module owns how the service connects to the database. Keeping the connection
+# details in one place means the agent, the sandbox and any offline jobs all open
+# connections the same way, with the same (low-privilege) credentials.
+# The backend (Azure SQL, Fabric, PostgreSQL, SQLite, DuckDB) is chosen by configuration;
+# see db_backends.py. Without a data source, the functions below use the configured (default)
+# database; see data_sources.py for the named ones.
+
+
+def get_database_name(data_source=None) -> str:
+    """Name of the active data source, used to key caches (schema, column statistics)."""
+    if data_source is not None:
+        return data_source.database_name()
+    return get_backend().database_name()
+
+
+def get_dialect_hints(data_source=None) -> str:
+    """Dialect-specific guidance for the agent prompt."""
+    backend = data_source.backend if data_source is not None else get_backend()
+    return backend.dialect_hints
+
+
+def create_read_only_engine(data_source=None):
+    """
+    Create the SQLAlchemy engine used to run agent-generated SQL.
+
+    Parameters:
+    - data_source (DataSource): The database to connect to. Defaults to the configured one.
+
+    Returns:
+    - Engine: An engine for the configured backend, using its read-only login where
+      one is configured, its fastest installed driver and its pool defaults.
+    """
+    backend = data_source.backend if data_source is not None else get_backend()
+    database = data_source.database if data_source is not None else None
+    logger.info("Connecting with the %s backend (driver: %s)", backend.name, backend.select_driver())
+    return backend.create_engine(read_only=True, database=database)
@@ -0,0 +1,171 @@
+import os
+import re
+import json
+import math
+import logging
+import threading
+from collections import Counter
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Few-shot example library (question -> SQL pairs) with retrieval by question similarity.
+# Instead of sending the same static examples on every call, the 2-3 examples closest to the
+# incoming question are injected into the prompt. Examples come from two places:
+#   - Curated: few_shot_examples.json, maintained by hand next to this module.
+#   - Harvested: the SQL of successful agent runs, appended to a JSON Lines file when
+#     FEW_SHOT_HARVEST=true (off by default: review what a deployment harvests before relying on it).
+# Similarity is TF-IDF cosine over words and word pairs. It runs in-process, needs no extra
+# dependency or embedding call, and is fast for libraries of a few thousand examples.
+
+CURATED_EXAMPLES_PATH = os.path.join(os.path.dirname(__file__), "few_shot_examples.json")
+DEFAULT_HARVEST_PATH = os.path.join(os.path.dirname(__file__), "cache", "harvested_examples.jsonl")
+
+_STOP_WORDS = frozenset({
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "give",
+    "how", "i", "in", "is", "it", "me", "of", "on", "or", "please", "show", "tell", "that", "the",
+    "there", "to", "was", "were", "what", "which", "who", "with", "you",
+})
+
+
+def _terms(text: str) -> List[str]:
+    """Lower-case words (without stop words) plus adjacent word pairs."""
+    words = [word for word in re.findall(r"[a-z0-9_]+", text.lower()) if word not in _STOP_WORDS]
+    return words + [left + " " + right for left, right in zip(words, words[1:])]
+
+
+def normalize_question(question: str) -> str:
+    """Normalize a question for de-duplication."""
+    return " ".join(re.findall(r"[a-z0-9_]+", question.lower()))
+
+
+class FewShotExampleStore:
+    """In-memory TF-IDF index over curated and harvested question/SQL examples."""
+
+    def __init__(self, curated_path: str = CURATED_EXAMPLES_PATH, harvest_path: Optional[str] = None,
+                 min_score: float = 0.15):
+        self.curated_path = curated_path
+        self.harvest_path = harvest_path
+        self.min_score = min_score
+        self._examples = []
+        self._vectors = []
+        self._idf = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self) -> None:
+        examples = []
+        if self.curated_path and os.path.exists(self.curated_path):
+            with open(self.curated_path, encoding="utf-8") as f:
+                examples.extend(dict(example, source="curated") for example in json.load(f))
+        if self.harvest_path and os.path.exists(self.harvest_path):
+            with open(self.harvest_path, encoding="utf-8") as f:
+                harvested = [json.loads(line) for line in f if line.strip()]
+            # Earlier versions harvested the answer text after the SQL (closing fence, prose)
+            clean = [example for example in harvested if "```" not in example["sql"]]
+            if len(clean) < len(harvested):
+                logger.warning("Skipped %d harvested examples whose SQL contains answer text", len(harvested) - len(clean))
+            examples.extend(clean)
+        with self._lock:
+            self._examples = examples
+            self._reindex()
+        logger.info("Loaded %d few-shot examples", len(examples))
+
+    def _reindex(self) -> None:
+        # Caller holds the lock
+        documents = [Counter(_terms(example["question"])) for example in self._examples]
+        document_frequency = Counter(term for document in documents for term in document)
+        total = len(documents)
+        self._idf = {term: math.log((1 + total) / (1 + count)) + 1 for term, count in document_frequency.items()}
+        self._vectors = [self._vectorize(document) for document in documents]
+
+    def _vectorize(self, term_counts: Counter) -> dict:
+        vector = {term: count * self._idf.get(term, 0.0) for term, count in term_counts.items()}
+        norm = math.sqrt(sum(weight * weight for weight in vector.values())) or 1.0
+        return {term: weight / norm for term, weight in vector.items() if weight}
+
+    def __len__(self) -> int:
+        return len(self._examples)
+
+    def search(self, question: str, k: int = 3) -> List[Tuple[float, dict]]:
+        """
+        Find the examples most similar to a question.
+
+        Parameters:
+        - question (str): The user's question.
+        - k (int): Maximum number of examples to return.
+
+        Returns:
+        - list: (score, example) pairs, best first, above the minimum score.
+        """
+        with self._lock:
+            query = self._vectorize(Counter(_terms(question)))
+            scored = []
+            for vector, example in zip(self._vectors, self._examples):
+                score = sum(weight * vector.get(term, 0.0) for term, weight in query.items())
+                if score >= self.min_score:
+                    scored.append((score, example))
+        scored.sort(key=lambda pair: pair[0], reverse=True)
+        return scored[:k]
+
+    def add(self, question: str, sql: str, answer: str = "", explanation: str = "") -> bool:
+        """
+        Harvest a validated question/SQL pair.
+
+        Returns:
+        - bool: False when an example with the same normalized question already exists.
+        """
+        example = {"question": question.strip(), "sql": sql.strip(), "answer": answer.strip(),
+                   "explanation": explanation.strip(), "source": "harvested"}
+        key = normalize_question(question)
+        with self._lock:
+            if any(normalize_question(existing["question"]) == key for existing in self._examples):
+                return False
+            self._examples.append(example)
+            self._reindex()
+            if self.harvest_path:
+                os.makedirs(os.path.dirname(self.harvest_path), exist_ok=True)
+                with open(self.harvest_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(example) + "\n")
+        logger.info("Harvested few-shot example: %s", question)
+        return True
+
+
+def render_examples(examples: List[dict]) -> str:
+    """
+    Render examples as a prompt section.
+
+    Braces are escaped because the agent prefix is passed through str.format by LangChain.
+    """
+    if not examples:
+        return ""
+    blocks = []
+    for number, example in enumerate(examples, start=1):
+        block = "Example {}:\n\nQuestion: {}\n\n".format(number, example["question"])
+        if example.get("answer"):
+            block += "Final Answer: {}\n\n".format(example["answer"])
+        explanation = example.get("explanation", "").strip()
+        block += "Explanation:\n{}I used the following query:\n\n```sql\n{}\n```\n".format(
+            explanation + " " if explanation else "", example["sql"])
+        blocks.append(block)
+    section = "\n### Examples of similar questions answered on this database:\n\n" + "\n".join(blocks)
+    return section.replace("{", "{{").replace("}", "}}")
+
+
+_example_store = None
+_example_store_lock = threading.Lock()
+
+
+def get_example_store() -> FewShotExampleStore:
+    """Return the process-wide example store, loading it on first use."""
+    global _example_store
+    with _example_store_lock:
+        if _example_store is None:
+            harvest_path = DEFAULT_HARVEST_PATH
+            if os.getenv("FEW_SHOT_HARVEST", "false").lower() != "true":
+                harvest_path = None
+            _example_store = FewShotExampleStore(
+                harvest_path=os.getenv("FEW_SHOT_HARVEST_PATH", harvest_path) if harvest_path else None,
+                min_score=float(os.getenv("FEW_SHOT_MIN_SCORE", "0.15")),
+            )
+        return _example_store
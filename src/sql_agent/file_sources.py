@@ -0,0 +1,190 @@
+import os
+import re
+import json
+import glob
+import uuid
+import logging
+import zipfile
+import threading
+
+from sqlalchemy import create_engine
+
+logger = logging.getLogger(__name__)
+
+# Local files (CSV / Parquet) as a first-class data source, backed by embedded DuckDB.
+# The Fabric accelerator answers questions over loansclean.csv with a pandas agent, which runs
+# LLM-written Python over DataFrames held in memory. Here the files are mounted into a DuckDB
+# database instead, and the normal NL2SQL flow (SQLDatabase, toolkit, sandbox) runs on top of it
+# with DuckDB's vectorized, columnar execution and no SQL Server.
+#   - CSV files are loaded once into native DuckDB tables (parsed once, stored columnar).
+#   - Parquet files are exposed as views; they are already columnar and are scanned in place.
+#   - Zip archives are extracted to the cache folder first.
+#   - Directories are expanded to the CSV/Parquet files they contain.
+# The database file is rebuilt only when a source file changed: the modification time and size of
+# every source file (directories are listed again) are recorded next to it in a manifest
+# (<database>.sources.json) and compared on each check, so files edited in place, added or removed
+# are seen too. A rebuild writes a new file and swaps it in with os.replace: engines, pooled
+# connections and other workers that still have the old file open keep reading it until they are
+# rebuilt, and never see a half-written database. The agent connects to it read-only.
+#
+# Configuration:
+#   FILE_SOURCE_PATHS="../Fabric/loansclean.csv.zip;/data/parquet"   (";"-separated)
+#   FILE_SOURCE_DATABASE="< Path of the DuckDB file >"               (default: sql_agent/cache/file_sources.duckdb)
+
+DEFAULT_DATABASE_PATH = os.path.join(os.path.dirname(__file__), "cache", "file_sources.duckdb")
+
+_build_lock = threading.Lock()
+
+
+def get_file_source_paths() -> list:
+    """Return the configured source paths (FILE_SOURCE_PATHS), or an empty list."""
+    return [path.strip() for path in os.getenv("FILE_SOURCE_PATHS", "").split(";") if path.strip()]
+
+
+def table_name_for(path: str) -> str:
+    """Derive a SQL-friendly table name from a file name (loans-clean.csv -> loans_clean)."""
+    stem = os.path.basename(path).split(".")[0]
+    name = re.sub(r"[^0-9a-zA-Z_]", "_", stem).lower()
+    return name if not name[:1].isdigit() else "t_" + name
+
+
+def _expand_sources(paths: list, extract_dir: str) -> list:
+    """Resolve directories and zip archives to (table_name, file_path, kind) entries."""
+    sources = []
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(glob.glob(os.path.join(path, "*.csv")) + glob.glob(os.path.join(path, "*.parquet")))
+            sources.extend(_expand_sources(files, extract_dir))
+        elif path.endswith(".zip"):
+            with zipfile.ZipFile(path) as archive:
+                members = [name for name in archive.namelist()
+                           if name.endswith((".csv", ".parquet")) and not name.startswith("__MACOSX")]
+                if not members:
+                    logger.warning("No CSV or Parquet file found in %s", path)
+                for member in members:
+                    sources.extend(_expand_sources([archive.extract(member, extract_dir)], extract_dir))
+        elif path.endswith(".parquet"):
+            sources.append((table_name_for(path), os.path.abspath(path), "parquet"))
+        elif path.endswith(".csv"):
+            sources.append((table_name_for(path), os.path.abspath(path), "csv"))
+        else:
+            logger.warning("Skipping unsupported file source: %s", path)
+    return sources
+
+
+def _manifest_path(database_path: str) -> str:
+    return database_path + ".sources.json"
+
+
+def _source_files(paths: list) -> list:
+    """The files behind the source paths: directories are expanded, zip archives count as one file."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "*.csv")) + glob.glob(os.path.join(path, "*.parquet"))))
+        else:
+            files.append(path)
+    return files
+
+
+def _fingerprint(paths: list) -> dict:
+    """Map each source file to its [modification time (ns), size], or None when it is missing."""
+    fingerprint = {}
+    for path in _source_files(paths):
+        try:
+            stat = os.stat(path)
+            fingerprint[os.path.abspath(path)] = [stat.st_mtime_ns, stat.st_size]
+        except OSError:
+            fingerprint[os.path.abspath(path)] = None
+    return fingerprint
+
+
+def _is_stale(database_path: str, paths: list) -> bool:
+    if not os.path.exists(database_path):
+        return True
+    try:
+        with open(_manifest_path(database_path), encoding="utf-8") as f:
+            built_from = json.load(f)
+    except (OSError, ValueError):
+        # Built by an older version (or the manifest was removed): rebuild once to record it
+        return True
+    return built_from != _fingerprint(paths)
+
+
+def file_sources_changed(paths: list = None, database_path: str = None) -> bool:
+    """True when a source file changed since the DuckDB database was built, so engines over it must be rebuilt."""
+    paths = paths or get_file_source_paths()
+    database_path = database_path or os.getenv("FILE_SOURCE_DATABASE", DEFAULT_DATABASE_PATH)
+    return _is_stale(database_path, paths)
+
+
+def build_file_database(paths: list, database_path: str = DEFAULT_DATABASE_PATH) -> list:
+    """
+    Mount CSV/Parquet files into a DuckDB database file.
+
+    Parameters:
+    - paths (list): Files, directories or zip archives.
+    - database_path (str): The DuckDB database file to create or refresh.
+
+    Returns:
+    - list: Names of the tables and views that were created.
+    """
+    # Optional dependency: only required when file sources are configured
+    import duckdb
+
+    os.makedirs(os.path.dirname(database_path), exist_ok=True)
+    extract_dir = os.path.join(os.path.dirname(database_path), "file_sources")
+    # Taken before reading the files, so a change made during the build triggers another one
+    fingerprint = _fingerprint(paths)
+    sources = _expand_sources(paths, extract_dir)
+
+    # Built next to the target (same file system) and swapped in once complete
+    build_path = "{}.{}.tmp".format(database_path, uuid.uuid4().hex)
+    connection = duckdb.connect(build_path)
+    try:
+        for table_name, file_path, kind in sources:
+            quoted_path = file_path.replace("'", "''")
+            if kind == "csv":
+                connection.execute('CREATE OR REPLACE TABLE "{}" AS SELECT * FROM read_csv_auto(\'{}\')'.format(
+                    table_name, quoted_path))
+            else:
+                connection.execute('CREATE OR REPLACE VIEW "{}" AS SELECT * FROM read_parquet(\'{}\')'.format(
+                    table_name, quoted_path))
+            logger.info("Mounted %s as %s (%s)", file_path, table_name, kind)
+        connection.execute("CHECKPOINT")
+    except Exception:
+        connection.close()
+        for leftover in (build_path, build_path + ".wal"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        raise
+    connection.close()
+    os.replace(build_path, database_path)
+    manifest_build_path = "{}.{}.tmp".format(_manifest_path(database_path), uuid.uuid4().hex)
+    with open(manifest_build_path, "w", encoding="utf-8") as f:
+        json.dump(fingerprint, f)
+    os.replace(manifest_build_path, _manifest_path(database_path))
+    return [table_name for table_name, _, _ in sources]
+
+
+def create_file_engine(paths: list = None, database_path: str = None):
+    """
+    Create a read-only SQLAlchemy engine over the mounted file sources.
+
+    Parameters:
+    - paths (list): Source paths. Defaults to FILE_SOURCE_PATHS.
+    - database_path (str): DuckDB file. Defaults to FILE_SOURCE_DATABASE.
+
+    Returns:
+    - Engine: A duckdb engine (requires the duckdb-engine package) opened read-only.
+    """
+    paths = paths or get_file_source_paths()
+    database_path = database_path or os.getenv("FILE_SOURCE_DATABASE", DEFAULT_DATABASE_PATH)
+
+    # The lock only avoids duplicate builds within a process; builds in other workers write their
+    # own file and the last one to finish is swapped in
+    with _build_lock:
+        if _is_stale(database_path, paths):
+            build_file_database(paths, database_path)
+
+    return create_engine("duckdb:///" + database_path, connect_args={"read_only": True})
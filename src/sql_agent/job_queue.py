@@ -0,0 +1,319 @@
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import logging
+import ipaddress
+import threading
+import contextvars
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+from typing import Optional
+from urllib.parse import urlparse
+
+from sql_agent.metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+# Asynchronous jobs for long-running questions (POST /generate-sql/jobs, GET /jobs/{id} in main.py).
+# Some analytical questions take minutes end to end. On /generate-sql/ they hold the HTTP
+# connection and a FastAPI threadpool slot for the whole agent run, so a few slow questions can
+# starve the fast ones. In job mode the request returns a job id right away and the question
+# runs on a separate, bounded worker pool:
+#   - JobRunner            JOB_MAX_WORKERS threads run generate_sql_query; at most JOB_MAX_QUEUED
+#                          jobs wait for a worker, further submissions are rejected (429)
+#   - InMemoryJobStore     bounded, per process (default)
+#   - SqliteJobStore       JOB_STORE_PATH; shared by the workers of one host and kept across restarts
+#   - webhooks             when the job has a webhook_url, its final state is POSTed there. Webhooks
+#                          are rejected unless JOB_WEBHOOK_ALLOWED_HOSTS lists the host, so API
+#                          callers cannot make the workers POST to internal services. Before each
+#                          delivery the host is resolved again and loopback, link-local (e.g. the
+#                          169.254.169.254 metadata endpoint), multicast and unspecified addresses
+#                          are refused; redirects are not followed.
+# Threads are used rather than processes: an agent run mostly waits on the LLM and the
+# database, and the worker threads share the warm engine, caches and token providers.
+# With the SQLite store, jobs still queued or running JOB_STALE_SECONDS after their creation
+# were lost with the process that ran them; they are marked failed at the next start.
+
+JOB_STATUSES = ("queued", "running", "succeeded", "failed")
+
+
+class JobQueueFull(Exception):
+    """Raised when JOB_MAX_QUEUED jobs are already waiting for a worker."""
+
+
+@dataclass
+class Job:
+    """One asynchronous question and its outcome."""
+    job_id: str
+    prompt: str
+    session_id: Optional[str] = None
+    data_source: Optional[str] = None
+    webhook_url: Optional[str] = None
+    status: str = "queued"
+    created_at: float = 0.0
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Optional[dict] = None
+    error: Optional[str] = None
+
+
+class InMemoryJobStore:
+    """Bounded, thread-safe, in-process job store; the oldest jobs are evicted first."""
+
+    def __init__(self, max_jobs: int = 10000):
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, job: Job) -> None:
+        with self._lock:
+            self._jobs[job.job_id] = job
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last=False)
+
+    def update(self, job_id: str, **fields) -> None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                for name, value in fields.items():
+                    setattr(job, name, value)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return Job(**asdict(job)) if job is not None else None
+
+    def fail_unfinished(self, error: str, older_than_seconds: float) -> int:
+        # Nothing survives a restart in memory
+        return 0
+
+
+class SqliteJobStore:
+    """Job store in a SQLite file, kept across restarts. Finished jobs expire after ttl_seconds."""
+
+    def __init__(self, path: str, ttl_seconds: int = 86400):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, status TEXT NOT NULL, "
+                "created_at REAL NOT NULL, finished_at REAL, payload TEXT NOT NULL)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread; WAL lets readers poll while a worker writes
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def _write(self, job: Job) -> None:
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO jobs (job_id, status, created_at, finished_at, payload) VALUES (?, ?, ?, ?, ?)",
+                (job.job_id, job.status, job.created_at, job.finished_at, json.dumps(asdict(job))))
+
+    def create(self, job: Job) -> None:
+        self._write(job)
+        with self._connect() as connection:
+            connection.execute("DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?",
+                               (time.time() - self.ttl_seconds,))
+
+    def update(self, job_id: str, **fields) -> None:
+        job = self.get(job_id)
+        if job is not None:
+            for name, value in fields.items():
+                setattr(job, name, value)
+            self._write(job)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        row = self._connect().execute("SELECT payload FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return Job(**json.loads(row[0])) if row else None
+
+    def fail_unfinished(self, error: str, older_than_seconds: float) -> int:
+        # Only old jobs: the other workers sharing the file may be running the recent ones
+        job_ids = [row[0] for row in self._connect().execute(
+            "SELECT job_id FROM jobs WHERE status IN ('queued', 'running') AND created_at < ?",
+            (time.time() - older_than_seconds,)).fetchall()]
+        for job_id in job_ids:
+            self.update(job_id, status="failed", error=error, finished_at=time.time())
+        return len(job_ids)
+
+
+def job_response(job: Job) -> dict:
+    """Body returned by GET /jobs/{job_id} and POSTed to the webhook."""
+    return {"job_id": job.job_id, "status": job.status, "created_at": job.created_at,
+            "started_at": job.started_at, "finished_at": job.finished_at,
+            "SqlResponse": job.result, "error": job.error}
+
+
+def to_json_result(result) -> dict:
+    """Make a generate_sql_query result storable (a JSONResponse is turned back into its content)."""
+    if hasattr(result, "body"):
+        return json.loads(result.body)
+    return result
+
+
+def check_webhook_address(hostname: str, port: int = None) -> None:
+    """Raise ValueError when the host resolves to a loopback, link-local, multicast or unspecified address."""
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(hostname, port, proto=socket.IPPROTO_TCP)}
+    except socket.gaierror as e:
+        raise ValueError("webhook_url host {} cannot be resolved: {}".format(hostname, e))
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split("%")[0])
+        if ip.is_loopback or ip.is_link_local or ip.is_multicast or ip.is_unspecified:
+            raise ValueError("webhook_url host {} resolves to a disallowed address ({}).".format(hostname, ip))
+
+
+class _NoRedirectHandler(urllib.request.HTTPRedirectHandler):
+    # A redirect could lead the worker to a host that was never checked
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+_webhook_opener = urllib.request.build_opener(_NoRedirectHandler)
+
+
+def send_webhook(url: str, payload: dict, attempts: int = 3, timeout_seconds: float = 10) -> bool:
+    """POST the job to its webhook URL, retrying with backoff. Returns True on a 2xx response."""
+    body = json.dumps(payload).encode("utf-8")
+    parsed = urlparse(url)
+    for attempt in range(1, attempts + 1):
+        request = urllib.request.Request(url, data=body, method="POST",
+                                         headers={"Content-Type": "application/json"})
+        try:
+            # Resolved again on every attempt: the name may point elsewhere than at submission
+            check_webhook_address(parsed.hostname, parsed.port)
+            with _webhook_opener.open(request, timeout=timeout_seconds) as response:
+                if 200 <= response.status < 300:
+                    return True
+        except Exception as e:
+            logger.warning("Webhook for job %s failed (attempt %d): %s", payload.get("job_id"), attempt, e)
+        if attempt < attempts:
+            time.sleep(2 ** attempt)
+    return False
+
+
+class JobRunner:
+    """Runs queued jobs on a bounded worker pool and records their state in a job store."""
+
+    def __init__(self, handler, store, max_workers: int = 4, max_queued: int = 100,
+                 allowed_webhook_hosts: Optional[list] = None):
+        self.handler = handler
+        self.store = store
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.allowed_webhook_hosts = [host.lower() for host in allowed_webhook_hosts or []]
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job-worker")
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def check_webhook_url(self, url: str) -> None:
+        """
+        Raise ValueError for webhook URLs that are not http(s), not on the allowed hosts
+        (JOB_WEBHOOK_ALLOWED_HOSTS; without it every webhook is rejected) or that resolve to a
+        loopback or link-local address.
+        """
+        if not self.allowed_webhook_hosts:
+            raise ValueError("Webhooks are disabled (JOB_WEBHOOK_ALLOWED_HOSTS is not set).")
+        parsed = urlparse(url)
+        if parsed.scheme not in ("http", "https") or not parsed.hostname:
+            raise ValueError("webhook_url must be an http(s) URL.")
+        if parsed.hostname.lower() not in self.allowed_webhook_hosts:
+            raise ValueError("webhook_url host {} is not allowed.".format(parsed.hostname))
+        check_webhook_address(parsed.hostname, parsed.port)
+
+    def submit(self, prompt: str, session_id: str = None, webhook_url: str = None,
+               data_source: str = None) -> Job:
+        """
+        Queue a question.
+
+        Returns:
+        - Job: The queued job. Raises JobQueueFull when too many jobs are waiting for a worker.
+        """
+        if webhook_url:
+            self.check_webhook_url(webhook_url)
+        with self._lock:
+            # Jobs not yet picked up by a worker
+            if self._pending - self.max_workers >= self.max_queued:
+                get_metrics().increment("jobs.rejected")
+                raise JobQueueFull("Too many queued jobs; retry later.")
+            self._pending += 1
+        job = Job(job_id=uuid.uuid4().hex, prompt=prompt, session_id=session_id, data_source=data_source,
+                  webhook_url=webhook_url, created_at=time.time())
+        self.store.create(job)
+        get_metrics().increment("jobs.submitted")
+        # The worker runs in a copy of this context (request id for the logs)
+        context = contextvars.copy_context()
+        self._executor.submit(context.run, self._run, job)
+        return job
+
+    def _run(self, job: Job) -> None:
+        started_at = time.time()
+        self.store.update(job.job_id, status="running", started_at=started_at)
+        get_metrics().observe("jobs.queue_wait_ms", (started_at - job.created_at) * 1000)
+        try:
+            result = to_json_result(self.handler(job.prompt, session_id=job.session_id, data_source=job.data_source))
+            self.store.update(job.job_id, status="succeeded", result=result, finished_at=time.time())
+            get_metrics().increment("jobs.succeeded")
+        except Exception as e:
+            logger.error("Job %s failed: %s", job.job_id, e)
+            self.store.update(job.job_id, status="failed", error=str(e), finished_at=time.time())
+            get_metrics().increment("jobs.failed")
+        finally:
+            with self._lock:
+                self._pending -= 1
+            get_metrics().observe("jobs.run_ms", (time.time() - started_at) * 1000)
+
+        if job.webhook_url:
+            finished = self.store.get(job.job_id)
+            if not send_webhook(job.webhook_url, job_response(finished)):
+                get_metrics().increment("jobs.webhook_failed")
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def create_job_store():
+    """Return the job store selected by JOB_STORE_PATH (SQLite), or an in-memory store."""
+    path = os.getenv("JOB_STORE_PATH")
+    if path:
+        store = SqliteJobStore(path, ttl_seconds=int(os.getenv("JOB_TTL_SECONDS", "86400")))
+        interrupted = store.fail_unfinished("Interrupted by a service restart.",
+                                            older_than_seconds=float(os.getenv("JOB_STALE_SECONDS", "3600")))
+        if interrupted:
+            logger.warning("Marked %d interrupted job(s) as failed", interrupted)
+        return store
+    return InMemoryJobStore(max_jobs=int(os.getenv("JOB_MAX_JOBS", "10000")))
+
+
+_job_runner = None
+_job_runner_lock = threading.Lock()
+
+
+def get_job_runner(handler) -> JobRunner:
+    """Return the process-wide job runner (handler applies when it is first created)."""
+    global _job_runner
+    with _job_runner_lock:
+        if _job_runner is None:
+            allowed_hosts = [host.strip().lower() for host in os.getenv("JOB_WEBHOOK_ALLOWED_HOSTS", "").split(",")
+                             if host.strip()]
+            _job_runner = JobRunner(
+                handler,
+                create_job_store(),
+                max_workers=int(os.getenv("JOB_MAX_WORKERS", "4")),
+                max_queued=int(os.getenv("JOB_MAX_QUEUED", "100")),
+                allowed_webhook_hosts=allowed_hosts or None,
+            )
+        return _job_runner
@@ -0,0 +1,136 @@
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import threading
+import contextvars
+import logging.handlers
+
+from sql_agent.metrics import get_metrics
+
+# Structured, non-blocking logging for the service.
+# Request-path code only puts log records on an in-memory queue; a background listener thread
+# formats them and writes them to stdout. A slow or contended stdout therefore never blocks a
+# request. If the queue is full, the record is dropped and counted (logging.dropped_records in
+# /metrics) instead of waiting.
+#   - Records are JSON objects (LOG_FORMAT=json, default) or plain text (LOG_FORMAT=text).
+#   - Every record carries the request id of the request that produced it (request_id_var),
+#     set by the middleware in main.py from the X-Request-ID header or a new id.
+#   - String fields are capped at LOG_MAX_FIELD_CHARS, so a large result cannot produce a huge line.
+#   - INFO and DEBUG records are sampled with LOG_SAMPLE_RATE (0..1); warnings and errors are always kept.
+# Code that runs on its own threads (tool pools) must copy the context to keep the request id.
+
+request_id_var = contextvars.ContextVar("request_id", default="-")
+
+# Attributes every LogRecord has; anything else was passed with extra={...}
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id"}
+
+
+def cap(value, max_chars: int):
+    """Cap a string at max_chars, noting how much was cut."""
+    if isinstance(value, str) and len(value) > max_chars:
+        return value[:max_chars] + "... [{} more chars]".format(len(value) - max_chars)
+    return value
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamps records with the current request id and applies sampling to INFO and below."""
+
+    def __init__(self, sample_rate: float = 1.0):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno <= logging.INFO and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return False
+        record.request_id = request_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with extra fields and size-capped strings."""
+
+    def __init__(self, max_field_chars: int = 2000):
+        super().__init__()
+        self.max_field_chars = max_field_chars
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + ".{:03d}".format(int(record.msecs)),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            # Already capped by the queue handler (tracebacks included)
+            "message": record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRIBUTES and not name.startswith("_"):
+                entry[name] = cap(value if isinstance(value, (int, float, bool, type(None))) else str(value),
+                                  self.max_field_chars)
+        return json.dumps(entry, default=str)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full."""
+
+    def __init__(self, log_queue, max_field_chars: int = 2000):
+        super().__init__(log_queue)
+        self.max_field_chars = max_field_chars
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Tracebacks are rendered into the message here; give them more room than plain messages
+        max_chars = self.max_field_chars * 4 if record.exc_info else self.max_field_chars
+        record = super().prepare(record)
+        # The message was merged with its arguments; cap it before it sits in the queue
+        record.msg = record.message = cap(record.msg, max_chars)
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            get_metrics().increment("logging.dropped_records")
+
+
+_setup_lock = threading.Lock()
+_listener = None
+
+
+def setup_logging() -> None:
+    """
+    Route all logging through the background queue listener. Safe to call more than once.
+
+    Environment:
+    - LOG_LEVEL (default INFO), LOG_FORMAT (json | text), LOG_SAMPLE_RATE (default 1.0),
+      LOG_MAX_FIELD_CHARS (default 2000), LOG_QUEUE_SIZE (default 10000).
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+
+        max_field_chars = int(os.getenv("LOG_MAX_FIELD_CHARS", "2000"))
+        stream_handler = logging.StreamHandler(sys.stdout)
+        if os.getenv("LOG_FORMAT", "json").lower() == "text":
+            stream_handler.setFormatter(logging.Formatter(
+                '%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s'))
+        else:
+            stream_handler.setFormatter(JsonFormatter(max_field_chars))
+
+        log_queue = queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", "10000")))
+        queue_handler = NonBlockingQueueHandler(log_queue, max_field_chars)
+        queue_handler.addFilter(RequestContextFilter(float(os.getenv("LOG_SAMPLE_RATE", "1.0"))))
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(queue_handler)
+        root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+
+        _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+        _listener.start()
+        # Flush what is still queued when the process exits
+        atexit.register(_listener.stop)
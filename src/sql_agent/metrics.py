@@ -0,0 +1,70 @@
+import sys
+import threading
+
+# In-process service metrics, exposed as JSON by GET /metrics in main.py.
+# Values are aggregated per name (count, sum, max, last), so a scrape shows both averages and
+# worst cases without keeping per-request history. Metrics are per worker process.
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; peak RSS is then not reported
+    resource = None
+
+
+class MetricsRegistry:
+    """Thread-safe counters and value summaries."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._summaries = {}
+
+    def increment(self, name: str, amount: float = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def observe(self, name: str, value: float) -> None:
+        with self._lock:
+            summary = self._summaries.setdefault(name, {"count": 0, "sum": 0.0, "max": value, "last": value})
+            summary["count"] += 1
+            summary["sum"] += value
+            summary["max"] = max(summary["max"], value)
+            summary["last"] = value
+
+    def summary(self, name: str):
+        """Return a copy of one summary (with avg), or None when nothing was observed."""
+        with self._lock:
+            summary = self._summaries.get(name)
+            if summary is None:
+                return None
+            return dict(summary, avg=summary["sum"] / summary["count"] if summary["count"] else 0.0)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            summaries = {
+                name: dict(summary, avg=summary["sum"] / summary["count"] if summary["count"] else 0.0)
+                for name, summary in self._summaries.items()
+            }
+            return {"counters": dict(self._counters), "summaries": summaries, "process": process_memory()}
+
+
+def peak_rss_mb() -> float:
+    """Peak resident memory of this process in MB, or 0.0 when it cannot be read."""
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return round(peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10, 1)
+
+
+def process_memory() -> dict:
+    return {"peak_rss_mb": peak_rss_mb()}
+
+
+_metrics = MetricsRegistry()
+
+
+def get_metrics() -> MetricsRegistry:
+    """Return the process-wide metrics registry."""
+    return _metrics
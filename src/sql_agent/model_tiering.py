@@ -0,0 +1,167 @@
+import os
+import re
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+from sql_agent.metrics import get_metrics
+from sql_agent.sql_sandbox import UnsafeSqlError, referenced_tables, validate_read_only_sql
+
+logger = logging.getLogger(__name__)
+
+# Adaptive model tiering.
+# Most questions are answered correctly by the small, fast deployment; a few need the large one.
+# With MODEL_TIERING enabled, the agent runs on the first tier (GPT35_DEPLOYMENT_NAME by default)
+# and its answer is checked:
+#   - a Final Answer and a SQL statement were produced,
+#   - the last query the agent executed (the tool input, not the SQL quoted in the answer text,
+#     which comes with fences and prose) passes the read-only sandbox validation,
+#   - every table it references exists in the database (schema validation),
+#   - that query did not fail,
+#   - the answer does not express low confidence ("I'm not sure", "I don't know", ...).
+# When a check fails, or the tier raises an error, the question is re-run on the next tier
+# (GPT4_DEPLOYMENT_NAME by default). The last tier's answer is returned as is.
+# Per tier, /metrics reports attempts, accepted and escalated answers (escalation rate =
+# escalated / attempts), latency, tokens and cost, plus the latency and cost saved by answers
+# accepted below the top tier, estimated from the top tier's running averages.
+
+QUERY_TOOLS = ("sql_db_query", "sql_db_query_candidates")
+
+LOW_CONFIDENCE_PATTERN = re.compile(
+    r"\b(i don't know|i do not know|not sure|unable to (?:determine|find|answer)|cannot (?:determine|be determined)|"
+    r"could not (?:find|determine))\b", re.IGNORECASE)
+
+# Observation of sql_db_query_candidates when a candidate succeeded (speculative_execution.py)
+_CANDIDATE_SUCCESS_PATTERN = re.compile(r"^Candidate \d+ succeeded\.\nSQL: (.*?)\nResult: ", re.DOTALL)
+_SQL_FENCE_PATTERN = re.compile(r"^```(?:sql)?|```$", re.IGNORECASE)
+
+_CTE_NAME_PATTERN = re.compile(r"(?:\bWITH\s+(?:RECURSIVE\s+)?|,\s*)([\w\"\[\]]+)\s*(?:\([^)]*\)\s*)?AS\s*\(", re.IGNORECASE)
+
+
+@dataclass
+class TierVerdict:
+    """Outcome of checking one tier's answer."""
+    accepted: bool
+    reason: str = ""
+
+
+def get_model_tiers() -> list:
+    """
+    Deployments to try, cheapest first.
+
+    Returns:
+    - list: MODEL_TIERS (comma-separated deployment names) when set; with MODEL_TIERING=true,
+      GPT35_DEPLOYMENT_NAME then GPT4_DEPLOYMENT_NAME; otherwise only GPT35_DEPLOYMENT_NAME.
+    """
+    if os.getenv("MODEL_TIERS"):
+        return [name.strip() for name in os.environ["MODEL_TIERS"].split(",") if name.strip()]
+    tiers = [os.environ["GPT35_DEPLOYMENT_NAME"]]
+    if os.getenv("MODEL_TIERING", "false").lower() == "true" and os.getenv("GPT4_DEPLOYMENT_NAME"):
+        if os.environ["GPT4_DEPLOYMENT_NAME"] not in tiers:
+            tiers.append(os.environ["GPT4_DEPLOYMENT_NAME"])
+    return tiers
+
+
+def _normalize_table_name(name: str) -> str:
+    # Drop brackets/quotes and the schema prefix: dbo.[Orders] -> orders
+    return re.sub(r'[\[\]"`]', "", name).split(".")[-1].lower()
+
+
+def query_steps(intermediate_steps: list) -> list:
+    """(SQL, observation) of every query the agent ran, in order."""
+    steps = []
+    for step in intermediate_steps:
+        if not isinstance(step, tuple):
+            continue
+        action, observation = step
+        tool = getattr(action, "tool", None)
+        if tool not in QUERY_TOOLS:
+            continue
+        tool_input = action.tool_input
+        if isinstance(tool_input, dict):
+            tool_input = tool_input.get("query", "")
+        sql = str(tool_input)
+        if tool == "sql_db_query_candidates":
+            # The tool input is a list of candidates; the observation names the one that ran
+            success = _CANDIDATE_SUCCESS_PATTERN.match(str(observation))
+            sql = success.group(1) if success else sql
+        steps.append((_SQL_FENCE_PATTERN.sub("", sql.strip()).strip(), observation))
+    return steps
+
+
+def executed_sql(intermediate_steps: list) -> Optional[str]:
+    """The last SQL statement the agent executed, or None when it ran no query."""
+    steps = query_steps(intermediate_steps)
+    return steps[-1][0] if steps else None
+
+
+def unknown_tables(sql_statement: str, usable_tables: list) -> list:
+    """Tables referenced by the statement that do not exist in the database (CTE names excluded)."""
+    known = {_normalize_table_name(table) for table in usable_tables}
+    ctes = {_normalize_table_name(name) for name in _CTE_NAME_PATTERN.findall(sql_statement)}
+    return [table for table in referenced_tables(sql_statement)
+            if _normalize_table_name(table) not in known and _normalize_table_name(table) not in ctes]
+
+
+def check_agent_answer(final_answer: str, sql_statement: str, intermediate_steps: list, usable_tables: list) -> TierVerdict:
+    """
+    Decide whether an agent answer is good enough to return without escalating.
+
+    Parameters:
+    - final_answer (str): The extracted "Final Answer: ..." text, or None when missing.
+    - sql_statement (str): The extracted SQL statement, or None when missing.
+    - intermediate_steps (list): The agent's (action, observation) steps; the checks run on the
+      last query executed there.
+    - usable_tables (list): Table names of the database.
+
+    Returns:
+    - TierVerdict: accepted, or the reason for escalating.
+    """
+    if not final_answer:
+        return TierVerdict(False, "no final answer")
+    if not sql_statement:
+        return TierVerdict(False, "no SQL statement")
+    steps = query_steps(intermediate_steps)
+    if not steps:
+        return TierVerdict(False, "the SQL was never executed")
+    last_sql, last_observation = steps[-1]
+    try:
+        validate_read_only_sql(last_sql)
+    except UnsafeSqlError as e:
+        return TierVerdict(False, "SQL rejected by the sandbox: {}".format(e))
+    missing = unknown_tables(last_sql, usable_tables)
+    if missing:
+        return TierVerdict(False, "unknown tables: {}".format(", ".join(missing)))
+    if str(last_observation).startswith("Error"):
+        return TierVerdict(False, "the last query failed")
+    if LOW_CONFIDENCE_PATTERN.search(final_answer):
+        return TierVerdict(False, "low confidence answer")
+    return TierVerdict(True)
+
+
+def record_tier_attempt(deployment_name: str, latency_ms: float, total_tokens: int, cost_usd: float,
+                        accepted: bool, escalated: bool) -> None:
+    """Report one tier attempt to the metrics registry."""
+    metrics = get_metrics()
+    prefix = "tiering.{}.".format(deployment_name)
+    metrics.increment(prefix + "attempts")
+    if accepted:
+        metrics.increment(prefix + "accepted")
+    if escalated:
+        metrics.increment(prefix + "escalated")
+    metrics.observe(prefix + "latency_ms", latency_ms)
+    metrics.observe(prefix + "total_tokens", total_tokens)
+    metrics.observe(prefix + "cost_usd", cost_usd)
+
+
+def record_savings(tiers: list, accepted_tier: str, latency_ms: float, cost_usd: float) -> None:
+    """Estimate what answering below the top tier saved, from the top tier's running averages."""
+    if accepted_tier == tiers[-1]:
+        return
+    metrics = get_metrics()
+    top_latency = metrics.summary("tiering.{}.latency_ms".format(tiers[-1]))
+    top_cost = metrics.summary("tiering.{}.cost_usd".format(tiers[-1]))
+    if top_latency:
+        metrics.observe("tiering.saved_latency_ms", top_latency["avg"] - latency_ms)
+    if top_cost:
+        metrics.observe("tiering.saved_cost_usd", top_cost["avg"] - cost_usd)
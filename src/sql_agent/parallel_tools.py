@@ -0,0 +1,81 @@
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterator, Optional
+
+from langchain.agents import AgentExecutor
+
+from sql_agent.profiling import profile_stage
+
+logger = logging.getLogger(__name__)
+
+# Parallel tool execution within a single agent turn.
+# With the openai-tools agent, the model can request several tools in one turn (for example the
+# schemas of three tables, or two independent probe queries). LangChain's AgentExecutor runs them
+# one after another. ParallelAgentExecutor runs the tool calls of a turn concurrently on a
+# short-lived thread pool, capped per request by max_parallel_tools, and returns the results in
+# the order the model asked for them. Database tools share the engine's connection pool, so the
+# cap should not exceed the pool size.
+# Tool calls within one turn are independent by construction: the model issued them before
+# seeing any of their results.
+# When a step retention policy is set (step_retention.py), each observation is compacted as
+# soon as its tool returns, before the executor stores it in the intermediate steps.
+# Each tool call runs in a "tool:<name>" profiling stage (profiling.py), on whichever thread runs it.
+
+
+class _DeferredToolCall:
+    """A tool call captured by _perform_agent_action, executed later by _iter_next_step."""
+
+    def __init__(self, run):
+        self.run = run
+
+
+class ParallelAgentExecutor(AgentExecutor):
+    """AgentExecutor that runs the tool calls of one turn concurrently."""
+
+    max_parallel_tools: int = 4
+    step_retention: Optional[Any] = None
+
+    @classmethod
+    def from_executor(cls, agent_executor: AgentExecutor, max_parallel_tools: int = 4,
+                      step_retention=None) -> "ParallelAgentExecutor":
+        """Wrap an executor built by a LangChain factory such as create_sql_agent."""
+        fields = {name: getattr(agent_executor, name) for name in agent_executor.__fields__}
+        return cls(**fields, max_parallel_tools=max_parallel_tools, step_retention=step_retention)
+
+    def _retain(self, step):
+        return self.step_retention.compact_step(step) if self.step_retention is not None else step
+
+    def _perform_agent_action(self, name_to_tool_map, color_mapping, agent_action, run_manager=None):
+        # Defer the call so all calls of the turn can be started together
+        perform = super()._perform_agent_action
+
+        def run():
+            with profile_stage("tool:" + agent_action.tool):
+                return perform(name_to_tool_map, color_mapping, agent_action, run_manager)
+        return _DeferredToolCall(run)
+
+    def _iter_next_step(self, name_to_tool_map, color_mapping, inputs, intermediate_steps,
+                        run_manager=None) -> Iterator:
+        deferred_calls = []
+        for item in super()._iter_next_step(name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager):
+            if isinstance(item, _DeferredToolCall):
+                deferred_calls.append(item)
+            else:
+                yield item
+
+        if len(deferred_calls) <= 1 or self.max_parallel_tools <= 1:
+            for call in deferred_calls:
+                yield self._retain(call.run())
+            return
+
+        logger.info("Running %d tool calls in parallel (cap %d)", len(deferred_calls), self.max_parallel_tools)
+        workers = min(self.max_parallel_tools, len(deferred_calls))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="agent-tool") as pool:
+            # Observations are compacted on the worker thread, as soon as each tool returns.
+            # Each call runs in a copy of the request's context, so its log records keep the request id.
+            futures = [pool.submit(contextvars.copy_context().run, lambda call=call: self._retain(call.run()))
+                       for call in deferred_calls]
+            # Results are returned in request order; an exception propagates as it would sequentially
+            for future in futures:
+                yield future.result()
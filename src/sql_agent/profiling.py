@@ -0,0 +1,288 @@
+import os
+import sys
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# On-demand sampling profiler for requests, tagged with the pipeline stages.
+# When p99 latency spikes, the question is where the time goes inside the worker: LangChain,
+# regex extraction, JSON encoding, tokenization or waiting on the model and the database.
+# A sampler thread reads the Python stacks of the threads it watches (sys._current_frames)
+# every interval, so the profiled code is not instrumented and runs at full speed. Samples are
+# wall-clock: a thread waiting on a socket shows up in the frame it waits in.
+# Every stack is prefixed with the pipeline stage the thread was in, set by sql_agent_service.py
+# (connect, topic_gate, semantic_layer, prompt, agent, answer_check, response) and by the agent
+# executor for each tool call (tool:sql_db_query, ...); worker threads inherit the stage of the
+# request that started them. Stage tracking is a dictionary update per stage, also when no
+# profiler runs.
+# Two modes, both opt-in (PROFILING_ENABLED, see main.py):
+#   request      one /generate-sql/ call sampled at PROFILING_INTERVAL_MS (X-Profile header or
+#                POST /admin/profile); the last PROFILING_KEEP profiles are kept in memory
+#   continuous   PROFILING_CONTINUOUS=true samples every thread that is inside a stage, at the
+#                lower PROFILING_CONTINUOUS_INTERVAL_MS rate, for as long as the process runs
+# Profiles are exported as collapsed stacks ("stage;frame;frame count", for flamegraph.pl and
+# speedscope) or as speedscope JSON (https://www.speedscope.app).
+
+SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+PROFILE_FORMATS = ("speedscope", "collapsed")
+
+# Stage path of the current context; copied into worker threads with the context
+_stage_var = contextvars.ContextVar("profile_stage", default=())
+# Profiler of the request being profiled in this context
+_profile_var = contextvars.ContextVar("request_profile", default=None)
+# Thread id -> stage path, read by the sampler thread
+_thread_stages = {}
+
+_MAX_DEPTH = 128
+
+
+def _enter_stage(path: tuple):
+    thread_id = threading.get_ident()
+    previous = _thread_stages.get(thread_id)
+    _thread_stages[thread_id] = path
+    profiler = _profile_var.get()
+    if profiler is not None:
+        profiler.add_thread(thread_id)
+    return _stage_var.set(path), previous
+
+
+@contextmanager
+def profile_stage(name: str):
+    """Tag the code in the block (and the threads it starts) with a pipeline stage."""
+    token, previous = _enter_stage(_stage_var.get() + (name,))
+    try:
+        yield
+    finally:
+        _stage_var.reset(token)
+        thread_id = threading.get_ident()
+        if previous is None:
+            _thread_stages.pop(thread_id, None)
+            profiler = _profile_var.get()
+            if profiler is not None:
+                # The thread may go back to a pool and work for other requests
+                profiler.discard_thread(thread_id)
+        else:
+            _thread_stages[thread_id] = previous
+
+
+def mark_stage(name: str) -> None:
+    """Move the innermost stage of the enclosing profile_stage block on to the next step."""
+    path = _stage_var.get()
+    if path:
+        # The enclosing block restores the outer path when it exits
+        _enter_stage(path[:-1] + (name,))
+
+
+def current_profile():
+    """The profiler of the request being profiled in this context, or None."""
+    return _profile_var.get()
+
+
+def _frame_key(frame) -> tuple:
+    code = frame.f_code
+    # The last two path components tell apart modules with the same file name (e.g., __init__.py)
+    file_name = os.path.join(*os.path.normpath(code.co_filename).split(os.sep)[-2:])
+    return (code.co_name, file_name, code.co_firstlineno)
+
+
+class SamplingProfiler:
+    """Samples the stacks of a set of threads (or of every thread inside a stage) at an interval."""
+
+    def __init__(self, interval_seconds: float = 0.005, name: str = "request", watch_all_stages: bool = False):
+        self.profile_id = uuid.uuid4().hex
+        self.name = name
+        self.interval_seconds = interval_seconds
+        self.watch_all_stages = watch_all_stages
+        self.started_at = None
+        self.stopped_at = None
+        self.sample_count = 0
+        # (frame keys, outermost first) -> samples
+        self._stacks = Counter()
+        self._threads = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_thread(self, thread_id: int) -> None:
+        with self._lock:
+            self._threads.add(thread_id)
+
+    def discard_thread(self, thread_id: int) -> None:
+        with self._lock:
+            self._threads.discard(thread_id)
+
+    def sample(self) -> None:
+        """Record one sample of every watched thread."""
+        own_id = threading.get_ident()
+        with self._lock:
+            watched = set(self._threads)
+        frames = sys._current_frames()
+        stacks = []
+        for thread_id, frame in frames.items():
+            if thread_id == own_id:
+                continue
+            stages = _thread_stages.get(thread_id)
+            if not (thread_id in watched or (self.watch_all_stages and stages)):
+                continue
+            stack = []
+            while frame is not None and len(stack) < _MAX_DEPTH:
+                stack.append(_frame_key(frame))
+                frame = frame.f_back
+            stack.reverse()
+            stacks.append(tuple(("[stage] " + stage, "", 0) for stage in stages or ("no stage",)) + tuple(stack))
+        with self._lock:
+            self._stacks.update(stacks)
+            self.sample_count += 1
+
+    def _sample_loop(self) -> None:
+        while not self._stop.wait(self.interval_seconds):
+            try:
+                self.sample()
+            except Exception as e:
+                # A failed sample must not end the profile, nor the request
+                logger.debug("Profiler sample failed: %s", e)
+
+    def start(self) -> None:
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._sample_loop, name="profiler-" + self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+        self.stopped_at = time.time()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stacks.clear()
+            self.sample_count = 0
+        self.started_at = time.time()
+
+    def _snapshot(self) -> list:
+        with self._lock:
+            return list(self._stacks.items())
+
+    def to_collapsed(self) -> str:
+        """Collapsed stacks: one "frame;frame;frame count" line per distinct stack."""
+        lines = []
+        for stack, count in sorted(self._snapshot()):
+            frames = [name if not file_name else "{} ({}:{})".format(name, file_name, line)
+                      for name, file_name, line in stack]
+            lines.append("{} {}".format(";".join(frame.replace(";", ":") for frame in frames), count))
+        return "\n".join(lines) + "\n"
+
+    def to_speedscope(self) -> dict:
+        """The profile as a speedscope "sampled" profile (weights in seconds)."""
+        frame_index = {}
+        frames = []
+        samples = []
+        weights = []
+        for stack, count in self._snapshot():
+            indexes = []
+            for key in stack:
+                if key not in frame_index:
+                    frame_index[key] = len(frames)
+                    name, file_name, line = key
+                    frames.append({"name": name, "file": file_name, "line": line} if file_name else {"name": name})
+                indexes.append(frame_index[key])
+            samples.append(indexes)
+            weights.append(round(count * self.interval_seconds, 6))
+        end = (self.stopped_at or time.time()) - (self.started_at or time.time())
+        return {
+            "$schema": SPEEDSCOPE_SCHEMA,
+            "name": "{} {}".format(self.name, self.profile_id),
+            "exporter": "sql-agent-profiler",
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": [{"type": "sampled", "name": self.name, "unit": "seconds", "startValue": 0,
+                          "endValue": round(max(end, sum(weights)), 6), "samples": samples, "weights": weights}],
+        }
+
+    def export(self, profile_format: str):
+        if profile_format not in PROFILE_FORMATS:
+            raise ValueError("Unknown profile format '{}'. Use one of: {}".format(
+                profile_format, ", ".join(PROFILE_FORMATS)))
+        return self.to_speedscope() if profile_format == "speedscope" else self.to_collapsed()
+
+
+class ProfileStore:
+    """The most recent request profiles, by id."""
+
+    def __init__(self, max_profiles: int = 20):
+        self.max_profiles = max_profiles
+        self._profiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, profiler: SamplingProfiler) -> None:
+        with self._lock:
+            self._profiles[profiler.profile_id] = profiler
+            while len(self._profiles) > self.max_profiles:
+                self._profiles.popitem(last=False)
+
+    def get(self, profile_id: str) -> Optional[SamplingProfiler]:
+        with self._lock:
+            return self._profiles.get(profile_id)
+
+
+_profile_store = None
+_continuous_profiler = None
+_profiling_lock = threading.Lock()
+
+
+def get_profile_store() -> ProfileStore:
+    global _profile_store
+    with _profiling_lock:
+        if _profile_store is None:
+            _profile_store = ProfileStore(int(os.getenv("PROFILING_KEEP", "20")))
+        return _profile_store
+
+
+@contextmanager
+def profile_request(name: str = "request"):
+    """
+    Sample the calling thread, and the threads it hands work to, for the duration of the block.
+
+    Returns:
+    - SamplingProfiler: Stored in the profile store when the block exits.
+    """
+    profiler = SamplingProfiler(float(os.getenv("PROFILING_INTERVAL_MS", "5")) / 1000, name=name)
+    profiler.add_thread(threading.get_ident())
+    token = _profile_var.set(profiler)
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        _profile_var.reset(token)
+        get_profile_store().add(profiler)
+        logger.info("Profiled %s: %d samples (profile %s)", name, profiler.sample_count, profiler.profile_id)
+
+
+def get_continuous_profiler() -> Optional[SamplingProfiler]:
+    """Return the continuous profiler, starting it on first use; None unless PROFILING_CONTINUOUS is on."""
+    global _continuous_profiler
+    if os.getenv("PROFILING_CONTINUOUS", "false").lower() != "true":
+        return None
+    with _profiling_lock:
+        if _continuous_profiler is None:
+            _continuous_profiler = SamplingProfiler(
+                float(os.getenv("PROFILING_CONTINUOUS_INTERVAL_MS", "50")) / 1000, name="continuous",
+                watch_all_stages=True)
+            _continuous_profiler.start()
+        return _continuous_profiler
+
+
+def stop_continuous_profiler() -> None:
+    global _continuous_profiler
+    with _profiling_lock:
+        if _continuous_profiler is not None:
+            _continuous_profiler.stop()
+            _continuous_profiler = None
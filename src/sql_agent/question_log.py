@@ -0,0 +1,83 @@
+import re
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from collections import Counter, deque
+
+from sql_agent.schema_cache import load_cache, save_cache
+
+logger = logging.getLogger(__name__)
+
+# Recent questions, used by the warm-up scheduler to replay the most frequent ones on a new
+# instance (see warmup.py).
+# Recording is in memory only, so it adds no I/O to the request path. The scheduler saves the
+# log to the schema cache folder (<database>.recent_questions.json) in the background and at
+# shutdown, and the next instance loads it at startup.
+# Questions asked by the warm-up replay itself are not recorded (see replaying()): otherwise
+# every replay would count once more and the top-N list would lock onto itself.
+
+_replaying_var = contextvars.ContextVar("replaying_questions", default=False)
+
+
+@contextmanager
+def replaying():
+    """Within this block (and work it hands to other threads with a copied context), record() is a no-op."""
+    token = _replaying_var.set(True)
+    try:
+        yield
+    finally:
+        _replaying_var.reset(token)
+
+
+def normalize_question(question: str) -> str:
+    """Collapse case and whitespace so repeated questions count together."""
+    return re.sub(r"\s+", " ", question.strip()).lower()
+
+
+class RecentQuestions:
+    """Bounded, thread-safe log of the most recent questions."""
+
+    def __init__(self, max_questions: int = 1000):
+        self._questions = deque(maxlen=max_questions)
+        self._lock = threading.Lock()
+        self._dirty = False
+
+    def record(self, question: str) -> None:
+        if _replaying_var.get():
+            return
+        with self._lock:
+            self._questions.append(question.strip())
+            self._dirty = True
+
+    def top(self, n: int) -> list:
+        """The n most frequent questions, most frequent first (original wording of the latest ask)."""
+        with self._lock:
+            questions = list(self._questions)
+        latest_wording = {normalize_question(question): question for question in questions}
+        counts = Counter(normalize_question(question) for question in questions)
+        return [latest_wording[key] for key, _ in counts.most_common(n)]
+
+    def load(self, database: str) -> None:
+        payload = load_cache(database, "recent_questions") or {}
+        with self._lock:
+            # Loaded questions are older than anything recorded since startup
+            current = list(self._questions)
+            self._questions.clear()
+            self._questions.extend(payload.get("questions", []) + current)
+
+    def save(self, database: str) -> None:
+        with self._lock:
+            if not self._dirty:
+                return
+            questions = list(self._questions)
+            self._dirty = False
+        save_cache(database, "recent_questions", {"questions": questions})
+
+
+_recent_questions = RecentQuestions()
+
+
+def get_recent_questions() -> RecentQuestions:
+    """Return the process-wide recent question log."""
+    return _recent_questions
@@ -0,0 +1,207 @@
+import os
+import time
+import logging
+import threading
+from typing import Optional
+
+from sql_agent.metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+# Read-replica routing for agent-generated queries.
+# Agent probes (sample rows, exploratory queries, the final query) are read-only and tolerate
+# data that is a few seconds old, so they do not need to compete with the OLTP workload on the
+# primary. The sandbox (sql_sandbox.py) asks a ReplicaRouter for an engine for every query:
+#   - replicas are readable secondaries: the primary's server with ApplicationIntent=ReadOnly
+#     (REPLICA_APPLICATION_INTENT, Azure SQL / Fabric) and/or explicit SQLAlchemy URLs
+#     (REPLICA_URLS, or "replica_urls" of a data source in data_sources.py). Replica engines are
+#     built by the backend like the primary's, with the read-only login and token injection; a
+#     replica URL only gives the host, port and database, and must be of the primary's dialect
+#   - a background thread checks every replica every REPLICA_CHECK_INTERVAL_SECONDS: it connects
+#     and runs the dialect's lag query (REPLICA_LAG_QUERY overrides it)
+#   - a query goes to the healthy replica with the lowest lag, round robin among replicas whose
+#     lag is within a second of it; replicas lagging more than REPLICA_MAX_LAG_SECONDS are skipped
+#   - the SQL Server lag query reads sys.dm_database_replica_states, which needs
+#     GRANT VIEW DATABASE STATE TO <read-only user>; without the permission (or when the lag query
+#     fails otherwise on a reachable replica) the lag is unknown: the replica is still used, after
+#     the replicas whose lag is known, and the reason is in its stats
+#   - with no usable replica, or when a replica connection fails mid-query, the query runs on
+#     the primary; the failed replica is skipped until its next successful check
+# Schema reflection stays on the primary engine. Routing decisions are counted in /metrics.
+# The router only needs engines, so it can be exercised with SQLite files as stand-ins for
+# the primary and the replicas (a table holding a lag value and REPLICA_LAG_QUERY reading it).
+
+# Seconds the replica is behind its primary, run on the replica itself. NULL counts as no lag.
+LAG_QUERIES = {
+    "mssql": "SELECT MAX(secondary_lag_seconds) FROM sys.dm_database_replica_states WHERE is_local = 1",
+    "postgresql": ("SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                   "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"),
+}
+
+
+class ReplicaState:
+    """A replica engine and the result of its last health check."""
+
+    def __init__(self, name: str, engine):
+        self.name = name
+        self.engine = engine
+        # Not used until the first check has succeeded
+        self.healthy = False
+        # None when the replica does not tell (see lag_error)
+        self.lag_seconds = None
+        self.lag_error = None
+        self.last_checked_at = None
+        self.last_error = None
+
+    def stats(self) -> dict:
+        return {"healthy": self.healthy, "lag_seconds": self.lag_seconds, "lag_error": self.lag_error,
+                "last_checked_at": self.last_checked_at, "last_error": self.last_error}
+
+
+class ReplicaRouter:
+    """Chooses a replica engine for each read-only query, falling back to the primary."""
+
+    def __init__(self, replicas: dict, max_lag_seconds: float = 30, check_interval_seconds: float = 15,
+                 lag_query: Optional[str] = None):
+        self.replicas = [ReplicaState(name, engine) for name, engine in replicas.items()]
+        self.max_lag_seconds = max_lag_seconds
+        self.check_interval_seconds = check_interval_seconds
+        self.lag_query = lag_query
+        self._next = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _lag_query_for(self, engine) -> Optional[str]:
+        return self.lag_query or LAG_QUERIES.get(engine.dialect.name)
+
+    def check(self, replica: ReplicaState) -> None:
+        """Connect to a replica and measure its lag; record the outcome."""
+        try:
+            lag, lag_error = None, None
+            with replica.engine.connect() as connection:
+                lag_query = self._lag_query_for(replica.engine)
+                if lag_query is None:
+                    connection.exec_driver_sql("SELECT 1")
+                    lag = 0.0
+                else:
+                    try:
+                        value = connection.exec_driver_sql(lag_query).scalar()
+                        lag = float(value) if value is not None else 0.0
+                    except Exception as e:
+                        # Connected, so the replica serves queries; typically the login lacks
+                        # VIEW DATABASE STATE (SQL Server)
+                        lag_error = str(e)[:500]
+                        if replica.lag_error is None:
+                            logger.warning("Cannot read the lag of replica %s; using it with an unknown lag "
+                                           "(on SQL Server, GRANT VIEW DATABASE STATE to the read-only login): %s",
+                                           replica.name, e)
+            with self._lock:
+                replica.healthy = True
+                replica.lag_seconds = lag
+                replica.lag_error = lag_error
+                replica.last_error = None
+        except Exception as e:
+            self.mark_failed(replica, e)
+        finally:
+            replica.last_checked_at = time.time()
+
+    def refresh(self) -> None:
+        """Check every replica now."""
+        for replica in self.replicas:
+            self.check(replica)
+
+    def select(self) -> Optional[ReplicaState]:
+        """
+        Pick the replica for the next query.
+
+        Returns:
+        - ReplicaState | None: None when no replica is healthy and recent enough; the query
+          then runs on the primary.
+        """
+        with self._lock:
+            usable = [replica for replica in self.replicas
+                      if replica.healthy and (replica.lag_seconds is None or replica.lag_seconds <= self.max_lag_seconds)]
+            if not usable:
+                get_metrics().increment("replicas.primary_fallback")
+                return None
+            # An unknown lag ranks as the largest acceptable one
+            lags = {replica.name: self.max_lag_seconds if replica.lag_seconds is None else replica.lag_seconds
+                    for replica in usable}
+            lowest_lag = min(lags.values())
+            candidates = [replica for replica in usable if lags[replica.name] <= lowest_lag + 1]
+            replica = candidates[self._next % len(candidates)]
+            self._next += 1
+        get_metrics().increment("replicas.{}.queries".format(replica.name))
+        return replica
+
+    def mark_failed(self, replica: ReplicaState, error: Exception) -> None:
+        """Stop using a replica until its next successful check."""
+        with self._lock:
+            was_healthy = replica.healthy
+            replica.healthy = False
+            replica.last_error = str(error)[:500]
+        get_metrics().increment("replicas.{}.failures".format(replica.name))
+        if was_healthy:
+            logger.warning("Replica %s is unavailable, using the primary: %s", replica.name, error)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {replica.name: replica.stats() for replica in self.replicas}
+
+    def _check_loop(self) -> None:
+        while True:
+            self.refresh()
+            if self._stop.wait(self.check_interval_seconds):
+                return
+
+    def start(self) -> None:
+        """Start the background health checks (the first one runs immediately)."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._check_loop, name="replica-checks", daemon=True)
+        self._thread.start()
+
+    def dispose(self) -> None:
+        self._stop.set()
+        for replica in self.replicas:
+            replica.engine.dispose()
+
+
+def create_replica_router(backend, primary_engine, database: Optional[str] = None,
+                          replica_urls=()) -> Optional[ReplicaRouter]:
+    """
+    Build the replica router of a data source, or None when it has no replicas.
+
+    Parameters:
+    - backend (DatabaseBackend): The backend of the primary; it builds the replica engines too.
+    - primary_engine (Engine): The primary's engine.
+    - database (str): The database on the backend (None for the configured one).
+    - replica_urls (list): SQLAlchemy URLs of readable replicas.
+
+    Returns:
+    - ReplicaRouter | None: Not started; call start() to begin the health checks.
+    """
+    replicas = {}
+    if os.getenv("REPLICA_APPLICATION_INTENT", "false").lower() == "true" and backend.supports_application_intent:
+        replicas["read_only_intent"] = backend.create_engine(read_only=True, database=database,
+                                                             application_intent="ReadOnly")
+    for number, url in enumerate(replica_urls, start=1):
+        try:
+            replicas["replica_{}".format(number)] = backend.create_engine(read_only=True, database=database,
+                                                                          replica_url=url)
+        except ValueError as e:
+            logger.warning("Skipping replica %d of %s: %s", number, primary_engine.url.database, e)
+    if not replicas:
+        return None
+    return ReplicaRouter(
+        replicas,
+        max_lag_seconds=float(os.getenv("REPLICA_MAX_LAG_SECONDS", "30")),
+        check_interval_seconds=float(os.getenv("REPLICA_CHECK_INTERVAL_SECONDS", "15")),
+        lag_query=os.getenv("REPLICA_LAG_QUERY"),
+    )
+
+
+def get_replica_urls() -> list:
+    """Return the replica URLs of the configured database (REPLICA_URLS, ";"-separated)."""
+    return [url.strip() for url in os.getenv("REPLICA_URLS", "").split(";") if url.strip()]
@@ -0,0 +1,112 @@
+import re
+import logging
+from typing import Any, List, Optional
+
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+from sql_agent.result_spool import get_result_spool
+from sql_agent.runtime import get_runtime
+from sql_agent.sql_agent_service import SqlAnswer
+
+logger = logging.getLogger(__name__)
+
+# v2 response contract of POST /v2/generate-sql and GET /v2/results (see main.py).
+# The v1 body nests the answer under "SqlResponse", prefixes every field with its label
+# ("Total Tokens: 812") and repeats the numbers as ...Int/...Float fields so clients can parse
+# them. v2 is a flat, typed model: numbers are numbers, the answer and the SQL carry no labels
+# and there is one field per fact. Bodies are encoded with orjson (ORJSONResponse) when it is
+# installed, which matters once result rows are part of the response.
+# The final SQL statement is run once more through the read-only sandbox, its rows are streamed
+# into the result spool (result_spool.py) and the first page is returned with a continuation
+# token; GET /v2/results?cursor=... returns the next pages. The agent's own runs are not reused:
+# the tool results it saw are truncated or aggregated for the model (result_aggregation.py).
+# v1 (/generate-sql/) is unchanged.
+
+try:
+    import orjson  # noqa: F401
+    from fastapi.responses import ORJSONResponse as FastJSONResponse
+except ImportError:
+    logger.info("orjson is not installed; v2 responses are encoded with the standard json module")
+    FastJSONResponse = JSONResponse
+
+# "Final Answer: " prefixes of the agent output (the semantic layer answer carries one too)
+_ANSWER_PREFIX = re.compile(r"^\s*(Final Answer:\s*)+", re.IGNORECASE)
+_SQL_FENCE = re.compile(r"^```(?:sql)?\s*|\s*```$", re.IGNORECASE)
+
+
+class ResultPage(BaseModel):
+    columns: List[str]
+    rows: List[List[Any]]
+    # Rows in the spooled result (at most RESULT_SPOOL_MAX_ROWS)
+    row_count: int
+    # The query returned more rows than were spooled
+    truncated: bool = False
+    # Pass to GET /v2/results for the next page; None on the last page
+    next_cursor: Optional[str] = None
+
+
+class SqlResponseV2(BaseModel):
+    prompt: str
+    answer: str
+    sql: Optional[str] = None
+    explanation: str = ""
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_tokens: int = 0
+    total_cost: float = 0.0
+    session_id: Optional[str] = None
+    # agent, semantic_layer or topic_gate
+    answered_by: str = "agent"
+    result: Optional[ResultPage] = None
+    # Why result is None although there is a SQL statement (e.g., the query failed)
+    result_error: Optional[str] = None
+
+
+def clean_sql(sql_statement: str) -> str:
+    """Strip code fences and the trailing semicolon from the SQL statement of an answer."""
+    return _SQL_FENCE.sub("", sql_statement.strip()).strip().rstrip(";").strip()
+
+
+def result_page(sql_statement: str, data_source: str = None, page_size: int = 100) -> ResultPage:
+    """Run a query in the read-only sandbox, spool its rows and return the first page."""
+    db = get_runtime(data_source).db
+    spool = get_result_spool()
+    # The rows are streamed into the spool while the query runs, up to RESULT_SPOOL_MAX_ROWS;
+    # a statement without a result set gives an empty page with no columns
+    meta = db.stream(clean_sql(sql_statement), spool.write)
+    return ResultPage(**spool.read_page(meta["spool_id"], page_size=page_size))
+
+
+def build_v2_response(answer: SqlAnswer, data_source: str = None, page_size: int = 100) -> SqlResponseV2:
+    """
+    Shape an answer into the v2 contract, with the first page of its query result.
+
+    Parameters:
+    - answer (SqlAnswer): The answer returned by answer_question.
+    - data_source (str): The data source the question ran against; its query runs there again.
+    - page_size (int): Rows in the first page; 0 returns no result rows.
+
+    Returns:
+    - SqlResponseV2: The response. When the query cannot be run, result is None and result_error says why.
+    """
+    response = SqlResponseV2(
+        prompt=answer.prompt,
+        answer=_ANSWER_PREFIX.sub("", answer.final_answer or "").strip(),
+        sql=clean_sql(answer.sql_statement) if answer.sql_statement else None,
+        explanation=answer.explanation or "",
+        prompt_tokens=answer.prompt_tokens,
+        completion_tokens=answer.completion_tokens,
+        total_tokens=answer.total_tokens,
+        total_cost=answer.total_cost,
+        session_id=answer.session_id,
+        answered_by=answer.answered_by,
+    )
+    if response.sql and page_size > 0:
+        try:
+            response.result = result_page(response.sql, data_source, page_size)
+        except Exception as e:
+            # The answer is still valid; the client can retry with v1 or fix the data source
+            logger.warning("Could not run the answer's SQL for the v2 result: %s", e)
+            response.result_error = str(e)
+    return response
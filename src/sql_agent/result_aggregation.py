@@ -0,0 +1,237 @@
+import re
+import logging
+from decimal import Decimal
+from typing import List, Optional
+
+import pandas as pd
+from langchain_community.agent_toolkits import SQLDatabaseToolkit
+from langchain_community.tools.sql_database.tool import QuerySQLDataBaseTool
+from langchain_community.utilities.sql_database import truncate_word
+from langchain_core.callbacks import CallbackManagerForToolRun
+from langchain_core.tools import BaseTool
+from sqlalchemy.exc import SQLAlchemyError
+
+from sql_agent.metrics import get_metrics
+from sql_agent.sql_sandbox import UnsafeSqlError
+
+logger = logging.getLogger(__name__)
+
+# Arithmetic over query results, done locally instead of by the model.
+# Asked "how many people died in Texas in 2020?", the agent used to list one death count per day
+# and add the numbers up itself: hundreds of rows in the prompt, and a sum that is often wrong.
+# The prompt now asks for SUM/AVG/COUNT/GROUP BY in SQL, and the sql_db_query tool catches the
+# list-then-aggregate pattern when the model lists rows anyway. It applies only when the question
+# asks for a total/average/count/min/max and the query has no aggregate of its own:
+#   - more than RESULT_AGGREGATION_MAX_ROWS rows: the rows are not sent to the model. Sum, average,
+#     min, max and count of every measure column, and sums per group when the result has one
+#     low-cardinality text column, are computed with pandas over the whole result; the model
+#     gets those figures, the first rows and an equivalent aggregate query to cite.
+#   - fewer rows: the rows are sent as usual, followed by the requested figure.
+# Any other result (a plain listing, an already grouped query) is returned as it is; the step
+# retention policy (step_retention.py) bounds its size.
+# Identifier-like columns (id, customer_id, CustomerID) are never summed.
+
+# Checked in order: "average number of" is an average, not a count
+_INTENTS = (
+    ("avg", re.compile(r"\b(average|avg|mean)\b", re.IGNORECASE)),
+    ("count", re.compile(r"\b(how many|number of|count)\b", re.IGNORECASE)),
+    ("sum", re.compile(r"\b(total|sum|altogether|combined|overall|how much)\b", re.IGNORECASE)),
+    ("max", re.compile(r"\b(highest|maximum|max|largest|biggest|most)\b", re.IGNORECASE)),
+    ("min", re.compile(r"\b(lowest|minimum|min|smallest|least|fewest)\b", re.IGNORECASE)),
+)
+
+_AGGREGATE_SQL = re.compile(r"\b(SUM|AVG|COUNT|MIN|MAX)\s*\(|\bGROUP\s+BY\b", re.IGNORECASE)
+_ID_COLUMN = re.compile(r"(^id$|_id$|[a-z]ID$|^key$|_key$)")
+_TRAILING_ORDER_BY = re.compile(r"\s+ORDER\s+BY\s+[^()]*$", re.IGNORECASE)
+_ROW_LIMIT = re.compile(r"\b(TOP|LIMIT|OFFSET|FETCH)\b", re.IGNORECASE)
+
+# pandas aggregation -> SQL aggregate
+_SQL_FUNCTIONS = {"sum": "SUM", "mean": "AVG", "min": "MIN", "max": "MAX", "count": "COUNT"}
+
+
+def detect_intent(question: str) -> Optional[str]:
+    """The aggregate a question asks for: avg, count, sum, max, min, or None."""
+    for intent, pattern in _INTENTS:
+        if pattern.search(question or ""):
+            return intent
+    return None
+
+
+def has_aggregate(sql: str) -> bool:
+    """Whether a query already aggregates (an aggregate function or GROUP BY)."""
+    return bool(_AGGREGATE_SQL.search(sql))
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float, Decimal)) and not isinstance(value, bool)
+
+
+def result_frame(rows: List[dict]) -> tuple:
+    """
+    Load query rows into a DataFrame and split its columns.
+
+    Returns:
+    - tuple: (DataFrame, measure columns, dimension columns). Measures are numeric, non-identifier
+      columns, converted to float; dimensions are the text columns.
+    """
+    frame = pd.DataFrame.from_records(rows)
+    measures = []
+    dimensions = []
+    for column in frame.columns:
+        values = frame[column].dropna()
+        if len(values) and values.map(_is_number).all():
+            if not _ID_COLUMN.search(str(column)):
+                # Decimal columns arrive as objects; float64 makes the aggregations vectorized
+                frame[column] = pd.to_numeric(frame[column], errors="coerce").astype("float64")
+                measures.append(column)
+        elif len(values) and values.map(lambda value: isinstance(value, str)).all():
+            dimensions.append(column)
+    return frame, measures, dimensions
+
+
+def _number(value):
+    value = float(value)
+    return int(value) if value.is_integer() else round(value, 4)
+
+
+def aggregate_query(sql: str, function: str, column: Optional[str], quote=lambda name: name) -> str:
+    """Wrap a listing query into an aggregate over one of its columns (None: COUNT(*))."""
+    inner = sql.strip().rstrip(";").strip()
+    if not _ROW_LIMIT.search(inner):
+        # ORDER BY is not allowed in a derived table on SQL Server and does not change the result
+        inner = _TRAILING_ORDER_BY.sub("", inner)
+    if column is None:
+        alias, expression = "row_count", "*"
+    else:
+        alias = "{}_{}".format(function.lower(), re.sub(r"\W+", "_", str(column)).strip("_").lower())
+        expression = quote(str(column))
+    return "SELECT {}({}) AS {} FROM ({}) AS t".format(function, expression, alias, inner)
+
+
+def _named_measure(measures: list, question: str):
+    # The measure the question mentions (e.g., "price" in "average price"), else the first one
+    words = set(re.findall(r"[a-z0-9]+", (question or "").lower()))
+    for column in measures:
+        if set(re.findall(r"[a-z0-9]+", str(column).lower())) & words:
+            return column
+    return measures[0]
+
+
+def requested_figures(frame, measures: list, intent: str, question: str = "") -> list:
+    """(SQL function, column, value) of each figure the question may ask for."""
+    figures = []
+    if intent == "count":
+        # "How many loans" counts rows; "how many people died" sums a column that holds counts
+        figures.append(("COUNT", None, len(frame)))
+    if measures:
+        aggregation = {"count": "sum", "avg": "mean"}.get(intent, intent)
+        column = _named_measure(measures, question)
+        figures.append((_SQL_FUNCTIONS[aggregation], column, _number(frame[column].agg(aggregation))))
+    return figures
+
+
+def _describe(figures: list) -> str:
+    return "; ".join("{}({}) = {}".format(function, column or "*", value) for function, column, value in figures)
+
+
+def format_rows(rows: List[dict], max_string_length: int = 300) -> str:
+    """Render rows the way SQLDatabase.run does (a list of tuples)."""
+    if not rows:
+        return ""
+    return str([tuple(truncate_word(value, length=max_string_length) for value in row.values()) for row in rows])
+
+
+def summarize_rows(rows: List[dict], sql: str, question: str, max_rows: int = 30, max_groups: int = 20,
+                   preview_rows: int = 5, quote=lambda name: name, max_string_length: int = 300) -> Optional[str]:
+    """
+    Replace a long listing by locally computed aggregates, or append the figure a question asks for.
+
+    Parameters:
+    - rows (list): Query result rows as dictionaries.
+    - sql (str): The query that produced them.
+    - question (str): The user's question; its wording selects the requested figure.
+    - max_rows (int): Longer results are summarized instead of listed.
+    - quote (callable): Quotes identifiers in the suggested aggregate query.
+
+    Returns:
+    - str | None: The observation for the model, or None to return the rows unchanged (always
+      when the question asks for no aggregate or the query already has one).
+    """
+    intent = detect_intent(question)
+    # The model needs the rows of listings and of queries that already aggregate
+    if intent is None or len(rows) < 2 or has_aggregate(sql):
+        return None
+    listed = len(rows) <= max_rows
+
+    frame, measures, dimensions = result_frame(rows)
+    figures = requested_figures(frame, measures, intent, question)
+    if listed:
+        if not figures:
+            return None
+        get_metrics().increment("result_aggregation.figures")
+        return "{}\nComputed over these {} rows: {}. Use these figures; do not redo the arithmetic.".format(
+            format_rows(rows, max_string_length), len(rows), _describe(figures))
+    if not measures and not figures:
+        # Nothing to compute (e.g., a list of names); the step retention policy bounds its size
+        return None
+
+    get_metrics().increment("result_aggregation.summarized")
+    lines = ["The query returned {} rows. They were aggregated locally instead of being listed: use these "
+             "figures and do not add up rows yourself.".format(len(rows))]
+    if figures:
+        lines.append("Requested figure: " + _describe(figures))
+        if len(figures) > 1:
+            lines.append("(COUNT(*) counts the rows; use the SUM when each row already holds a count.)")
+    if measures:
+        statistics = frame[measures].agg(["sum", "mean", "min", "max", "count"])
+        lines.append("Over all rows:")
+        for column in measures:
+            lines.append("  {}: sum {}, avg {}, min {}, max {}, non-null {}".format(
+                column, *(_number(statistics.at[name, column]) for name in ("sum", "mean", "min", "max", "count"))))
+        if len(dimensions) == 1 and 1 < frame[dimensions[0]].nunique() <= max_groups:
+            totals = frame.groupby(dimensions[0])[measures[0]].sum().sort_values(ascending=False)
+            lines.append("Sum of {} by {}: {}".format(measures[0], dimensions[0], ", ".join(
+                "{} {}".format(group, _number(total)) for group, total in totals.items())))
+    lines.append("First {} rows: {}".format(min(preview_rows, len(rows)), format_rows(rows[:preview_rows], max_string_length)))
+    if figures:
+        lines.append("Equivalent aggregate queries (cite the one you use in your Final Answer):")
+        lines.extend("  " + aggregate_query(sql, function, column, quote) for function, column, _ in figures)
+    return "\n".join(lines)
+
+
+class AggregatingQueryTool(QuerySQLDataBaseTool):
+    """sql_db_query that computes totals locally instead of sending long listings to the model."""
+
+    question: str = ""
+    max_rows: int = 30
+
+    def _run(self, query: str, run_manager: Optional[CallbackManagerForToolRun] = None) -> str:
+        try:
+            rows = self.db._execute(query, fetch="all")
+        except (UnsafeSqlError, SQLAlchemyError) as e:
+            logger.warning("Sandbox rejected or failed agent query: %s", e)
+            return f"Error: {e}"
+        max_string_length = getattr(self.db, "_max_string_length", 300)
+        try:
+            summary = summarize_rows(rows, query, self.question, max_rows=self.max_rows,
+                                     quote=self.db._engine.dialect.identifier_preparer.quote,
+                                     max_string_length=max_string_length)
+        except Exception as e:
+            # The listing is still a correct answer to the query
+            logger.warning("Could not aggregate the query result locally: %s", e)
+            summary = None
+        return summary if summary is not None else format_rows(rows, max_string_length)
+
+
+class AggregatingSQLDatabaseToolkit(SQLDatabaseToolkit):
+    """SQLDatabaseToolkit whose sql_db_query tool aggregates long results locally."""
+
+    question: str = ""
+    max_rows: int = 30
+
+    def get_tools(self) -> List[BaseTool]:
+        tools = super().get_tools()
+        return [AggregatingQueryTool(db=self.db, description=tool.description, question=self.question,
+                                     max_rows=self.max_rows)
+                if isinstance(tool, QuerySQLDataBaseTool) else tool
+                for tool in tools]
@@ -0,0 +1,210 @@
+import os
+import re
+import hmac
+import json
+import time
+import uuid
+import base64
+import hashlib
+import logging
+import tempfile
+import datetime
+import threading
+from decimal import Decimal
+from typing import Iterable, Optional
+
+from sql_agent.metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+# Server-side spool of query results for the paginated v2 responses (response_v2.py).
+# The v1 response only returns the SQL; a client that wants the rows re-runs it or receives them
+# all at once. v2 runs the final query once, writes its rows to a spool file and returns the first
+# page with a continuation token; GET /v2/results?cursor=... returns the following pages.
+#   - a spool is a JSON Lines file (one row per line) plus a small meta file with the columns,
+#     the row count and the expiry time, in RESULT_SPOOL_DIR; spools older than
+#     RESULT_SPOOL_TTL_SECONDS are pruned when new ones are written
+#   - at most RESULT_SPOOL_MAX_ROWS rows are spooled; the page says when the result was cut
+#   - a cursor is the spool id, the next row and its byte offset in the file, signed with
+#     RESULT_SPOOL_SECRET (HMAC-SHA256) and base64url-encoded; a page is read by seeking to the
+#     offset, so late pages cost the same as the first one
+# The spool directory must be shared by the workers that serve the cursors, and so must the
+# secret: without RESULT_SPOOL_SECRET every process signs with its own random key.
+
+SPOOL_SUFFIX = ".jsonl"
+META_SUFFIX = ".meta.json"
+_SPOOL_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+class InvalidCursorError(ValueError):
+    """The cursor was not issued by this service (or was altered)."""
+
+
+class ExpiredCursorError(LookupError):
+    """The spool the cursor points into has expired or was removed."""
+
+
+def to_json_value(value):
+    """Normalize a database value to a JSON type (Decimal -> float, dates -> ISO 8601, bytes -> hex)."""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    return str(value)
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+class ResultSpool:
+    """Spooled query results, read back a page at a time through signed cursors."""
+
+    def __init__(self, directory: str = None, ttl_seconds: int = 3600, max_rows: int = 100000,
+                 secret: Optional[str] = None):
+        self.directory = directory or os.path.join(tempfile.gettempdir(), "sql_agent_results")
+        self.ttl_seconds = ttl_seconds
+        self.max_rows = max_rows
+        if secret:
+            self._key = secret.encode("utf-8")
+        else:
+            self._key = os.urandom(32)
+            logger.info("RESULT_SPOOL_SECRET is not set; cursors are valid only in this process")
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "ResultSpool":
+        return cls(
+            directory=os.getenv("RESULT_SPOOL_DIR"),
+            ttl_seconds=int(os.getenv("RESULT_SPOOL_TTL_SECONDS", "3600")),
+            max_rows=int(os.getenv("RESULT_SPOOL_MAX_ROWS", "100000")),
+            secret=os.getenv("RESULT_SPOOL_SECRET"),
+        )
+
+    def _path(self, spool_id: str, suffix: str) -> str:
+        return os.path.join(self.directory, spool_id + suffix)
+
+    def _prune(self) -> None:
+        cutoff = time.time() - self.ttl_seconds
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.name.endswith((SPOOL_SUFFIX, META_SUFFIX)) and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError:
+                # Another worker removed it first
+                pass
+
+    def encode_cursor(self, spool_id: str, row: int, offset: int) -> str:
+        payload = json.dumps([spool_id, row, offset], separators=(",", ":")).encode("utf-8")
+        signature = hmac.new(self._key, payload, hashlib.sha256).digest()[:16]
+        return _b64encode(payload) + "." + _b64encode(signature)
+
+    def decode_cursor(self, cursor: str) -> tuple:
+        """Return (spool id, row, byte offset) of a cursor issued by encode_cursor."""
+        try:
+            payload_text, signature_text = cursor.split(".", 1)
+            payload = _b64decode(payload_text)
+            signature = _b64decode(signature_text)
+        except (ValueError, AttributeError):
+            raise InvalidCursorError("Malformed cursor.")
+        if not hmac.compare_digest(hmac.new(self._key, payload, hashlib.sha256).digest()[:16], signature):
+            raise InvalidCursorError("Invalid cursor.")
+        spool_id, row, offset = json.loads(payload)
+        if not _SPOOL_ID.match(spool_id):
+            raise InvalidCursorError("Invalid cursor.")
+        return spool_id, int(row), int(offset)
+
+    def write(self, columns: list, rows: Iterable) -> dict:
+        """
+        Spool the rows of a query result.
+
+        Parameters:
+        - columns (list): Column names.
+        - rows (iterable): Row tuples, e.g. streamed by ReadOnlySQLDatabase.stream; at most
+          max_rows + 1 are read (the extra row only tells that the result was cut).
+
+        Returns:
+        - dict: The spool meta data (spool_id, columns, row_count, truncated, expires_at).
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            self._prune()
+        spool_id = uuid.uuid4().hex
+        row_count = 0
+        truncated = False
+        with open(self._path(spool_id, SPOOL_SUFFIX), "w", encoding="utf-8") as f:
+            for row in rows:
+                if row_count >= self.max_rows:
+                    truncated = True
+                    break
+                f.write(json.dumps([to_json_value(value) for value in row], ensure_ascii=False))
+                f.write("\n")
+                row_count += 1
+        meta = {"spool_id": spool_id, "columns": [str(column) for column in columns], "row_count": row_count,
+                "truncated": truncated, "expires_at": time.time() + self.ttl_seconds}
+        with open(self._path(spool_id, META_SUFFIX), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        metrics = get_metrics()
+        metrics.increment("result_spool.spools")
+        metrics.observe("result_spool.rows", row_count)
+        return meta
+
+    def read_meta(self, spool_id: str) -> dict:
+        try:
+            with open(self._path(spool_id, META_SUFFIX), encoding="utf-8") as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            raise ExpiredCursorError("The result has expired; ask the question again.")
+        if meta["expires_at"] < time.time():
+            raise ExpiredCursorError("The result has expired; ask the question again.")
+        return meta
+
+    def read_page(self, spool_id: str, row: int = 0, offset: int = 0, page_size: int = 100) -> dict:
+        """
+        Read page_size rows starting at a row (and its byte offset in the spool file).
+
+        Returns:
+        - dict: columns, rows (lists of values), row_count, truncated and next_cursor (None on the last page).
+        """
+        meta = self.read_meta(spool_id)
+        rows = []
+        try:
+            with open(self._path(spool_id, SPOOL_SUFFIX), "rb") as f:
+                f.seek(offset)
+                while len(rows) < page_size:
+                    line = f.readline()
+                    if not line:
+                        break
+                    rows.append(json.loads(line))
+                offset = f.tell()
+        except FileNotFoundError:
+            raise ExpiredCursorError("The result has expired; ask the question again.")
+        next_row = row + len(rows)
+        next_cursor = self.encode_cursor(spool_id, next_row, offset) if next_row < meta["row_count"] else None
+        get_metrics().increment("result_spool.pages")
+        return {"columns": meta["columns"], "rows": rows, "row_count": meta["row_count"],
+                "truncated": meta["truncated"], "next_cursor": next_cursor}
+
+    def read_cursor(self, cursor: str, page_size: int = 100) -> dict:
+        spool_id, row, offset = self.decode_cursor(cursor)
+        return self.read_page(spool_id, row, offset, page_size)
+
+
+_result_spool = None
+_result_spool_lock = threading.Lock()
+
+
+def get_result_spool() -> ResultSpool:
+    global _result_spool
+    with _result_spool_lock:
+        if _result_spool is None:
+            _result_spool = ResultSpool.from_env()
+        return _result_spool
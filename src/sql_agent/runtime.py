@@ -0,0 +1,255 @@
+import gc
+import os
+import sys
+import time
+import types
+import logging
+import threading
+from collections import OrderedDict
+
+from sql_agent.data_sources import DEFAULT_DATA_SOURCE, get_data_source
+from sql_agent.db_connection import create_read_only_engine
+from sql_agent.metrics import get_metrics
+from sql_agent.replica_routing import create_replica_router
+from sql_agent.sql_sandbox import ReadOnlySQLDatabase
+
+logger = logging.getLogger(__name__)
+
+# Process-wide database runtimes: one engine (with its connection pool) and one sandboxed
+# SQLDatabase per data source, shared by every request for that data source.
+# Creating them per request meant every request opened new connections and reflected the
+# schema again. Shared, the pool keeps connections open between requests, reflected tables
+# stay in the SQLDatabase's metadata, and the warm-up scheduler (warmup.py) can prepare the
+# default one before the first request arrives.
+# With several data sources (data_sources.py), the runtimes are kept in a bounded LRU pool:
+#   - RUNTIME_POOL_MAX_ENTRIES   runtimes kept at most; the least recently used one is evicted
+#   - RUNTIME_POOL_MAX_MB        budget for the reflected schemas of all runtimes, measured as the
+#                                deep size of each runtime's MetaData (estimate_metadata_bytes)
+#   - RUNTIME_IDLE_SECONDS       runtimes unused for this long are evicted (checked on access and
+#                                by the warm-up scheduler's background upkeep)
+# The default data source is never evicted for size or idleness. Evicting a runtime disposes
+# its engine, which closes its idle connections; connections still in use by a request are
+# closed when they are returned.
+# A runtime is also recreated when its backend reports its engine as stale (for example, the
+# file sources behind the DuckDB backend changed).
+# Agents and toolkits are still built per request: they bind the model tier and the prompt.
+
+
+# Shared by every runtime (classes, code, modules), so not part of a schema's size
+_SHARED_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType,
+                 types.CodeType)
+
+
+def estimate_metadata_bytes(metadata, max_objects: int = 1000000) -> int:
+    """
+    Approximate memory held by the reflected schema: the deep size of the MetaData object graph.
+
+    Parameters:
+    - metadata (MetaData): The SQLDatabase's metadata.
+    - max_objects (int): Objects visited at most, so sizing a huge schema stays bounded in time.
+
+    Returns:
+    - int: Bytes of the tables, columns, constraints, indexes, types and the strings and dicts they hold.
+    """
+    seen = set()
+    pending = [metadata]
+    size = 0
+    while pending and len(seen) < max_objects:
+        obj = pending.pop()
+        if id(obj) in seen or isinstance(obj, _SHARED_TYPES):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        pending.extend(gc.get_referents(obj))
+    return size
+
+
+class DatabaseRuntime:
+    """Engine and sandboxed SQLDatabase of one data source."""
+
+    def __init__(self, data_source=None):
+        self.data_source = data_source or get_data_source()
+        self.backend = self.data_source.backend
+        self.database_name = self.data_source.database_name()
+        self.engine = create_read_only_engine(self.data_source)
+        # ReadOnlySQLDatabase is the execution sandbox: every agent query is validated and run
+        # in a read-only transaction that is always rolled back (see sql_sandbox.py).
+        self.db = ReadOnlySQLDatabase(self.engine)
+        # Agent queries go to readable replicas when the data source has any (replica_routing.py)
+        self.replica_router = create_replica_router(self.backend, self.engine, self.data_source.database,
+                                                    self.data_source.replica_urls)
+        if self.replica_router is not None:
+            self.db.set_replica_router(self.replica_router)
+            self.replica_router.start()
+        self.created_at = time.time()
+        self.last_used_at = self.created_at
+        self.requests = 0
+        self._sized_tables = -1
+        self._memory_bytes = 0
+
+    @property
+    def is_default(self) -> bool:
+        return self.data_source.is_default
+
+    def memory_bytes(self) -> int:
+        """Approximate memory of the reflected schema of this runtime."""
+        # Re-estimated only when more tables have been reflected since the last call
+        table_count = len(self.db._metadata.tables)
+        if table_count != self._sized_tables:
+            self._memory_bytes = estimate_metadata_bytes(self.db._metadata)
+            self._sized_tables = table_count
+        return self._memory_bytes
+
+    def stats(self) -> dict:
+        pool = self.engine.pool
+        return {
+            "database": self.database_name,
+            "backend": self.backend.name,
+            "requests": self.requests,
+            "idle_seconds": round(time.time() - self.last_used_at, 1),
+            "memory_bytes": self.memory_bytes(),
+            "pooled_connections": pool.checkedin() if hasattr(pool, "checkedin") else None,
+            "replicas": self.replica_router.stats() if self.replica_router is not None else {},
+        }
+
+    def dispose(self) -> None:
+        """Close the pooled connections (and stop the replica health checks)."""
+        if self.replica_router is not None:
+            self.replica_router.dispose()
+        self.engine.dispose()
+
+
+class RuntimePool:
+    """Bounded LRU of per-data-source runtimes with idle and memory-based eviction."""
+
+    def __init__(self, max_entries: int = 16, max_bytes: int = 256 * 2 ** 20, idle_seconds: float = 900):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self._runtimes = OrderedDict()
+        self._creation_locks = {}
+        self._evicted = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "RuntimePool":
+        return cls(
+            max_entries=int(os.getenv("RUNTIME_POOL_MAX_ENTRIES", "16")),
+            max_bytes=int(float(os.getenv("RUNTIME_POOL_MAX_MB", "256")) * 2 ** 20),
+            idle_seconds=float(os.getenv("RUNTIME_IDLE_SECONDS", "900")),
+        )
+
+    def _evict(self, name: str, reason: str) -> None:
+        # Disposed by _dispose_evicted once the pool lock is released: closing connections can be
+        # slow and must not hold up requests for the other data sources
+        self._evicted.append(self._runtimes.pop(name))
+        get_metrics().increment("runtime_pool.evicted." + reason)
+        logger.info("Evicted the runtime of data source %s (%s)", name, reason)
+
+    def _dispose_evicted(self) -> None:
+        with self._lock:
+            evicted, self._evicted = self._evicted, []
+        for runtime in evicted:
+            runtime.dispose()
+
+    def _evictable(self) -> list:
+        # Least recently used first; the default data source stays
+        return [name for name, runtime in self._runtimes.items() if not runtime.is_default]
+
+    def _enforce_limits(self) -> None:
+        now = time.time()
+        for name in self._evictable():
+            if now - self._runtimes[name].last_used_at > self.idle_seconds:
+                self._evict(name, "idle")
+        while len(self._runtimes) > self.max_entries and self._evictable():
+            self._evict(self._evictable()[0], "size")
+        # Keep the most recently used runtime even when it alone is over the budget
+        while self._evictable()[:-1] and self.total_bytes() > self.max_bytes:
+            self._evict(self._evictable()[0], "memory")
+
+    def total_bytes(self) -> int:
+        return sum(runtime.memory_bytes() for runtime in self._runtimes.values())
+
+    def _lookup(self, name: str):
+        runtime = self._runtimes.get(name)
+        if runtime is not None and runtime.backend.engine_is_stale():
+            logger.info("Database engine of %s is stale; recreating it", name)
+            self._evict(name, "stale")
+            runtime = None
+        return runtime
+
+    def get(self, data_source) -> DatabaseRuntime:
+        name = data_source.name
+        try:
+            with self._lock:
+                runtime = self._lookup(name)
+                creation_lock = self._creation_locks.setdefault(name, threading.Lock()) if runtime is None else None
+            if runtime is None:
+                # One creation per data source at a time, outside the pool lock so that a slow
+                # connection to one database does not hold up requests for the others
+                with creation_lock:
+                    with self._lock:
+                        runtime = self._lookup(name)
+                    if runtime is None:
+                        runtime = DatabaseRuntime(data_source)
+                        with self._lock:
+                            self._runtimes[name] = runtime
+                        get_metrics().increment("runtime_pool.created")
+            with self._lock:
+                if self._runtimes.get(name) is runtime:
+                    self._runtimes.move_to_end(name)
+                runtime.last_used_at = time.time()
+                runtime.requests += 1
+                self._enforce_limits()
+        finally:
+            self._dispose_evicted()
+        return runtime
+
+    def evict_idle(self) -> None:
+        with self._lock:
+            self._enforce_limits()
+        self._dispose_evicted()
+
+    def stats(self) -> dict:
+        with self._lock:
+            runtimes = {name: runtime.stats() for name, runtime in self._runtimes.items()}
+        return {"entries": len(runtimes), "max_entries": self.max_entries,
+                "memory_bytes": sum(runtime["memory_bytes"] for runtime in runtimes.values()),
+                "max_bytes": self.max_bytes, "runtimes": runtimes}
+
+    def clear(self) -> None:
+        with self._lock:
+            for name in list(self._runtimes):
+                self._evict(name, "shutdown")
+        self._dispose_evicted()
+
+
+_runtime_pool = None
+_runtime_pool_lock = threading.Lock()
+
+
+def get_runtime_pool() -> RuntimePool:
+    """Return the process-wide runtime pool."""
+    global _runtime_pool
+    with _runtime_pool_lock:
+        if _runtime_pool is None:
+            _runtime_pool = RuntimePool.from_env()
+        return _runtime_pool
+
+
+def get_runtime(data_source: str = None) -> DatabaseRuntime:
+    """
+    Return the shared runtime of a data source, creating it on first use.
+
+    Parameters:
+    - data_source (str): A declared data source name (see data_sources.py). Defaults to "default".
+
+    Returns:
+    - DatabaseRuntime: Recreated when the backend reports its engine as stale.
+    """
+    return get_runtime_pool().get(get_data_source(data_source or DEFAULT_DATA_SOURCE))
+
+
+def reset_runtime() -> None:
+    """Dispose every runtime (e.g., at shutdown); the next call to get_runtime recreates it."""
+    get_runtime_pool().clear()
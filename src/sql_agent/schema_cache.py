@@ -0,0 +1,76 @@
+import os
+import json
+import logging
+import threading
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Local cache for schema metadata produced by offline jobs.
+# Files are stored per database as <database>.<kind>.json, for example:
+#   - loansdb.schema.json:        reflected tables, columns and types
+#   - loansdb.column_stats.json:  column profiles built by column_profiler.py
+# The agent reads these files at question time instead of querying the database.
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(__file__), "cache")
+
+# Parsed files, keyed by path and invalidated when the file's modification time changes
+_loaded = {}
+_loaded_lock = threading.Lock()
+
+
+def get_cache_dir() -> str:
+    """Return the schema cache directory (SCHEMA_CACHE_DIR or sql_agent/cache)."""
+    return os.getenv("SCHEMA_CACHE_DIR", DEFAULT_CACHE_DIR)
+
+
+def get_cache_path(database: str, kind: str) -> str:
+    """
+    Build the path of a cache file.
+
+    Parameters:
+    - database (str): The database name.
+    - kind (str): The cached artifact, e.g. "schema" or "column_stats".
+
+    Returns:
+    - str: The absolute path of the cache file.
+    """
+    safe_name = "".join(ch if ch.isalnum() or ch in "-_" else "_" for ch in database)
+    return os.path.join(get_cache_dir(), "{}.{}.json".format(safe_name, kind))
+
+
+def save_cache(database: str, kind: str, payload: dict) -> str:
+    """Write a cache file atomically and return its path."""
+    path = get_cache_path(database, kind)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2, default=str)
+    os.replace(temp_path, path)
+    logger.info("Saved %s cache for %s to %s", kind, database, path)
+    return path
+
+
+def load_cache(database: str, kind: str) -> Optional[dict]:
+    """Read a cache file, returning None when it does not exist or cannot be parsed."""
+    path = get_cache_path(database, kind)
+    try:
+        modified = os.path.getmtime(path)
+    except OSError:
+        return None
+
+    with _loaded_lock:
+        cached = _loaded.get(path)
+        if cached and cached[0] == modified:
+            return cached[1]
+
+    try:
+        with open(path, encoding="utf-8") as f:
+            payload = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning("Ignoring unreadable %s cache %s: %s", kind, path, e)
+        return None
+
+    with _loaded_lock:
+        _loaded[path] = (modified, payload)
+    return payload
@@ -0,0 +1,163 @@
+import os
+import re
+import json
+import logging
+from dataclasses import dataclass
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Semantic layer for common metrics.
+# Many questions are the same aggregations over large fact tables ("average credit score by
+# ownership type"). semantic_layer.json declares:
+#   - metrics:        named aggregates over a base table, with the phrases users say for them
+#   - dimensions:     columns the metrics can be grouped by, with their phrases
+#   - pre_aggregates: summary tables or indexed views at a coarser grain, with one
+#                     re-aggregation expression per metric they can answer
+# A question that names exactly one metric and only known dimensions (and nothing else, such as
+# a filter) is routed to the smallest matching pre-aggregate, or to the base table when none
+# covers it. The SQL is generated and executed without an LLM round trip. Anything else falls
+# through to the agent.
+# The layer is opt-in (SEMANTIC_LAYER_ENABLED=true): the bundled config describes the loans
+# table and its pre-aggregate, which other databases do not have. Routes only use the tables that
+# exist in the database the question runs against, so a missing pre-aggregate falls back to the
+# base table and a missing base table sends the question to the agent.
+
+SEMANTIC_LAYER_PATH = os.path.join(os.path.dirname(__file__), "semantic_layer.json")
+
+# Words that may appear around metric/dimension phrases without changing the question
+_FILLER_WORDS = frozenset({
+    "a", "all", "an", "and", "are", "broken", "by", "calculate", "can", "compute", "down", "each", "for",
+    "get", "give", "grouped", "i", "in", "is", "list", "listing", "me", "of", "per", "please",
+    "produce", "report", "see", "show", "split", "table", "tell", "the", "their", "to", "what",
+    "whats", "would", "you", "like",
+})
+
+
+@dataclass
+class SemanticRoute:
+    """A question resolved to a metric, its dimensions and the SQL that answers it."""
+    metric: str
+    dimensions: List[str]
+    source: str
+    sql_statement: str
+    uses_pre_aggregate: bool
+
+
+def _normalize(text: str) -> str:
+    return " ".join(re.findall(r"[a-z0-9_]+", text.lower()))
+
+
+class SemanticLayer:
+    """Routes metric questions to pre-aggregated tables using a declarative config."""
+
+    def __init__(self, config: dict):
+        self.metrics = {metric["name"]: metric for metric in config.get("metrics", [])}
+        self.dimensions = {dimension["name"]: dimension for dimension in config.get("dimensions", [])}
+        self.pre_aggregates = config.get("pre_aggregates", [])
+        self.filler_words = _FILLER_WORDS | frozenset(config.get("ignore_words", []))
+
+    @classmethod
+    def from_file(cls, path: str = SEMANTIC_LAYER_PATH) -> Optional["SemanticLayer"]:
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def _find_phrases(self, question: str, definitions: dict) -> tuple:
+        """Return the definitions whose phrases occur in the question, and the question without them."""
+        found = []
+        # Longest phrases first, so "average credit score" wins over "credit score"
+        phrases = sorted(
+            ((_normalize(phrase), name) for name, definition in definitions.items()
+             for phrase in [name.replace("_", " ")] + definition.get("synonyms", [])),
+            key=lambda pair: len(pair[0]), reverse=True,
+        )
+        for phrase, name in phrases:
+            pattern = r"\b{}\b".format(re.escape(phrase))
+            if re.search(pattern, question):
+                if name not in found:
+                    found.append(name)
+                question = re.sub(pattern, " ", question)
+        return found, question
+
+    def route(self, question: str, available_tables: list = None) -> Optional[SemanticRoute]:
+        """
+        Resolve a question to SQL over a pre-aggregate (or the base table).
+
+        Parameters:
+        - question (str): The user's question.
+        - available_tables (list): Tables of the database (e.g. SQLDatabase.get_usable_table_names());
+          pre-aggregates and base tables that are not in it are not used. None trusts the config.
+
+        Returns:
+        - SemanticRoute | None: None when the question is not a plain metric-by-dimension question.
+        """
+        normalized = _normalize(question)
+        metrics, remainder = self._find_phrases(normalized, self.metrics)
+        if len(metrics) != 1:
+            return None
+        dimensions, remainder = self._find_phrases(remainder, self.dimensions)
+
+        # Anything left over (a filter, a year, a second question) needs the agent
+        leftover = [word for word in remainder.split() if word not in self.filler_words]
+        if leftover:
+            logger.debug("Semantic layer skipped question; unrecognized words: %s", leftover)
+            return None
+
+        metric = self.metrics[metrics[0]]
+        columns = [self.dimensions[name]["column"] for name in dimensions]
+        available = None if available_tables is None else {table.split(".")[-1].lower() for table in available_tables}
+
+        def exists(table: str) -> bool:
+            return available is None or table.split(".")[-1].lower() in available
+
+        # Smallest pre-aggregate that has every requested dimension and can compute the metric
+        candidates = [
+            aggregate for aggregate in self.pre_aggregates
+            if metric["name"] in aggregate.get("metrics", {}) and set(dimensions) <= set(aggregate.get("dimensions", []))
+            and exists(aggregate["table"])
+        ]
+        if candidates:
+            aggregate = min(candidates, key=lambda candidate: candidate.get("row_estimate", float("inf")))
+            source, expression, uses_pre_aggregate = aggregate["table"], aggregate["metrics"][metric["name"]], True
+        elif exists(metric["table"]):
+            source, expression, uses_pre_aggregate = metric["table"], metric["expression"], False
+        else:
+            logger.debug("Semantic layer skipped question; table %s is not in the database", metric["table"])
+            return None
+
+        select_list = columns + ["{} AS {}".format(expression, metric["name"])]
+        sql_statement = "SELECT {} FROM {}".format(", ".join(select_list), source)
+        if columns:
+            sql_statement += " GROUP BY {} ORDER BY {}".format(", ".join(columns), ", ".join(columns))
+
+        return SemanticRoute(metric=metric["name"], dimensions=dimensions, source=source,
+                             sql_statement=sql_statement, uses_pre_aggregate=uses_pre_aggregate)
+
+
+def format_rows_as_markdown(rows: list, max_rows: int = 30) -> str:
+    """Render result rows (dicts) as a Markdown table."""
+    if not rows:
+        return "The query returned no rows."
+    headers = list(rows[0].keys())
+    lines = ["| " + " | ".join(headers) + " |", "|" + "---|" * len(headers)]
+    for row in rows[:max_rows]:
+        lines.append("| " + " | ".join(str(row[header]) for header in headers) + " |")
+    if len(rows) > max_rows:
+        lines.append("\n({} more rows not shown)".format(len(rows) - max_rows))
+    return "\n".join(lines)
+
+
+_semantic_layer = None
+_semantic_layer_loaded = False
+
+
+def get_semantic_layer() -> Optional[SemanticLayer]:
+    """Return the configured semantic layer, or None when it is not enabled (SEMANTIC_LAYER_ENABLED) or not configured."""
+    global _semantic_layer, _semantic_layer_loaded
+    if not _semantic_layer_loaded:
+        if os.getenv("SEMANTIC_LAYER_ENABLED", "false").lower() in ("true", "1", "yes"):
+            _semantic_layer = SemanticLayer.from_file(os.getenv("SEMANTIC_LAYER_PATH", SEMANTIC_LAYER_PATH))
+        _semantic_layer_loaded = True
+    return _semantic_layer
@@ -0,0 +1,140 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field, asdict
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Server-side conversation sessions.
+# Each /generate-sql/ call used to start from scratch. When a user refines a question
+# ("now only for 2021"), the agent re-listed tables, re-fetched schemas and re-derived the query.
+# A session keeps the last few turns (question, SQL, tables used, short result summary) so the
+# agent can edit the previous query instead of re-planning.
+# Two backends are provided:
+#   - InMemorySessionStore: bounded LRU with a TTL, per process (default).
+#   - RedisSessionStore: any Redis-compatible server, selected with SESSION_STORE_URL.
+# Sessions are stored per data source (session_key): a session id sent with another data source
+# starts a new conversation there instead of replaying SQL written for a different database.
+
+
+@dataclass
+class SessionTurn:
+    """One completed question/answer exchange within a session."""
+    question: str
+    sql_statement: str
+    tables: List[str] = field(default_factory=list)
+    result_summary: str = ""
+    created_at: float = field(default_factory=time.time)
+
+
+class InMemorySessionStore:
+    """Bounded, thread-safe, in-process session store with LRU eviction and idle expiry."""
+
+    def __init__(self, max_sessions: int = 1000, max_turns: int = 5, ttl_seconds: int = 1800):
+        self.max_sessions = max_sessions
+        self.max_turns = max_turns
+        self.ttl_seconds = ttl_seconds
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_turns(self, session_id: str) -> List[SessionTurn]:
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return []
+            last_access, turns = entry
+            if time.time() - last_access > self.ttl_seconds:
+                del self._sessions[session_id]
+                return []
+            self._sessions.move_to_end(session_id)
+            return list(turns)
+
+    def append_turn(self, session_id: str, turn: SessionTurn) -> None:
+        with self._lock:
+            _, turns = self._sessions.pop(session_id, (None, []))
+            turns = (turns + [turn])[-self.max_turns:]
+            self._sessions[session_id] = (time.time(), turns)
+            # Evict the least recently used sessions once the bound is reached
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def clear(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+class RedisSessionStore:
+    """Session store backed by a Redis-compatible server (one capped list per session)."""
+
+    def __init__(self, url: str, max_turns: int = 5, ttl_seconds: int = 1800, key_prefix: str = "aisqlsense:session:"):
+        # Optional dependency: only required when SESSION_STORE_URL is configured
+        import redis
+
+        self._client = redis.Redis.from_url(url)
+        self.max_turns = max_turns
+        self.ttl_seconds = ttl_seconds
+        self.key_prefix = key_prefix
+
+    def _key(self, session_id: str) -> str:
+        return self.key_prefix + session_id
+
+    def get_turns(self, session_id: str) -> List[SessionTurn]:
+        raw_turns = self._client.lrange(self._key(session_id), 0, -1)
+        return [SessionTurn(**json.loads(raw)) for raw in raw_turns]
+
+    def append_turn(self, session_id: str, turn: SessionTurn) -> None:
+        key = self._key(session_id)
+        pipeline = self._client.pipeline()
+        pipeline.rpush(key, json.dumps(asdict(turn)))
+        pipeline.ltrim(key, -self.max_turns, -1)
+        pipeline.expire(key, self.ttl_seconds)
+        pipeline.execute()
+
+    def clear(self, session_id: str) -> None:
+        self._client.delete(self._key(session_id))
+
+
+_session_store = None
+_session_store_lock = threading.Lock()
+
+
+def session_key(session_id: str, data_source: str) -> str:
+    """The store key of a session on a data source (the name from data_sources.py)."""
+    return "{}:{}".format(data_source, session_id)
+
+
+def get_session_store():
+    """
+    Return the process-wide session store, creating it on first use.
+
+    Returns:
+    - InMemorySessionStore | RedisSessionStore: Selected by SESSION_STORE_URL.
+    """
+    global _session_store
+    with _session_store_lock:
+        if _session_store is None:
+            max_turns = int(os.getenv("SESSION_MAX_TURNS", "5"))
+            ttl_seconds = int(os.getenv("SESSION_TTL_SECONDS", "1800"))
+            store_url = os.getenv("SESSION_STORE_URL")
+            if store_url:
+                logger.info("Using Redis-compatible session store")
+                _session_store = RedisSessionStore(store_url, max_turns=max_turns, ttl_seconds=ttl_seconds)
+            else:
+                _session_store = InMemorySessionStore(
+                    max_sessions=int(os.getenv("SESSION_MAX_SESSIONS", "1000")),
+                    max_turns=max_turns,
+                    ttl_seconds=ttl_seconds,
+                )
+        return _session_store
+
+
+def summarize_result(text: Optional[str], max_chars: int = 500) -> str:
+    """Trim a result or answer so that only a short summary is kept in the session."""
+    if not text:
+        return ""
+    text = " ".join(str(text).split())
+    return text if len(text) <= max_chars else text[:max_chars] + "..."
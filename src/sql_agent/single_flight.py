@@ -0,0 +1,138 @@
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from sql_agent.metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+# Single-flight coalescing of identical in-flight questions (used by orchestration_service.py).
+# When a dashboard refresh sends the same question from many users at once, only the first
+# request starts an agent run; the others attach to it and all receive its result (or its
+# exception). The run happens on a worker thread owned by the coalescer, not by any one caller,
+# so it survives the first caller leaving:
+#   - every caller waits on the shared future, optionally with a timeout
+#   - a caller that times out detaches; when the last caller has left, the run is cancelled
+#   - cancellation sets an event that CancellationCallbackHandler checks before every LLM
+#     call and tool call, so the agent stops at its next step instead of running to the end
+# Coalesced requests are counted in /metrics (coalescing.leaders, .followers, .cancelled).
+
+# Cancellation event of the run on the current thread (set by SingleFlight, read by the callback)
+cancel_event_var = contextvars.ContextVar("cancel_event", default=None)
+
+
+class RequestCancelled(RuntimeError):
+    """Raised inside a coalesced run once every caller waiting for it has left."""
+
+
+def raise_if_cancelled() -> None:
+    cancel_event = cancel_event_var.get()
+    if cancel_event is not None and cancel_event.is_set():
+        raise RequestCancelled("Request cancelled: no caller is waiting for the result.")
+
+
+class CancellationCallbackHandler(BaseCallbackHandler):
+    """Stops an agent run at its next LLM or tool call when its coalesced run was cancelled."""
+
+    # Exceptions raised by the handler abort the run instead of being logged and ignored
+    raise_error = True
+
+    def on_llm_start(self, serialized, prompts, **kwargs) -> None:
+        raise_if_cancelled()
+
+    def on_chat_model_start(self, serialized, messages, **kwargs) -> None:
+        raise_if_cancelled()
+
+    def on_tool_start(self, serialized, input_str, **kwargs) -> None:
+        raise_if_cancelled()
+
+
+class _Flight:
+    def __init__(self):
+        self.future = None
+        self.waiters = 0
+        self.cancel_event = threading.Event()
+
+
+class SingleFlight:
+    """Runs one computation per key at a time and shares its outcome with every caller."""
+
+    def __init__(self, max_workers: int = 40):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="single-flight")
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._flights)
+
+    def _run(self, key, flight: _Flight, fn, args, kwargs):
+        cancel_event_var.set(flight.cancel_event)
+        try:
+            raise_if_cancelled()
+            return fn(*args, **kwargs)
+        finally:
+            # New callers for this key start a fresh run from now on
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+
+    def do(self, key, fn, *args, timeout: float = None, **kwargs):
+        """
+        Run fn(*args, **kwargs), or attach to the identical run already in flight.
+
+        Parameters:
+        - key: Identifies identical requests.
+        - fn: The computation. Its result, or its exception, is shared by every caller.
+        - timeout (float): Seconds this caller waits before detaching. None waits until done.
+
+        Returns:
+        - The result of the run. Raises its exception, or TimeoutError when this caller timed out.
+        """
+        metrics = get_metrics()
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = _Flight()
+                self._flights[key] = flight
+                # The worker runs in a copy of this caller's context (request id for the logs)
+                context = contextvars.copy_context()
+                flight.future = self._executor.submit(context.run, self._run, key, flight, fn, args, kwargs)
+                metrics.increment("coalescing.leaders")
+            else:
+                metrics.increment("coalescing.followers")
+                logger.info("Attached to the identical request already in flight")
+            flight.waiters += 1
+
+        try:
+            return flight.future.result(timeout=timeout)
+        except FutureTimeoutError:
+            raise TimeoutError("The request did not complete within {} seconds.".format(timeout)) from None
+        finally:
+            with self._lock:
+                flight.waiters -= 1
+                if flight.waiters == 0 and not flight.future.done():
+                    # Nobody is left to receive the result: stop the run and let the next
+                    # identical request start a new one
+                    flight.cancel_event.set()
+                    flight.future.cancel()
+                    if self._flights.get(key) is flight:
+                        del self._flights[key]
+                    metrics.increment("coalescing.cancelled")
+                    logger.info("Cancelled a request that no caller is waiting for")
+
+
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight(max_workers: int = 40) -> SingleFlight:
+    """Return the process-wide coalescer (max_workers applies when it is first created)."""
+    global _single_flight
+    with _single_flight_lock:
+        if _single_flight is None:
+            _single_flight = SingleFlight(max_workers=max_workers)
+        return _single_flight
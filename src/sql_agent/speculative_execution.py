@@ -0,0 +1,128 @@
+import re
+import json
+import logging
+import contextvars
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import List, Optional
+
+from langchain_core.callbacks import CallbackManagerForToolRun
+from langchain_core.pydantic_v1 import Field
+from langchain_core.tools import BaseTool
+
+from sql_agent.sql_sandbox import UnsafeSqlError, validate_read_only_sql
+
+logger = logging.getLogger(__name__)
+
+# Speculative execution of candidate SQL queries.
+# For ambiguous questions the agent used to try a query, hit an error, rewrite it and try again,
+# one full LLM round trip per attempt. In speculative mode the agent writes several alternative
+# queries in a single completion and submits them together with the sql_db_query_candidates tool.
+# The tool validates them, runs them in parallel with a tight per-statement timeout, and returns
+# the result of the first candidate that succeeds, or every error at once so that all of them
+# can be fixed in the next step. The sequential retry loop becomes one parallel step.
+
+
+def parse_candidates(tool_input: str, max_candidates: int) -> List[str]:
+    """
+    Split the tool input into candidate queries.
+
+    Accepts a JSON list of strings, a JSON object with a "queries" list, or queries
+    separated by lines containing only ---.
+    """
+    text = tool_input.strip()
+    candidates = None
+    try:
+        parsed = json.loads(text)
+        if isinstance(parsed, dict):
+            parsed = parsed.get("queries", [])
+        if isinstance(parsed, list):
+            candidates = [str(candidate) for candidate in parsed]
+    except ValueError:
+        pass
+    if candidates is None:
+        candidates = re.split(r"^\s*-{3,}\s*$", text, flags=re.MULTILINE)
+
+    # Drop markdown fences, blanks and duplicates, keep the model's order
+    cleaned = []
+    for candidate in candidates:
+        candidate = re.sub(r"^```(?:sql)?|```$", "", candidate.strip(), flags=re.IGNORECASE).strip()
+        if candidate and candidate not in cleaned:
+            cleaned.append(candidate)
+    return cleaned[:max_candidates]
+
+
+def run_candidates(db, candidates: List[str], timeout_seconds: float = 10.0) -> str:
+    """
+    Validate and execute candidate queries in parallel.
+
+    Parameters:
+    - db (ReadOnlySQLDatabase): The sandboxed database.
+    - candidates (list): Alternative SQL statements, in the model's order of preference.
+    - timeout_seconds (float): Per-statement timeout, and how long to wait overall.
+
+    Returns:
+    - str: The first successful result, or all errors prefixed with "Error:".
+    """
+    errors = {}
+    valid = []
+    for number, candidate in enumerate(candidates, start=1):
+        try:
+            valid.append((number, validate_read_only_sql(candidate)))
+        except UnsafeSqlError as e:
+            errors[number] = str(e)
+
+    if valid:
+        pool = ThreadPoolExecutor(max_workers=len(valid), thread_name_prefix="sql-candidate")
+        futures = {
+            # A copy of the request's context per candidate keeps the request id on log records
+            pool.submit(contextvars.copy_context().run, db.run, sql,
+                        execution_options={"sandbox_timeout_seconds": timeout_seconds}): (number, sql)
+            for number, sql in valid
+        }
+        pending = set(futures)
+        try:
+            while pending:
+                done, pending = wait(pending, timeout=timeout_seconds, return_when=FIRST_COMPLETED)
+                if not done:
+                    for future in pending:
+                        errors[futures[future][0]] = "Timed out after {} seconds.".format(timeout_seconds)
+                    break
+                for future in done:
+                    number, sql = futures[future]
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        errors[number] = str(e).split("\n")[0]
+                        continue
+                    logger.info("Speculative candidate %d of %d succeeded", number, len(candidates))
+                    return "Candidate {} succeeded.\nSQL: {}\nResult: {}".format(number, sql, result)
+        finally:
+            # Do not wait for slower candidates; their statement timeout ends them
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    lines = ["Error: all {} candidate queries failed.".format(len(candidates))]
+    for number, candidate in enumerate(candidates, start=1):
+        lines.append("Candidate {}: {}\n  Error: {}".format(number, candidate, errors.get(number, "Not run.")))
+    return "\n".join(lines)
+
+
+class SpeculativeQueryTool(BaseTool):
+    """Tool that runs several alternative SQL queries in parallel and returns the first success."""
+
+    name: str = "sql_db_query_candidates"
+    description: str = (
+        "Input is a JSON list of 2 to 3 alternative SQL queries that answer the same question, "
+        "most likely first. All candidates are checked and executed in parallel; the result of the first "
+        "one that succeeds is returned together with its SQL. If they all fail, every error is returned so "
+        "you can fix them in one step. Use this instead of sql_db_query when you are unsure which "
+        "table, column, join or filter is correct."
+    )
+    db: object = Field(exclude=True)
+    max_candidates: int = 3
+    timeout_seconds: float = 10.0
+
+    def _run(self, tool_input: str, run_manager: Optional[CallbackManagerForToolRun] = None) -> str:
+        candidates = parse_candidates(tool_input, self.max_candidates)
+        if not candidates:
+            return "Error: no candidate queries found. Send a JSON list of SQL queries."
+        return run_candidates(self.db, candidates, timeout_seconds=self.timeout_seconds)
@@ -2,7 +2,7 @@
 
 # This code block imports necessary libraries and modules for connecting to databases, processing data, 
 # and utilizing the LangChain framework for SQL generation from natural language. It also sets up 
-# environment variables and defines a function for Markdown display in Jupyter notebooks.
+# environment variables.
 import os
 import pandas as pd
 # # import pyodbc
@@ -10,14 +10,15 @@ import logging
 import sys
 import re
 import json
+import time
 import importlib.util
+from dataclasses import dataclass
+from typing import Optional
 
 from dotenv import load_dotenv
 from fastapi.responses import JSONResponse
 
 # Enable logging
-# Define a custom log format
-log_format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 
 # Python Logging Levels:
 # DEBUG: Detailed information, typically of interest only when diagnosing problems.
@@ -26,18 +27,16 @@ log_format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 # ERROR: Due to a more serious problem, the software has not been able to perform some function.
 # CRITICAL: A very serious error, indicating that the program itself may be unable to continue running.
 
-# logging.basicConfig(level=logging.DEBUG)
-# logging.basicConfig(level=logging.DEBUG, format=log_format)
-logging.basicConfig(level=logging.INFO, format=log_format)
-logger = logging.getLogger('langchain')
-
-# Import the Markdown module from IPython.display
-from IPython.display import Markdown, HTML, display  
-
 # Load environment variables from the credentials.env file
 env_path = os.path.join(os.path.dirname(__file__), 'credentials.env')
 load_dotenv(env_path)
 
+# Records go through a background queue as structured JSON with the request id (see logging_config.py).
+# Set LOG_LEVEL=DEBUG to see the table list and every agent step; LOG_FORMAT=text for plain lines.
+from sql_agent.logging_config import setup_logging
+setup_logging()
+logger = logging.getLogger('langchain')
+
 azure_openai_api_version = os.getenv("AZURE_OPENAI_API_VERSION")
 
 if not azure_openai_api_version:
@@ -83,73 +82,258 @@ from tiktoken import encoding_for_model
 from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.engine import URL
 
-# Function to print comments using markdown
-def printmd(string):
-    display(Markdown(string))
+# Read-only execution sandbox for agent-generated SQL
+from sql_agent.sql_sandbox import ReadOnlySQLDatabase, UnsafeSqlError, referenced_tables, validate_read_only_sql
 
-# Flag that controls whether to show query execution steps
-show_query_execution_steps = True #False #True
+# Conversation sessions for follow-up questions
+from sql_agent.session_store import SessionTurn, get_session_store, session_key, summarize_result
 
-logger.info("##### Dependencies loaded...")
-printmd(f"##### Dependencies loaded...")
+# Few-shot examples retrieved by question similarity
+from sql_agent.example_store import get_example_store, render_examples
 
-###################################
-# Define the SQL Flow Function
-###################################
-def sql_flow_function(user_prompt: str) -> str:
-    """Generate an SQL query using the user prompt and predefined prefix."""
+# Precomputed column statistics for filter grounding
+from sql_agent.column_stats_tool import ColumnStatsLookupTool, load_column_stats
 
-    logger.info("Entered sql_flow_function with: %s", user_prompt)
-    
-    # Connect to Azure SQL Database using SQLAlchemy and pyodbc. 
-    # Configuration for the database connection
-    db_config = {
-        'drivername': 'mssql+pyodbc',
-        'username': os.environ["SQL_SERVER_USERNAME"] + '@' + os.environ["SQL_SERVER_NAME"],
-        'password': os.environ["SQL_SERVER_PASSWORD"],
-        'host': os.environ["SQL_SERVER_NAME"],
-        'port': 1433,
-        'database': os.environ["SQL_SERVER_DATABASE"],
-        'query': {'driver': 'ODBC Driver 17 for SQL Server'},
-    }
+# Cached Entra ID tokens shared with the token-based database backends
+from sql_agent.token_cache import COGNITIVE_SERVICES_SCOPE, get_token_provider
 
-    # Create a URL object for connecting to the database
-    db_url = URL.create(**db_config)
+# Runs the tool calls of one agent turn concurrently
+from sql_agent.parallel_tools import ParallelAgentExecutor
 
-    #####################################################
-    ## Following Blocks Test the Database Connection:
-    # Connect to the Azure SQL Database using the URL string
-    engine = create_engine(db_url)
+# Runs alternative candidate queries in parallel and keeps the first one that succeeds
+from sql_agent.speculative_execution import SpeculativeQueryTool
+
+# Totals and averages over long results are computed locally instead of by the model
+from sql_agent.result_aggregation import AggregatingSQLDatabaseToolkit
+
+# Off-topic questions are caught locally before the agent runs
+from sql_agent.topic_gate import get_topic_gate, record_verdict, topic_gate_mode
+
+# Pipeline stages, used to tag the samples of the request profiler
+from sql_agent.profiling import mark_stage, profile_stage
+
+# Bounded retention of intermediate steps and per-request memory accounting
+from sql_agent.step_retention import StepRetentionPolicy
+from sql_agent.metrics import get_metrics, peak_rss_mb
+
+# Cheap model first, escalate to the large model when the answer does not check out
+from sql_agent.model_tiering import (TierVerdict, check_agent_answer, get_model_tiers, query_steps,
+                                     record_savings, record_tier_attempt)
+
+# Semantic layer: metric questions answered from pre-aggregates without an LLM call
+from sql_agent.semantic_layer import format_rows_as_markdown, get_semantic_layer
+
+# Shared engine/SQLDatabase and the recent question log used by the warm-up scheduler
+from sql_agent.runtime import get_runtime
+from sql_agent.data_sources import get_data_source
+from sql_agent.question_log import get_recent_questions
+
+# Cancellation of coalesced requests that no caller is waiting for any more
+from sql_agent.single_flight import CancellationCallbackHandler, RequestCancelled, raise_if_cancelled
+
+# Flag that controls whether to log query execution steps (at DEBUG level, size-capped)
+show_query_execution_steps = os.getenv("SHOW_QUERY_EXECUTION_STEPS", "true").lower() == "true"
+
+# Number of few-shot examples injected into the prompt for each question
+few_shot_top_k = int(os.getenv("FEW_SHOT_TOP_K", "3"))
+# Successful runs are added to the few-shot library only when harvesting is turned on
+few_shot_harvest = os.getenv("FEW_SHOT_HARVEST", "false").lower() == "true"
+
+# Maximum number of tool calls of one agent turn that run concurrently (1 disables it)
+max_parallel_tools = int(os.getenv("AGENT_MAX_PARALLEL_TOOLS", "4"))
 
-    # Create instance of the SQLDatabase class. 
+# Speculative execution: the agent may submit several candidate queries in one step
+speculative_execution = os.getenv("SPECULATIVE_EXECUTION", "false").lower() == "true"
+speculative_max_candidates = int(os.getenv("SPECULATIVE_MAX_CANDIDATES", "3"))
+speculative_timeout_seconds = float(os.getenv("SPECULATIVE_TIMEOUT_SECONDS", "10"))
+
+# Result aggregation: long sql_db_query results are summarized with pandas (see result_aggregation.py)
+result_aggregation = os.getenv("RESULT_AGGREGATION", "true").lower() == "true"
+result_aggregation_max_rows = int(os.getenv("RESULT_AGGREGATION_MAX_ROWS", "30"))
+
+# Topic gate: off | shadow | enforce (see topic_gate.py)
+topic_gate = topic_gate_mode()
+
+logger.info("##### Dependencies loaded...")
+
+def build_session_prompt(previous_turns: list, user_prompt: str) -> str:
+    """Prepend the previous turns of a session to a follow-up question."""
+    rendered_turns = "\n".join(
+        prompts.SESSION_TURN_TEMPLATE.format(
+            question=turn.question,
+            sql_statement=turn.sql_statement,
+            tables=", ".join(turn.tables) or "unknown",
+            result_summary=turn.result_summary,
+        )
+        for turn in previous_turns
+    )
+    return prompts.SESSION_CONTEXT_PREFIX.format(previous_turns=rendered_turns) + user_prompt
+
+def tables_used(intermediate_steps: list, sql_statement: str) -> list:
+    """Collect the tables the agent inspected (sql_db_schema calls) and queried."""
+    tables = []
+    for step in intermediate_steps:
+        if not isinstance(step, tuple):
+            continue
+        action, _ = step
+        if getattr(action, "tool", None) != "sql_db_schema":
+            continue
+        tool_input = action.tool_input
+        if isinstance(tool_input, dict):
+            tool_input = tool_input.get("table_names", "")
+        tables.extend(name.strip() for name in str(tool_input).split(",") if name.strip())
+    tables.extend(referenced_tables(sql_statement))
+    # Keep first-seen order and drop duplicates
+    return list(dict.fromkeys(tables))
+
+def harvest_example(user_prompt: str, final_answer: str, intermediate_steps: list) -> None:
+    """Add a successful run to the few-shot library when its last query executed without error."""
+    # The SQL the agent ran, not the one quoted in its answer text (fences and prose around it)
+    steps = query_steps(intermediate_steps)
+    if not steps or str(steps[-1][1]).startswith("Error"):
+        return
+    sql_statement = steps[-1][0]
     try:
-        # Under the hood,SqlAlchemy's create_engine is used to connect to DB's URI.
-        # Once connected, SqlAlchemy's MetaData and inspector object are used to intrpspect the DB's schema, 
-        # extracting information about tables, columns, and relationships.
-        # Using SqlAlchemy's ORM, it can map tables to Python classes and provides methods to query data, 
-        # fetch results, and interact with the databae. 
-        #SqlAlchemy an ORM. It's phasing out the toolkit, so we will use the SQLDatabase class instead
-        db = SQLDatabase.from_uri(db_url) 
-    except Exception as e:
-        print(f"An error occurred while connecting to the database: {e}")
-        logger.error(f"An error occurred while connecting to the database: {e}")
-        raise ConnectionError("Failed to connect to the database. Please check your database configuration.") from e
-    
-    # Test the connection to the database by fetching the table names
-    if show_query_execution_steps:
-        print("SqlDatabase Object Initialized. Found following tables:")
-        print(db.get_usable_table_names())
+        validate_read_only_sql(sql_statement)
+    except UnsafeSqlError:
+        return
+    answer = re.sub(r'^Final Answer:\s*', '', final_answer)
+    get_example_store().add(user_prompt, sql_statement, answer=answer)
+
+def record_request_memory(step_retention: StepRetentionPolicy) -> None:
+    """Report what the request's intermediate steps kept, dropped and spilled to the metrics registry."""
+    metrics = get_metrics()
+    for name, value in step_retention.stats.items():
+        metrics.observe("agent.steps." + name, value)
+    metrics.observe("process.peak_rss_mb", peak_rss_mb())
+    logger.info("Intermediate steps: %s", step_retention.stats)
+
+@dataclass
+class SqlAnswer:
+    """The parts of an answer, before they are shaped into a response contract (v1 below, v2 in response_v2.py)."""
+    prompt: str
+    final_answer: str
+    sql_statement: Optional[str]
+    explanation: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_tokens: int = 0
+    total_cost: float = 0.0
+    session_id: Optional[str] = None
+    # agent, semantic_layer or topic_gate
+    answered_by: str = "agent"
+
+def build_sql_response(answer: SqlAnswer) -> dict:
+    """Build the v1 response dictionary returned to the API (see SqlResponseModel in readme.md)."""
+    return {
+        "Prompt": "User Prompt: {}".format(answer.prompt),
+        "FinalAnswer": "Final Answer: {}".format(answer.final_answer),
+        "SqlStatement": "SQL Statement: {}".format(
+            answer.sql_statement if answer.sql_statement is not None else "SQL statement not found."),
+        "PromptTokens": "Prompt Tokens: {}".format(answer.prompt_tokens),
+        "CompletionTokens": "Completion Tokens: {}".format(answer.completion_tokens),
+        "TotalTokens": "Total Tokens: {}".format(answer.total_tokens),
+        "TotalCost": "Total Cost (USD): {}".format(answer.total_cost),
+        "Explanation": "Explanation: {}".format(answer.explanation),
+        "PromptTokensInt": answer.prompt_tokens,
+        "CompletionTokensInt": answer.completion_tokens,
+        "TotalCostFloat": answer.total_cost,
+        "SessionId": answer.session_id
+    }
+
+def answer_off_topic(runtime, user_prompt: str, column_stats: dict = None):
+    """
+    Check a standalone question against the topic gate.
+
+    Returns:
+    - SqlAnswer | None: The canned answer when the gate enforces and the question is off topic,
+      otherwise None and the question goes on to the agent.
+    """
+    start = time.perf_counter()
+    gate = get_topic_gate(runtime, column_stats, get_semantic_layer() if runtime.is_default else None)
+    verdict = gate.check(user_prompt)
+    record_verdict(verdict, topic_gate)
+    get_metrics().observe("topic_gate.latency_ms", (time.perf_counter() - start) * 1000)
+    if verdict.on_topic:
+        return None
+    logger.info("Topic gate: off-topic question (%s, %s)", verdict.reason,
+                "rejected" if topic_gate == "enforce" else "shadow")
+    if topic_gate != "enforce":
+        return None
+    final_answer = "I don't know. The question does not seem related to the database."
+    explanation = ("The question does not mention any table, column or value of the database, so it was "
+                   "not sent to the agent. Rephrase it with the names used in the data.")
+    return SqlAnswer(user_prompt, final_answer, "", explanation, answered_by="topic_gate")
+
+def answer_from_semantic_layer(db, user_prompt: str, session_id: str = None, store_key: str = None):
+    """
+    Answer a plain metric-by-dimension question from the semantic layer.
+
+    Parameters:
+    - session_id (str): Returned with the answer.
+    - store_key (str): The session's key in the session store (session_key); the turn is recorded under it.
+
+    Returns:
+    - SqlAnswer | None: None when the question does not match, or the generated
+      query fails, in which case the agent handles the question.
+    """
+    semantic_layer = get_semantic_layer()
+    route = semantic_layer.route(user_prompt, db.get_usable_table_names()) if semantic_layer else None
+    if route is None:
+        return None
 
-    ##### Initialize AzureOpenAI and Sql Agent
+    try:
+        rows = [row._asdict() for row in db.run(route.sql_statement, fetch="cursor").fetchall()]
+    except Exception as e:
+        logger.warning("Semantic layer query failed, falling back to the agent: %s", e)
+        return None
+
+    logger.info("Answered from the semantic layer (%s over %s)", route.metric, route.source)
+    final_answer = "Final Answer: " + format_rows_as_markdown(rows)
+    explanation = "The question matched the `{}` metric{} in the semantic layer, so it was answered from `{}`{}.".format(
+        route.metric,
+        " by " + ", ".join(route.dimensions) if route.dimensions else "",
+        route.source,
+        ", a pre-aggregated table," if route.uses_pre_aggregate else "",
+    )
+
+    if store_key:
+        get_session_store().append_turn(store_key, SessionTurn(
+            question=user_prompt,
+            sql_statement=route.sql_statement,
+            tables=[route.source],
+            result_summary=summarize_result(final_answer),
+        ))
+
+    return SqlAnswer(user_prompt, final_answer, route.sql_statement, explanation, session_id=session_id,
+                     answered_by="semantic_layer")
+
+def create_llm(deployment_name: str) -> AzureChatOpenAI:
+    """Create the chat model client for one deployment (one model tier)."""
+    ##### Initialize AzureOpenAI
     # Initialize instance of AzureChatOpenAI 
     # llm = AzureChatOpenAI(deployment_name=os.environ["GPT35_DEPLOYMENT_NAME"], temperature=0.2, max_tokens=2000, api_version=os.environ["AZURE_OPENAI_API_VERSION"])
        
+    # Without an API key, authenticate with Entra ID. The token comes from the shared cache,
+    # which refreshes it in the background, so the request never waits on the credential chain.
+    llm_options = {}
+    if not os.getenv("AZURE_OPENAI_API_KEY"):
+        llm_options["azure_ad_token_provider"] = get_token_provider(COGNITIVE_SERVICES_SCOPE)
+    # The agent streams its calls, and streamed responses carry no token usage unless it is asked
+    # for (stream_options); without it the reported token counts are 0. AzureChatOpenAI has no
+    # stream_usage field in the pinned langchain-openai, so the option goes to the API directly.
+    # The API rejects stream_options on a non-streamed call, so every call is streamed then.
+    if os.getenv("AZURE_OPENAI_STREAM_USAGE", "false").lower() == "true":
+        llm_options["streaming"] = True
+        llm_options["model_kwargs"] = {"stream_options": {"include_usage": True}}
+
     try:
         llm = AzureChatOpenAI(
-           deployment_name=os.environ["GPT35_DEPLOYMENT_NAME"],
+           deployment_name=deployment_name,
            temperature=0.2,
            max_tokens=2000,
-          api_version=os.environ["AZURE_OPENAI_API_VERSION"]
+          api_version=os.environ["AZURE_OPENAI_API_VERSION"],
+          **llm_options
         )
     except KeyError as e:
         logger.error(f"Missing environment variable: {e}")
@@ -157,9 +341,6 @@ def sql_flow_function(user_prompt: str) -> str:
     except Exception as e:
         logger.error(f"An error occurred while initializing AzureChatOpenAI: {e}")
         raise RuntimeError("Failed to initialize AzureChatOpenAI.") from e
-    
-
-
 
     # llm = AzureChatOpenAI(
     #     azure_deployment="gpt-35-turbo",  # or your deployment
@@ -177,12 +358,27 @@ def sql_flow_function(user_prompt: str) -> str:
     #     DO NOT make any DML statements (INSERT, UPDATE, DELETE, DROP etc.) to the database.
     #     If the question does not seem related to the database, just return "I don't know" as the answer.
     # """
-    
+
+    return llm
+
+def create_agent_executor(db, llm, agent_prefix: str, extra_tools: list, question: str = "") -> tuple:
+    """
+    Create the SQL agent for one model tier.
+
+    The question selects the figure the query tool computes over long results (RESULT_AGGREGATION).
+
+    Returns:
+    - tuple: (ParallelAgentExecutor, StepRetentionPolicy of this run)
+    """
     # SQLDatabaseToolkit is a utility for interacting with a SQL database using a language model (LLM).
     # It facilitate the integration between the database and the language model, enabling more sophisticated
     # query generation, execution, and result handling.
     # Parameters in the SQLDatabase class and the LLM.
-    toolkit = SQLDatabaseToolkit(db=db, llm=llm)
+    if result_aggregation:
+        toolkit = AggregatingSQLDatabaseToolkit(db=db, llm=llm, question=question,
+                                                max_rows=result_aggregation_max_rows)
+    else:
+        toolkit = SQLDatabaseToolkit(db=db, llm=llm)
 
     # Create the SqlAgent
     # SqlAgent interacts with directly with the SQL database. 
@@ -191,20 +387,27 @@ def sql_flow_function(user_prompt: str) -> str:
     # Note how the SqlAgent leverges the SQLDatabaseToolkit and the language model (LLM). 
     try:
         agent_executor = create_sql_agent(
-            prefix=MSSQL_AGENT_PREFIX,
+            prefix=agent_prefix,
             llm=llm,
             #prompt=full_prompt,
             temperature=0.1,
             toolkit=toolkit,
+            extra_tools=extra_tools,
             top_k=30,
             agent_type="openai-tools",
-            verbose=show_query_execution_steps, #True,
+            # The stdout callback handler writes synchronously; steps are logged after the run instead
+            verbose=False,
             agent_executor_kwargs={"return_intermediate_steps": True}
             # system_prompt=system_prompt
             # stream_runnble=False
         )
+        # Independent tool calls requested in the same turn run concurrently, and each observation
+        # is compacted as it is produced (STEP_RETENTION), so large results are not held for the whole request
+        step_retention = StepRetentionPolicy.from_env()
+        agent_executor = ParallelAgentExecutor.from_executor(
+            agent_executor, max_parallel_tools=max_parallel_tools, step_retention=step_retention)
     except Exception as e:
-        print(f"An error occurred while creating the agent_executor: {str(e)}")
+        logger.error("An error occurred while creating the agent_executor: %s", e)
         agent_executor = None  # Set agent_executor to None or handle it as needed
         raise RuntimeError("Failed to create the SQL agent executor.") from e
 
@@ -214,19 +417,24 @@ def sql_flow_function(user_prompt: str) -> str:
 
     # Continue with the rest of your code, checking if agent_executor was created successfully
     if agent_executor:
-        printmd(f"##### Langchain SqlAgent Created")
         logger.info("##### Langchain SqlAgent Created...")
 
-    # Invoke the SQL agent with the natural language question
-    # The agent will generate a SQL query based on the input question   
-    # and execute the query against the connected database.
-    # The response contains the query result and other relevant information.
-    # The response is a dictionary with keys such as 'query', 'result', 'intermediate_steps', and 'execution_time'.
+    return agent_executor, step_retention
+
+def invoke_agent(agent_executor, agent_input: str, step_retention: StepRetentionPolicy) -> tuple:
+    """
+    Run the agent and collect its token usage.
+
+    Returns:
+    - tuple: (agent response dictionary, usage dictionary with prompt_tokens, completion_tokens,
+      total_tokens and total_cost)
+    """
     try:
         # get_openai_callback() is a context manager that provides a callback handler for OpenAI API calls
         # It can be used to track token useage and cost for API requests and responses 
         with get_openai_callback() as cb:
-            response = agent_executor.invoke(user_prompt)
+            # Stops the run at its next step when a coalesced request is cancelled (single_flight.py)
+            response = agent_executor.invoke(agent_input, config={"callbacks": [CancellationCallbackHandler()]})
     except ConnectionError as e:
         response = f"Connection error: {str(e)}"
         raise RuntimeError("Connection error occurred.") from e
@@ -242,6 +450,186 @@ def sql_flow_function(user_prompt: str) -> str:
     except Exception as e:
         response = f"An unexpected error occurred: {str(e)}"
         raise RuntimeError("An unexpected error occurred.") from e
+    finally:
+        record_request_memory(step_retention)
+
+    return response, {"prompt_tokens": cb.prompt_tokens, "completion_tokens": cb.completion_tokens,
+                      "total_tokens": cb.total_tokens, "total_cost": cb.total_cost}
+
+def parse_agent_output(output: str) -> tuple:
+    """
+    Split the agent output into its parts.
+
+    Returns:
+    - tuple: (final answer or None, explanation, SQL statement or None)
+    """
+    # Extract the 'Final Answer' from the response["output"]
+    match = re.search(r'Final Answer:.*?(?=\n\n|$)', output, re.DOTALL)
+    final_answer = match.group(0).strip() if match else None
+
+    # Remove the "Final Answer:" part from the response["output"]
+    explanation = re.sub(r'Final Answer:.*?(?=\n\n|$)', '', output, flags=re.DOTALL).strip()
+
+    # Extract the SQL statement from the response["output"]: the body of a ```sql fence, else
+    # from SELECT up to the explanation, a closing fence or the next blank line
+    fence_match = re.search(r'```sql\s*(.*?)```', output, re.DOTALL | re.IGNORECASE)
+    sql_match = fence_match or re.search(r'SELECT.*?(?=Explanation:|```|\n\s*\n|$)', output, re.DOTALL)
+    sql_statement = sql_match.group(1 if fence_match else 0).strip() if sql_match else None
+    sql_statement = sql_statement or None
+    return final_answer, explanation, sql_statement
+
+
+###################################
+# Define the SQL Flow Function
+###################################
+def sql_flow_function(user_prompt: str, session_id: str = None, data_source: str = None) -> JSONResponse:
+    """Generate an SQL query using the user prompt and predefined prefix (v1 response contract)."""
+    return JSONResponse(content=build_sql_response(answer_question(user_prompt, session_id, data_source)))
+
+# The pipeline stages of a request (mark_stage below) tag the profiler's samples (see profiling.py)
+@profile_stage("sql_flow")
+def answer_question(user_prompt: str, session_id: str = None, data_source: str = None) -> SqlAnswer:
+    """Answer a question with the agent (or a local shortcut) and return the parts of the answer.
+
+    When session_id is given, previous turns of that session are sent to the agent so
+    follow-up questions can reuse the last query, and this turn is recorded afterwards.
+    data_source selects one of the declared data sources (see data_sources.py); by default
+    the configured database is used.
+    """
+
+    logger.info("Entered answer_question with: %s (session: %s, data source: %s)",
+                user_prompt, session_id, data_source or "default")
+    
+    # Connect to the configured database backend using SQLAlchemy (Azure SQL with pyodbc by default).
+    # Agent queries use the low-privilege login (see db_connection.py and db_backends.py).
+    #####################################################
+    ## Following Blocks Test the Database Connection:
+    # The engine and the SQLDatabase are shared by every request for a data source (see
+    # runtime.py), so the connection pool and the reflected schema stay warm; the warm-up
+    # scheduler prepares the default one at startup (see warmup.py).
+    # An unknown data source is a client error (ValueError, 400), not a connection failure.
+    mark_stage("connect")
+    get_data_source(data_source)
+    try:
+        # Under the hood,SqlAlchemy's create_engine is used to connect to DB's URI.
+        # Once connected, SqlAlchemy's MetaData and inspector object are used to intrpspect the DB's schema, 
+        # extracting information about tables, columns, and relationships.
+        # Using SqlAlchemy's ORM, it can map tables to Python classes and provides methods to query data, 
+        # fetch results, and interact with the databae. 
+        # ReadOnlySQLDatabase is the execution sandbox: every agent query is validated and run
+        # in a read-only transaction that is always rolled back (see sql_sandbox.py).
+        runtime = get_runtime(data_source)
+        db = runtime.db
+    except Exception as e:
+        logger.error(f"An error occurred while connecting to the database: {e}")
+        raise ConnectionError("Failed to connect to the database. Please check your database configuration.") from e
+    # Sessions are kept per data source, so a follow-up never builds on SQL for another database
+    store_key = session_key(session_id, runtime.data_source.name) if session_id else None
+    
+    # Test the connection to the database by fetching the table names
+    if show_query_execution_steps and logger.isEnabledFor(logging.DEBUG):
+        logger.debug("SqlDatabase Object Initialized. Found following tables: %s", db.get_usable_table_names())
+
+    # Off-topic standalone questions are answered without the agent when the gate enforces
+    mark_stage("topic_gate")
+    column_stats = load_column_stats(runtime.database_name)
+    if topic_gate != "off" and not session_id:
+        off_topic_answer = answer_off_topic(runtime, user_prompt, column_stats)
+        if off_topic_answer is not None:
+            return off_topic_answer
+
+    # Standalone questions are remembered so a new instance can replay the most frequent ones
+    if not session_id and runtime.is_default:
+        get_recent_questions().record(user_prompt)
+
+    # Metric questions declared in the semantic layer are answered from pre-aggregates
+    # directly, skipping the LLM and the scan of the base tables.
+    # The semantic layer and the few-shot library describe the default database only.
+    mark_stage("semantic_layer")
+    if runtime.is_default:
+        semantic_answer = answer_from_semantic_layer(db, user_prompt, session_id, store_key)
+        if semantic_answer is not None:
+            return semantic_answer
+
+    # Build the agent prefix: the dialect notes, the optional tools and the few-shot examples.
+    # Precomputed column statistics (column_profiler.py) let the agent look up filter values
+    # without exploratory queries. The tool is only offered when the profile exists.
+    mark_stage("prompt")
+    agent_prefix = MSSQL_AGENT_PREFIX
+    dialect_hints = runtime.backend.dialect_hints
+    if dialect_hints:
+        # Escaped: the prefix goes through str.format in create_sql_agent
+        agent_prefix += prompts.DIALECT_NOTES_TEMPLATE.format(
+            dialect_hints=dialect_hints.replace("{", "{{").replace("}", "}}"))
+    extra_tools = []
+    if column_stats:
+        extra_tools.append(ColumnStatsLookupTool(column_stats=column_stats))
+        agent_prefix += prompts.COLUMN_VALUES_INSTRUCTIONS
+
+    # Speculative execution replaces the query/error/rewrite loop with one parallel step
+    if speculative_execution:
+        extra_tools.append(SpeculativeQueryTool(
+            db=db, max_candidates=speculative_max_candidates, timeout_seconds=speculative_timeout_seconds))
+        agent_prefix += prompts.SPECULATIVE_EXECUTION_INSTRUCTIONS
+
+    # Only the few-shot examples most similar to the question are appended to the prefix.
+    few_shot_examples = [example for _, example in get_example_store().search(user_prompt, k=few_shot_top_k)] \
+        if runtime.is_default else []
+    agent_prefix += render_examples(few_shot_examples)
+
+    # Invoke the SQL agent with the natural language question
+    # The agent will generate a SQL query based on the input question   
+    # and execute the query against the connected database.
+    # The response contains the query result and other relevant information.
+    # The response is a dictionary with keys such as 'query', 'result', 'intermediate_steps', and 'execution_time'.
+    # For a follow-up question in a session, the previous turns are sent along with the question.
+    agent_input = user_prompt
+    previous_turns = []
+    if session_id:
+        previous_turns = get_session_store().get_turns(store_key)
+        if previous_turns:
+            logger.info("Continuing session %s with %d previous turn(s)", session_id, len(previous_turns))
+            agent_input = build_session_prompt(previous_turns, user_prompt)
+
+    # Model tiers: the cheap deployment answers first; its answer is checked and the question is
+    # escalated to the next (larger) deployment only when the check fails (see model_tiering.py).
+    tiers = get_model_tiers()
+    usable_tables = db.get_usable_table_names() if len(tiers) > 1 else []
+    usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "total_cost": 0.0}
+    for tier_number, deployment_name in enumerate(tiers, start=1):
+        is_last_tier = tier_number == len(tiers)
+        start = time.perf_counter()
+        try:
+            raise_if_cancelled()
+            mark_stage("agent")
+            llm = create_llm(deployment_name)
+            agent_executor, step_retention = create_agent_executor(db, llm, agent_prefix, extra_tools, user_prompt)
+            response, tier_usage = invoke_agent(agent_executor, agent_input, step_retention)
+        except RequestCancelled:
+            # Nobody is waiting for the answer any more: do not escalate
+            raise
+        except Exception as e:
+            if is_last_tier:
+                raise
+            logger.warning("Model tier %s failed, escalating: %s", deployment_name, e)
+            record_tier_attempt(deployment_name, (time.perf_counter() - start) * 1000, 0, 0.0,
+                                accepted=False, escalated=True)
+            continue
+
+        for key in usage:
+            usage[key] += tier_usage[key]
+        mark_stage("answer_check")
+        final_answer, explanation, sql_statement = parse_agent_output(response["output"])
+        # The last tier's answer is returned whatever it is
+        verdict = TierVerdict(True) if is_last_tier else check_agent_answer(
+            final_answer, sql_statement, response.get("intermediate_steps", []), usable_tables)
+        latency_ms = (time.perf_counter() - start) * 1000
+        record_tier_attempt(deployment_name, latency_ms, tier_usage["total_tokens"], tier_usage["total_cost"],
+                            accepted=verdict.accepted, escalated=not verdict.accepted)
+        if verdict.accepted:
+            record_savings(tiers, deployment_name, latency_ms, tier_usage["total_cost"])
+            break
+        logger.info("Escalating from model tier %s: %s", deployment_name, verdict.reason)
 
     # Advanced logging block
     # Block iterates through the intermediate steps of the response 
@@ -249,7 +637,7 @@ def sql_flow_function(user_prompt: str) -> str:
     # This is a common pattern for displaying detailed information based on 
     # the content of data structures and conditional flag in Python
     # Importantly, the block reveals the agent's decision-making process.
-    if show_query_execution_steps: 
+    if show_query_execution_steps and logger.isEnabledFor(logging.DEBUG):
         # Iterate through each step in the 'intermediate_steps' list from the response
         for step in response['intermediate_steps']:
             # Check if the current step is a dictionary
@@ -265,11 +653,13 @@ def sql_flow_function(user_prompt: str) -> str:
 
             else:
                 # Handle unexpected step types by printing a warning and skipping the current iteration
-                print(f"Unexpected step type: {type(step)}")
+                logger.warning("Unexpected step type: %s", type(step))
                 continue  # Skip this step if it's neither dict nor tuple
 
-            # Print the action and observation for the current step
-            print(f"Action: {action}\nObservation: {observation}\n")
+            # Log the action and observation for the current step
+            logger.debug("Agent step", extra={"action": getattr(action, "tool", action),
+                                              "tool_input": getattr(action, "tool_input", ""),
+                                              "observation": observation})
 
             # print(f"Total Tokens: {cb.total_tokens}")
             # print(f"Prompt Tokens: {cb.prompt_tokens}")
@@ -288,64 +678,42 @@ def sql_flow_function(user_prompt: str) -> str:
     # except Exception as e:
     #     print(f"An error occurred: {e}")
 
-
-    class SqlResponseModel:
-        def __init__(self, Prompt: str, FinalAnswer: str, Explanation: str,
-                    SqlStatement: str, PromptTokens: int, CompletionTokens: int, TotalTokens: int, TotalCost: float):
-            self.Prompt = Prompt
-            self.FinalAnswer = FinalAnswer
-            self.SqlStatement = SqlStatement
-            self.PromptTokens = PromptTokens
-            self.CompletionTokens = CompletionTokens
-            self.TotalTokens = TotalTokens
-            self.TotalCost = TotalCost
-            self.Explanation = Explanation
-
+    mark_stage("response")
     try:
         # print(cb)
-        print("Total Tokens: {}".format(cb.total_tokens))
-        print("Prompt Tokens: {}".format(cb.prompt_tokens))
-        print("Completion Tokens: {}".format(cb.completion_tokens))
-        print("Total Cost (USD): {}".format(cb.total_cost))
-        print()  # Insert a newline
-
-        # Extract the 'Final Answer' from the response["output"]
-        match = re.search(r'Final Answer:.*?(?=\n\n|$)', response["output"], re.DOTALL)
-        final_answer = match.group(0).strip() if match else "Final Answer not found."
-
-        # Remove the "Final Answer:" part from the response["output"]
-        explanation = re.sub(r'Final Answer:.*?(?=\n\n|$)', '', response["output"], flags=re.DOTALL).strip()
-
-        # explanation2 = re.search(r'Explanation:.*?(?=\n\n|$)', response["output"], re.DOTALL)
-
-        print("User Prompt: {}".format(user_prompt))
-        print()  # Insert a newline
-
-        print("Final Answer: {}".format(final_answer))
-        print()  # Insert a newline
-
-        # Extract the SQL statement from the response["output"]
-        sql_match = re.search(r'SELECT.*?(?=Explanation:|$)', response["output"], re.DOTALL)
-        sql_statement = sql_match.group(0).strip() if sql_match else "SQL statement not found."
-        print("SQL Statement: {}".format(sql_statement))
-        print()  # Insert a newline
-
-        print("Explanation: {}".format(explanation))            
-        print()  # Insert a newline
-
-        sql_response = {
-            "Prompt": "User Prompt: {}".format(user_prompt),
-            "FinalAnswer": "Final Answer: {}".format(final_answer),
-            "SqlStatement": "SQL Statement: {}".format(sql_statement),
-            "PromptTokens": "Prompt Tokens: {}".format(cb.prompt_tokens),
-            "CompletionTokens": "Completion Tokens: {}".format(cb.completion_tokens),
-            "TotalTokens": "Total Tokens: {}".format(cb.total_tokens),
-            "TotalCost": "Total Cost (USD): {}".format(cb.total_cost),
-            "Explanation": "Explanation: {}".format(explanation),
-            "PromptTokensInt": cb.prompt_tokens,
-            "CompletionTokensInt": cb.completion_tokens,
-            "TotalCostFloat": cb.total_cost            
-        }
+        logger.info("Token usage", extra={"total_tokens": usage["total_tokens"], "prompt_tokens": usage["prompt_tokens"],
+                                          "completion_tokens": usage["completion_tokens"],
+                                          "total_cost_usd": usage["total_cost"], "model": deployment_name})
+
+        # The answer parts were extracted by parse_agent_output for the tier check
+        match = final_answer is not None
+        sql_match = sql_statement is not None
+        final_answer = final_answer if match else "Final Answer not found."
+        logger.debug("Agent answer", extra={"final_answer": final_answer, "sql_statement": sql_statement,
+                                            "explanation": explanation})
+
+        # Harvest standalone questions whose SQL ran successfully into the few-shot library.
+        # Follow-ups ("now only for 2021") only make sense with their session context.
+        if few_shot_harvest and sql_match and match and not previous_turns and runtime.is_default:
+            harvest_example(user_prompt, final_answer, response.get("intermediate_steps", []))
+
+        # Record this turn so that the next question in the session can build on it
+        if session_id and sql_match:
+            get_session_store().append_turn(store_key, SessionTurn(
+                question=user_prompt,
+                sql_statement=sql_statement,
+                tables=tables_used(response.get("intermediate_steps", []), sql_statement),
+                result_summary=summarize_result(final_answer),
+            ))
+
+        sql_answer = SqlAnswer(
+            user_prompt, final_answer, sql_statement, explanation,
+            prompt_tokens=usage["prompt_tokens"],
+            completion_tokens=usage["completion_tokens"],
+            total_tokens=usage["total_tokens"],
+            total_cost=usage["total_cost"],
+            session_id=session_id,
+        )
 
 
         # sql_response = {
@@ -359,8 +727,8 @@ def sql_flow_function(user_prompt: str) -> str:
         #     "Explanation": explanation
         # }
 
-        # Return the dictionary directly
-        return JSONResponse(content=sql_response)
+        # The API layer shapes it into the v1 or v2 response
+        return sql_answer
 
         # sql_response = {
         #     "Prompt": user_prompt,
@@ -394,5 +762,5 @@ def sql_flow_function(user_prompt: str) -> str:
         # printmd(f"Complete")
         # return SqlResponseModel
     except Exception as e:
-        print(f"An error occurred: {e}")
+        logger.error("An error occurred: %s", e)
         raise RuntimeError("An error occurred while extracting the SQL statement.") from e
\ No newline at end of file
@@ -0,0 +1,407 @@
+import os
+import re
+import math
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from sqlalchemy import event, text
+from sqlalchemy.exc import DBAPIError, SQLAlchemyError
+from langchain.sql_database import SQLDatabase
+
+from sql_agent.compact_schema import CompactSchemaRenderer
+
+logger = logging.getLogger(__name__)
+
+# Read-only execution sandbox for agent-generated SQL.
+# The prompt asks the model not to write to the database, but a prompt is not a guarantee.
+# Every statement that the agent executes passes through this module, which:
+#   - Rejects multi-statement batches, DML/DDL and statement keywords before the query reaches
+#     the server (see validate_read_only_sql for which words are checked where).
+#   - Runs the statement in a read-only transaction (READ COMMITTED on SQL Server; SNAPSHOT,
+#     which takes no shared locks, when the database allows it: SQL_SANDBOX_ISOLATION_LEVEL).
+#   - Always rolls the transaction back, so nothing the agent does can be committed.
+# The keyword check is a first line of defence; the read-only login and the rolled-back
+# transaction are what keep a statement the check lets through from changing anything.
+
+
+class UnsafeSqlError(ValueError):
+    """Raised when generated SQL is rejected by the read-only sandbox."""
+
+
+# Keywords that can change data, schema, permissions or server state, in two groups.
+# Reserved words (SQL standard and T-SQL) cannot be bare column or table names, so they are
+# rejected wherever they appear outside literals and quoted identifiers. INTO blocks
+# SELECT ... INTO, which creates a table; UPDATE also blocks SELECT ... FOR UPDATE row locks.
+FORBIDDEN_KEYWORDS = frozenset({
+    "INSERT", "UPDATE", "DELETE",
+    "DROP", "ALTER", "CREATE", "TRUNCATE",
+    "GRANT", "REVOKE", "DENY",
+    "EXEC", "EXECUTE", "INTO", "BULK", "OPENROWSET", "OPENDATASOURCE", "OPENQUERY",
+    "BACKUP", "RESTORE", "DBCC", "SHUTDOWN", "RECONFIGURE", "WAITFOR", "DECLARE",
+    "COMMIT", "ROLLBACK",
+})
+# Statement keywords that are also ordinary table or column names (a [Load] or Export column,
+# a merge table outside SQL Server). They are rejected only where they start a statement: T-SQL
+# runs "SELECT 1 KILL 52" as two statements, so one that is followed by anything an identifier
+# cannot be followed by (another name, a literal, a number) starts a new statement. Directly
+# after SELECT, FROM, JOIN or a comma a name is expected, so there the word is a name.
+STATEMENT_KEYWORDS = frozenset({
+    "USE", "SET", "KILL", "CALL", "COPY", "LOCK", "LOAD", "IMPORT", "EXPORT", "INSTALL",
+    "ATTACH", "DETACH", "PRAGMA", "VACUUM", "RENAME", "UPSERT", "CHECKPOINT", "MERGE",
+})
+# Words that may follow a column, table or alias name in a SELECT
+_CLAUSE_WORDS = frozenset({
+    "FROM", "WHERE", "GROUP", "ORDER", "BY", "HAVING", "JOIN", "INNER", "LEFT", "RIGHT", "FULL",
+    "OUTER", "CROSS", "APPLY", "NATURAL", "LATERAL", "ON", "USING", "AND", "OR", "NOT", "AS",
+    "UNION", "EXCEPT", "INTERSECT", "ALL", "LIMIT", "OFFSET", "FETCH", "WINDOW", "OVER",
+    "PARTITION", "IS", "IN", "LIKE", "ILIKE", "BETWEEN", "ESCAPE", "THEN", "ELSE", "END", "WHEN",
+    "ASC", "DESC", "NULLS", "COLLATE", "ROWS", "ONLY", "WITH", "FOR", "TABLESAMPLE", "PIVOT",
+    "UNPIVOT", "FILTER", "WITHIN",
+})
+
+# Comments, string literals and quoted identifiers. These are blanked out before the
+# keyword check so that a literal such as 'drop-off' or a column named [Update Date]
+# is not mistaken for a statement.
+_LITERAL_PATTERN = re.compile(
+    r"--[^\n]*"                 # line comment
+    r"|/\*.*?\*/"               # block comment
+    r"|N?'(?:[^']|'')*'"        # string literal (T-SQL N'' included)
+    r"|\"(?:[^\"]|\"\")*\""     # double-quoted identifier
+    r"|\[(?:[^\]]|\]\])*\]"     # bracketed identifier
+    r"|`[^`]*`",                # backtick identifier
+    re.DOTALL,
+)
+_WORD_PATTERN = re.compile(r"[A-Za-z_][A-Za-z_0-9]*")
+# Words, numbers, string placeholders and single punctuation characters
+_TOKEN_PATTERN = re.compile(r"''|[A-Za-z_@#][\w@#$]*|\d[\w.]*|\S")
+# Tokens after which a statement keyword is still an identifier (end, list, call, operators)
+_IDENTIFIER_FOLLOWERS = frozenset(",)(.=<>!+-*/%|&^:")
+# Tokens after which a name is expected: a select list, a table reference
+_NAME_POSITIONS = frozenset({"SELECT", "DISTINCT", "FROM", "JOIN", ","})
+_TABLE_REFERENCE_PATTERN = re.compile(
+    r"\b(?:FROM|JOIN)\s+((?:\[[^\]]+\]|\"[^\"]+\"|[A-Za-z_][\w$#]*)(?:\.(?:\[[^\]]+\]|\"[^\"]+\"|[A-Za-z_][\w$#]*))*)",
+    re.IGNORECASE,
+)
+
+# Per-dialect session settings applied inside the sandbox transaction.
+_ISOLATION_LEVELS = {
+    # SNAPSHOT fails unless the database has ALLOW_SNAPSHOT_ISOLATION ON; opt in through
+    # SQL_SANDBOX_ISOLATION_LEVEL
+    "mssql": "READ COMMITTED",
+    "postgresql": "REPEATABLE READ",
+}
+_SESSION_SETUP = {
+    "mssql": ["SET LOCK_TIMEOUT {lock_timeout_ms}"],
+    "postgresql": ["SET TRANSACTION READ ONLY", "SET LOCAL lock_timeout = {lock_timeout_ms}"],
+    "sqlite": ["PRAGMA query_only = ON"],
+}
+# Settings above that outlive the transaction, restored to the server defaults before the
+# connection goes back to the pool (see _reset_session), so other users of the engine do not
+# inherit them. PostgreSQL's are transaction-scoped.
+_SESSION_RESET = {
+    "mssql": ["SET LOCK_TIMEOUT -1"],
+    "sqlite": ["PRAGMA query_only = OFF"],
+}
+_SESSION_RESET_KEY = "sql_sandbox_session_reset"
+
+
+def strip_literals_and_comments(sql: str) -> str:
+    """
+    Blank out comments, string literals and quoted identifiers in a SQL string.
+
+    Parameters:
+    - sql (str): The SQL statement.
+
+    Returns:
+    - str: The statement with literals replaced by neutral placeholders.
+    """
+    def _placeholder(match):
+        token = match.group(0)
+        if token.startswith("--") or token.startswith("/*"):
+            return " "
+        if token.startswith("'") or token.startswith("N'"):
+            return "''"
+        return "_quoted_identifier"
+
+    return _LITERAL_PATTERN.sub(_placeholder, sql)
+
+
+def _starts_statement(tokens: list, position: int) -> bool:
+    """Whether the statement keyword at tokens[position] starts a statement rather than names a column."""
+    if position > 0 and tokens[position - 1] == ".":
+        # A qualified name: t.load
+        return False
+    if position > 0 and tokens[position - 1].upper() in _NAME_POSITIONS:
+        # SELECT merge FROM t, ... JOIN copy c ON ...
+        return False
+    following = tokens[position + 1] if position + 1 < len(tokens) else None
+    if following is None or following in _IDENTIFIER_FOLLOWERS:
+        return False
+    return following.upper() not in _CLAUSE_WORDS
+
+
+def _reset_session(dbapi_connection, connection_record, reset_state) -> None:
+    """Pool "reset" listener: undo the sandbox's session settings on a connection being returned."""
+    statements = connection_record.info.pop(_SESSION_RESET_KEY, None)
+    if not statements or reset_state.terminate_only:
+        return
+    # An error here makes the pool discard the connection instead of reusing it
+    cursor = dbapi_connection.cursor()
+    try:
+        for statement in statements:
+            cursor.execute(statement)
+    finally:
+        cursor.close()
+
+
+def _register_session_reset(engine) -> None:
+    if not event.contains(engine.pool, "reset", _reset_session):
+        event.listen(engine.pool, "reset", _reset_session)
+
+
+def validate_read_only_sql(sql: str) -> str:
+    """
+    Check that a statement is a single read-only query.
+
+    Parameters:
+    - sql (str): The SQL statement produced by the agent.
+
+    Returns:
+    - str: The statement with any trailing semicolons removed.
+
+    Raises:
+    - UnsafeSqlError: If the statement is empty, batched, contains a reserved DML/DDL keyword, or
+      a statement keyword (SET, USE, KILL, LOAD...) in a position where it starts a statement.
+    """
+    statement = sql.strip().rstrip(";").strip()
+    if not statement:
+        raise UnsafeSqlError("Empty SQL statement.")
+
+    stripped = strip_literals_and_comments(statement).strip().rstrip(";").strip()
+
+    # A remaining semicolon means more than one statement in the batch
+    if ";" in stripped:
+        raise UnsafeSqlError("Multi-statement batches are not allowed. Run one SELECT statement at a time.")
+
+    words = [word.upper() for word in _WORD_PATTERN.findall(stripped)]
+    if not words or words[0] not in ("SELECT", "WITH"):
+        raise UnsafeSqlError("Only SELECT statements (optionally starting with WITH) are allowed.")
+
+    forbidden = set(words) & FORBIDDEN_KEYWORDS
+    tokens = _TOKEN_PATTERN.findall(stripped)
+    for position, token in enumerate(tokens):
+        if token.upper() in STATEMENT_KEYWORDS and _starts_statement(tokens, position):
+            forbidden.add(token.upper())
+    if forbidden:
+        raise UnsafeSqlError(
+            "Statement rejected by the read-only sandbox (found: {}). "
+            "DML and DDL statements are not allowed.".format(", ".join(sorted(forbidden)))
+        )
+
+    return statement
+
+
+def referenced_tables(sql: str) -> list:
+    """
+    List the tables referenced in FROM and JOIN clauses of a statement.
+
+    Parameters:
+    - sql (str): The SQL statement.
+
+    Returns:
+    - list: Table names in order of first appearance, without brackets or quotes.
+    """
+    # Only comments and string literals are removed here; quoted identifiers are kept
+    without_literals = re.sub(r"--[^\n]*|/\*.*?\*/|N?'(?:[^']|'')*'", " ", sql, flags=re.DOTALL)
+    tables = []
+    for match in _TABLE_REFERENCE_PATTERN.finditer(without_literals):
+        name = re.sub(r'[\[\]"]', "", match.group(1))
+        if name.upper() not in ("SELECT", "LATERAL") and name not in tables:
+            tables.append(name)
+    return tables
+
+
+class ReadOnlySQLDatabase(SQLDatabase):
+    """SQLDatabase that validates every statement and runs it in a rolled-back, read-only transaction."""
+
+    def __init__(self, engine, **kwargs):
+        super().__init__(engine, **kwargs)
+        self._isolation_level = os.getenv("SQL_SANDBOX_ISOLATION_LEVEL") or _ISOLATION_LEVELS.get(self.dialect)
+        self._lock_timeout_ms = int(os.getenv("SQL_SANDBOX_LOCK_TIMEOUT_MS", "5000"))
+        # Schema reflection mutates shared MetaData; parallel tool calls must not race on it
+        self._reflect_lock = threading.Lock()
+        # Optional ReplicaRouter; schema reflection always uses the primary engine
+        self._replica_router = None
+        # SCHEMA_RENDERING=compact: short table descriptions instead of DDL (see compact_schema.py)
+        self._compact_schema = CompactSchemaRenderer(
+            max_values=int(os.getenv("SCHEMA_SAMPLE_VALUES", "3")),
+            max_chars=int(os.getenv("SCHEMA_SAMPLE_MAX_CHARS", "20")),
+        ) if os.getenv("SCHEMA_RENDERING", "full").lower() == "compact" else None
+        if self.dialect in _SESSION_RESET:
+            _register_session_reset(engine)
+
+    def set_replica_router(self, replica_router) -> None:
+        """Run agent queries on readable replicas chosen by the router (see replica_routing.py)."""
+        if self.dialect in _SESSION_RESET:
+            for replica in replica_router.replicas:
+                _register_session_reset(replica.engine)
+        self._replica_router = replica_router
+
+    def get_table_info(self, table_names=None) -> str:
+        with self._reflect_lock:
+            names = set(table_names or self.get_usable_table_names()) & set(self._all_tables)
+            reflected = {table.name for table in self._metadata.sorted_tables}
+            to_reflect = names - reflected
+            if to_reflect:
+                self._metadata.reflect(views=self._view_support, bind=self._engine,
+                                       only=list(to_reflect), schema=self._schema)
+        # Reflection is done, so sample-row queries for several calls can run concurrently
+        if self._compact_schema is not None:
+            return self._get_compact_table_info(table_names)
+        return super().get_table_info(table_names)
+
+    def _get_compact_table_info(self, table_names=None) -> str:
+        names = list(table_names) if table_names else sorted(self.get_usable_table_names())
+        missing_tables = set(names) - set(self.get_usable_table_names())
+        if missing_tables:
+            raise ValueError(f"table_names {missing_tables} not found in database")
+        tables = [table for table in self._metadata.sorted_tables if table.name in names]
+        # Hand-written descriptions (custom_table_info) are kept as they are
+        custom = self._custom_table_info or {}
+        renderings = [custom[table.name] for table in tables if table.name in custom]
+        rendered = self._compact_schema.render(self, [table for table in tables if table.name not in custom])
+        return "\n\n".join(renderings + ([rendered] if rendered else []))
+
+    def _execute(self, command, fetch: str = "all", *,
+                 parameters: Optional[Dict[str, Any]] = None,
+                 execution_options: Optional[Dict[str, Any]] = None):
+        # Agent SQL arrives as a string. Pre-built SQLAlchemy selectables (e.g., sample rows)
+        # are generated by LangChain itself and are read-only by construction.
+        if isinstance(command, str):
+            command = text(validate_read_only_sql(command))
+
+        # Optional per-statement timeout, e.g. for speculative candidate queries
+        execution_options = dict(execution_options or {})
+        timeout_seconds = execution_options.pop("sandbox_timeout_seconds", None)
+        # Optional consumer of the streamed rows (see stream below)
+        consume = execution_options.pop("sandbox_consume", None)
+        run = (command, fetch, parameters, execution_options, timeout_seconds, consume)
+
+        # Read-replica routing (see replica_routing.py): a connection failure on the replica
+        # moves the query to the primary; errors in the query itself are returned as usual.
+        replica = self._replica_router.select() if self._replica_router is not None else None
+        if replica is not None:
+            try:
+                connection = replica.engine.connect()
+            except SQLAlchemyError as e:
+                self._replica_router.mark_failed(replica, e)
+            else:
+                try:
+                    return self._execute_in_transaction(connection, *run)
+                except DBAPIError as e:
+                    if not e.connection_invalidated:
+                        raise
+                    self._replica_router.mark_failed(replica, e)
+        return self._execute_in_transaction(self._engine.connect(), *run)
+
+    def _execute_in_transaction(self, connection, command, fetch, parameters, execution_options, timeout_seconds,
+                                consume=None):
+        with connection:
+            if self._isolation_level:
+                connection = connection.execution_options(isolation_level=self._isolation_level)
+
+            transaction = connection.begin()
+            reset_timeout = None
+            try:
+                if self.dialect in _SESSION_RESET:
+                    # Restored when the connection is returned to the pool
+                    connection.connection.info[_SESSION_RESET_KEY] = _SESSION_RESET[self.dialect]
+                for setup in _SESSION_SETUP.get(self.dialect, []):
+                    connection.exec_driver_sql(setup.format(lock_timeout_ms=self._lock_timeout_ms))
+                if timeout_seconds:
+                    reset_timeout = self._apply_statement_timeout(connection, timeout_seconds)
+
+                cursor = connection.execute(command, parameters or {}, execution_options=execution_options)
+                if consume is not None:
+                    # Rows are read while the transaction is open; the consumer decides how many
+                    if not cursor.returns_rows:
+                        return consume([], iter(()))
+                    return consume(list(cursor.keys()), (tuple(row) for row in cursor))
+                if not cursor.returns_rows:
+                    return []
+                if fetch == "all":
+                    return [row._asdict() for row in cursor.fetchall()]
+                if fetch == "one":
+                    first_result = cursor.fetchone()
+                    return [] if first_result is None else [first_result._asdict()]
+                if fetch == "cursor":
+                    # Buffer the rows so the result outlives the rolled-back transaction
+                    return cursor.freeze()()
+                raise ValueError("Fetch parameter must be either 'one', 'all', or 'cursor'")
+            finally:
+                # Never commit: whatever happened, the transaction is discarded
+                transaction.rollback()
+                if reset_timeout:
+                    reset_timeout()
+
+    def stream(self, command: str, consume: Callable[[list, Any], Any], timeout_seconds: Optional[float] = None):
+        """
+        Run a query in the sandbox and hand its rows to a consumer as they are fetched.
+
+        Unlike run(fetch="cursor"), which buffers the whole result, only the rows the consumer
+        reads are fetched; the rest are discarded with the transaction.
+
+        Parameters:
+        - command (str): The SQL statement, validated like every agent query.
+        - consume (callable): Called with (column names, iterator of row tuples) inside the
+          transaction; a statement that returns no rows gives ([], empty iterator).
+        - timeout_seconds (float): Optional statement timeout.
+
+        Returns:
+        - Whatever consume returns.
+        """
+        execution_options = {"sandbox_consume": consume}
+        if self._engine.dialect.supports_server_side_cursors:
+            # Without it, drivers such as psycopg load the whole result at execute time
+            execution_options["stream_results"] = True
+        if timeout_seconds:
+            execution_options["sandbox_timeout_seconds"] = timeout_seconds
+        return self._execute(command, fetch="all", execution_options=execution_options)
+
+    def _apply_statement_timeout(self, connection, timeout_seconds: float):
+        """
+        Limit the running time of the next statement on this connection.
+
+        Returns:
+        - callable | None: Restores the pooled connection's previous setting.
+        """
+        if self.dialect == "postgresql":
+            # Scoped to the (rolled back) transaction
+            connection.exec_driver_sql("SET LOCAL statement_timeout = {}".format(int(timeout_seconds * 1000)))
+            return None
+
+        dbapi_connection = connection.connection.driver_connection
+        if self.dialect == "mssql" and hasattr(dbapi_connection, "timeout"):
+            # pyodbc query timeout, in whole seconds
+            previous = dbapi_connection.timeout
+            dbapi_connection.timeout = max(1, math.ceil(timeout_seconds))
+            return lambda: setattr(dbapi_connection, "timeout", previous)
+
+        if self.dialect == "sqlite":
+            # Abort the statement from SQLite's progress handler once the deadline passes
+            deadline = time.monotonic() + timeout_seconds
+            dbapi_connection.set_progress_handler(lambda: 1 if time.monotonic() > deadline else 0, 10000)
+            return lambda: dbapi_connection.set_progress_handler(None, 0)
+
+        # No server-side timeout for this dialect; callers still stop waiting after the timeout
+        return None
+
+    def run_no_throw(self, command: str, *args, **kwargs):
+        """Run the command, returning sandbox rejections to the agent as an error string."""
+        try:
+            return self.run(command, *args, **kwargs)
+        except (UnsafeSqlError, SQLAlchemyError) as e:
+            logger.warning("Sandbox rejected or failed agent query: %s", e)
+            return f"Error: {e}"
@@ -0,0 +1,123 @@
+import os
+import time
+import logging
+import tempfile
+import threading
+
+from langchain_core.agents import AgentStep
+
+logger = logging.getLogger(__name__)
+
+# Retention policy for the agent's intermediate steps.
+# The executor keeps every (action, observation) pair for the whole request, and a single
+# sql_db_query observation is the full result set rendered as a string. With large results and
+# many concurrent requests, those strings dominate resident memory.
+# StepRetentionPolicy compacts each observation as the tool returns it, so the full string is
+# released right away:
+#   full      keep observations as they are (previous behaviour)
+#   truncate  keep the first STEP_OBSERVATION_MAX_CHARS characters plus the row count (default)
+#   spill     like truncate, but the full observation is written to a file in STEP_SPILL_DIR
+#             for later inspection; the path is logged, the model is not told about it
+# Only query results (sql_db_query, sql_db_query_candidates) are compacted: table lists and
+# schemas are kept whole, or the model would write SQL against cut-off schemas.
+# The tool input (the SQL) is always kept. The model sees the compacted observation in later
+# turns, which also bounds prompt tokens; the row count tells it the result was cut.
+# Each policy instance belongs to one request and accounts for the bytes it kept, dropped
+# and spilled; sql_agent_service.py reports them to the metrics registry (metrics.py).
+
+RETENTION_MODES = ("full", "truncate", "spill")
+
+# Tools whose observations are query results
+COMPACTED_TOOLS = ("sql_db_query", "sql_db_query_candidates")
+
+
+def estimate_row_count(observation: str):
+    """Approximate row count of a sql_db_query result (a rendered list of tuples), or None."""
+    text = observation.strip()
+    if not text.startswith("[("):
+        return None
+    return text.count("), (") + 1
+
+
+class StepRetentionPolicy:
+    """Compacts agent step observations for one request and accounts for their size."""
+
+    def __init__(self, mode: str = "truncate", max_chars: int = 4000, spill_dir: str = None,
+                 spill_ttl_seconds: int = 3600):
+        if mode not in RETENTION_MODES:
+            raise ValueError("Unknown STEP_RETENTION '{}'. Use one of: {}".format(mode, ", ".join(RETENTION_MODES)))
+        self.mode = mode
+        self.max_chars = max_chars
+        self.spill_dir = spill_dir or os.path.join(tempfile.gettempdir(), "sql_agent_steps")
+        self.spill_ttl_seconds = spill_ttl_seconds
+        self._lock = threading.Lock()
+        self.stats = {"steps": 0, "retained_bytes": 0, "dropped_bytes": 0, "spilled_bytes": 0,
+                      "largest_observation_bytes": 0}
+
+    @classmethod
+    def from_env(cls) -> "StepRetentionPolicy":
+        return cls(
+            mode=os.getenv("STEP_RETENTION", "truncate").lower(),
+            max_chars=int(os.getenv("STEP_OBSERVATION_MAX_CHARS", "4000")),
+            spill_dir=os.getenv("STEP_SPILL_DIR"),
+            spill_ttl_seconds=int(os.getenv("STEP_SPILL_TTL_SECONDS", "3600")),
+        )
+
+    def _account(self, **sizes) -> None:
+        # Tool calls of one turn can finish on different threads (parallel_tools.py)
+        with self._lock:
+            self.stats["steps"] += 1
+            for name, size in sizes.items():
+                self.stats[name] += size
+
+    def _spill(self, observation: str) -> str:
+        os.makedirs(self.spill_dir, exist_ok=True)
+        self._prune_spill_dir()
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=self.spill_dir, prefix="step_",
+                                         suffix=".txt", delete=False) as f:
+            f.write(observation)
+            return f.name
+
+    def _prune_spill_dir(self) -> None:
+        cutoff = time.time() - self.spill_ttl_seconds
+        for entry in os.scandir(self.spill_dir):
+            try:
+                if entry.name.startswith("step_") and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError:
+                # Another worker removed it first
+                pass
+
+    def compact_observation(self, observation) -> str:
+        """Return the observation to retain, accounting for what was kept, dropped or spilled."""
+        if not isinstance(observation, str):
+            observation = str(observation)
+        size = len(observation.encode("utf-8"))
+        with self._lock:
+            self.stats["largest_observation_bytes"] = max(self.stats["largest_observation_bytes"], size)
+
+        if self.mode == "full" or len(observation) <= self.max_chars:
+            self._account(retained_bytes=size)
+            return observation
+
+        row_count = estimate_row_count(observation)
+        kept = observation[:self.max_chars]
+        note = "\n[Result truncated: showing {} of {} characters{}. Aggregate or filter in SQL to see the rest.]".format(
+            self.max_chars, len(observation), ", about {} rows in total".format(row_count) if row_count else "")
+        if self.mode == "spill":
+            spill_path = self._spill(observation)
+            # The path is for operators; the model cannot read files
+            logger.info("Spilled a %d-byte step observation to %s", size, spill_path)
+            self._account(retained_bytes=len(kept.encode("utf-8")), spilled_bytes=size)
+        else:
+            self._account(retained_bytes=len(kept.encode("utf-8")), dropped_bytes=size - len(kept.encode("utf-8")))
+        return kept + note
+
+    def compact_step(self, step):
+        """Compact the observation of a query tool's AgentStep; other items are returned unchanged."""
+        if not isinstance(step, AgentStep):
+            return step
+        if getattr(step.action, "tool", None) not in COMPACTED_TOOLS:
+            self._account(retained_bytes=len(str(step.observation).encode("utf-8")))
+            return step
+        return AgentStep(action=step.action, observation=self.compact_observation(step.observation))
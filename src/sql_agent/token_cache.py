@@ -0,0 +1,156 @@
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Cached Entra ID access tokens shared by the database engine and the LLM client.
+# Resolving the DefaultAzureCredential chain and acquiring a token can take hundreds of
+# milliseconds. Without a cache, the token-based database backends paid that cost on every new
+# pooled connection (do_connect hook), and the LLM client paid it on its own schedule.
+# CachedTokenProvider keeps one token per scope and refreshes it on a background thread before
+# it expires, so requests read a valid token from memory. A caller only waits when no valid
+# token exists at all (the very first call, or after the refresher kept failing until expiry).
+#
+# The credential is injectable, so the provider can be exercised with a fake credential whose
+# get_token(scope) returns an object with .token and .expires_on (epoch seconds).
+
+COGNITIVE_SERVICES_SCOPE = "https://cognitiveservices.azure.com/.default"
+
+
+class CachedTokenProvider:
+    """Thread-safe token cache for one scope, with proactive background refresh."""
+
+    def __init__(self, credential, scope: str, refresh_margin_seconds: float = 300,
+                 retry_seconds: float = 30, background: bool = True, clock=time.time):
+        self.credential = credential
+        self.scope = scope
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self.retry_seconds = retry_seconds
+        self.background = background
+        self._clock = clock
+        self._token = None
+        self._expires_on = 0.0
+        self._lock = threading.Lock()
+        # Serializes acquisitions so concurrent callers share one round trip
+        self._acquire_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.refresh_count = 0
+
+    def _acquire(self) -> None:
+        access_token = self.credential.get_token(self.scope)
+        with self._lock:
+            self._token = access_token.token
+            self._expires_on = float(access_token.expires_on)
+            self.refresh_count += 1
+        logger.info("Acquired access token for %s (expires in %.0f s)", self.scope, self._expires_on - self._clock())
+
+    def _is_valid(self) -> bool:
+        # Small safety window so a token is not handed out seconds before it expires
+        return self._token is not None and self._clock() < self._expires_on - 30
+
+    def get_token(self) -> str:
+        """
+        Return a valid access token.
+
+        Returns:
+        - str: The cached token; acquired synchronously only when no valid token exists.
+        """
+        with self._lock:
+            if self._is_valid():
+                return self._token
+
+        # No valid token: acquire it now
+        with self._acquire_lock:
+            if not self._is_valid():
+                self._acquire()
+        self.start()
+        return self._token
+
+    # The provider can be passed directly as AzureChatOpenAI(azure_ad_token_provider=...)
+    __call__ = get_token
+
+    def prefetch(self) -> None:
+        """Acquire the first token and start the background refresher (e.g., at startup)."""
+        self.get_token()
+
+    def seconds_until_refresh(self) -> float:
+        with self._lock:
+            return self._expires_on - self.refresh_margin_seconds - self._clock()
+
+    def _refresh_loop(self) -> None:
+        while not self._stop.is_set():
+            wait_seconds = max(self.seconds_until_refresh(), 1.0)
+            if self._stop.wait(wait_seconds):
+                return
+            try:
+                with self._acquire_lock:
+                    self._acquire()
+            except Exception as e:
+                # Keep serving the current token while it is valid and retry soon
+                logger.warning("Background token refresh for %s failed: %s", self.scope, e)
+                if self._stop.wait(self.retry_seconds):
+                    return
+
+    def start(self) -> None:
+        """Start the background refresher if it is enabled and not already running."""
+        if not self.background:
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._refresh_loop, name="token-refresh", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+_registry_lock = threading.Lock()
+_providers = {}
+_credential = None
+
+
+def set_credential(credential) -> None:
+    """Replace the shared credential (e.g., with a fake in tests) and drop cached providers."""
+    global _credential
+    with _registry_lock:
+        for provider in _providers.values():
+            provider.stop()
+        _providers.clear()
+        _credential = credential
+
+
+def _get_credential():
+    global _credential
+    if _credential is None:
+        # Resolve the credential chain once per process
+        from azure.identity import DefaultAzureCredential
+        _credential = DefaultAzureCredential()
+    return _credential
+
+
+def get_token_provider(scope: str) -> CachedTokenProvider:
+    """
+    Return the process-wide token provider for a scope.
+
+    Parameters:
+    - scope (str): The token scope, e.g. https://database.windows.net/.default.
+
+    Returns:
+    - CachedTokenProvider: Shared by every caller that asks for this scope.
+    """
+    with _registry_lock:
+        provider = _providers.get(scope)
+        if provider is None:
+            provider = CachedTokenProvider(_get_credential(), scope)
+            _providers[scope] = provider
+        return provider
+
+
+def get_registered_providers() -> list:
+    """Return the providers created so far (e.g., to prefetch them at startup)."""
+    with _registry_lock:
+        return list(_providers.values())
@@ -0,0 +1,212 @@
+import os
+import re
+import pickle
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Iterable, Optional
+
+from sql_agent.metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+# Local topic gate in front of the agent.
+# The prompt tells the agent to answer "I don't know" to questions unrelated to the database,
+# but reaching that answer costs a full agent run: listing the tables, fetching schemas and
+# several LLM calls. The gate decides in well under a millisecond, without any LLM call:
+#   1. vocabulary overlap: the question's words (stop words and generic words like "show" or
+#      "total" removed, plurals folded) are matched against the schema vocabulary: table and
+#      column names split into words, text values from the column statistics (column_profiler.py)
+#      and the metric and dimension phrases of the semantic layer
+#   2. optional classifier (TOPIC_GATE_MODEL_PATH): a pickled scikit-learn text pipeline
+#      (label 1 = on topic), consulted only when there is no overlap; it can accept questions
+#      that use words the schema does not, e.g. "people" for a table of applicants
+# Modes (TOPIC_GATE):
+#   off      no gate
+#   shadow   decisions are logged and counted in /metrics, every question still goes to the agent
+#   enforce  off-topic questions get the canned "I don't know" answer right away
+# Only standalone questions are gated: follow-ups ("now only for 2021") lean on their session.
+# benchmarks/topic_gate_eval.py measures the false-reject rate on a labeled question set; run it
+# (and shadow mode on real traffic) before switching to enforce.
+
+GATE_MODES = ("off", "shadow", "enforce")
+
+_STOP_WORDS = frozenset({
+    "a", "about", "all", "an", "and", "any", "are", "as", "at", "be", "been", "but", "by", "can",
+    "could", "did", "do", "does", "each", "for", "from", "get", "give", "had", "has", "have", "he",
+    "her", "his", "how", "i", "if", "in", "into", "is", "it", "its", "just", "know", "let", "like",
+    "list", "many", "me", "much", "my", "need", "not", "now", "of", "on", "one", "or", "our",
+    "please", "she", "should", "show", "so", "some", "tell", "than", "that", "the", "their", "them",
+    "then", "there", "these", "they", "this", "those", "to", "us", "want", "was", "we", "were",
+    "what", "when", "where", "which", "who", "whom", "why", "will", "with", "would", "you", "your",
+})
+
+# Words every data question uses; they say nothing about the topic
+_GENERIC_WORDS = frozenset({
+    "above", "across", "after", "average", "avg", "before", "below", "between", "biggest", "count",
+    "data", "database", "each", "find", "first", "highest", "largest", "last", "least", "less",
+    "lowest", "max", "maximum", "mean", "median", "min", "minimum", "more", "most", "number",
+    "over", "per", "percent", "percentage", "query", "rank", "ratio", "record", "row", "smallest",
+    "sum", "table", "top", "total", "under", "value",
+})
+
+
+def stem(word: str) -> str:
+    """Fold plurals so "loans" matches "loan" and "categories" matches "category"."""
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 4 and word.endswith(("ses", "xes", "ches", "shes")):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def identifier_words(name: str) -> list:
+    """Words of an identifier: loan_amount -> loan, amount; HomeOwnership -> home, ownership."""
+    spaced = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", str(name))
+    return [word for word in re.findall(r"[a-z0-9]+", spaced.lower()) if len(word) > 1]
+
+
+def question_terms(question: str) -> list:
+    """Topic-bearing words of a question, stemmed."""
+    words = re.findall(r"[a-z0-9]+", question.lower())
+    return [stem(word) for word in words
+            if word not in _STOP_WORDS and word not in _GENERIC_WORDS and not word.isdigit() and len(word) > 1]
+
+
+def build_vocabulary(db=None, column_stats: Optional[dict] = None, semantic_layer=None,
+                     extra_terms: Iterable[str] = ()) -> set:
+    """
+    Collect the schema vocabulary of a database.
+
+    Parameters:
+    - db (SQLDatabase): Table names, and the columns of the tables reflected so far.
+    - column_stats (dict): Precomputed column statistics; adds every column and frequent text values.
+    - semantic_layer (SemanticLayer): Adds the metric and dimension names and synonyms.
+    - extra_terms (list): Additional words or phrases (TOPIC_GATE_EXTRA_TERMS).
+
+    Returns:
+    - set: Stemmed words.
+    """
+    phrases = list(extra_terms)
+    if db is not None:
+        phrases.extend(db.get_usable_table_names())
+        for table in list(db._metadata.tables.values()):
+            phrases.append(table.name)
+            phrases.extend(column.name for column in table.columns)
+    if column_stats:
+        for table_name, table in column_stats.get("tables", {}).items():
+            phrases.append(table_name)
+            for column_name, profile in table.get("columns", {}).items():
+                phrases.append(column_name)
+                phrases.extend(str(value) for value, _ in profile.get("top_values") or [] if isinstance(value, str))
+    if semantic_layer is not None:
+        for definitions in (semantic_layer.metrics, semantic_layer.dimensions):
+            for name, definition in definitions.items():
+                phrases.append(name)
+                phrases.extend(definition.get("synonyms", []))
+
+    vocabulary = set()
+    for phrase in phrases:
+        for word in identifier_words(phrase):
+            if word not in _STOP_WORDS and word not in _GENERIC_WORDS:
+                vocabulary.add(stem(word))
+    return vocabulary
+
+
+def load_classifier(path: str):
+    """Load a pickled text classifier with predict_proba (e.g., a scikit-learn Pipeline)."""
+    with open(path, "rb") as f:
+        classifier = pickle.load(f)
+    if not hasattr(classifier, "predict_proba"):
+        raise ValueError("The topic classifier in {} has no predict_proba.".format(path))
+    return classifier
+
+
+@dataclass
+class TopicVerdict:
+    on_topic: bool
+    reason: str
+    matched_terms: list = field(default_factory=list)
+    probability: Optional[float] = None
+
+
+class TopicGate:
+    """Decides locally whether a question is about the database."""
+
+    def __init__(self, vocabulary: set, min_overlap: int = 1, classifier=None, threshold: float = 0.5):
+        self.vocabulary = vocabulary
+        self.min_overlap = min_overlap
+        self.classifier = classifier
+        self.threshold = threshold
+
+    def check(self, question: str) -> TopicVerdict:
+        terms = question_terms(question)
+        matched = sorted({term for term in terms if term in self.vocabulary})
+        if len(matched) >= self.min_overlap:
+            return TopicVerdict(True, "schema vocabulary", matched)
+        if self.classifier is not None:
+            probabilities = self.classifier.predict_proba([question])[0]
+            classes = list(getattr(self.classifier, "classes_", [0, 1]))
+            probability = float(probabilities[classes.index(1)])
+            return TopicVerdict(probability >= self.threshold, "classifier", matched, round(probability, 4))
+        if not terms:
+            return TopicVerdict(False, "no content words")
+        return TopicVerdict(False, "no schema vocabulary")
+
+
+def topic_gate_mode() -> str:
+    mode = os.getenv("TOPIC_GATE", "off").lower()
+    if mode not in GATE_MODES:
+        raise ValueError("Unknown TOPIC_GATE '{}'. Use one of: {}".format(mode, ", ".join(GATE_MODES)))
+    return mode
+
+
+_gates = {}
+_classifier = None
+_classifier_loaded = False
+_gates_lock = threading.Lock()
+
+
+def _get_classifier():
+    # Caller holds the lock
+    global _classifier, _classifier_loaded
+    if not _classifier_loaded:
+        path = os.getenv("TOPIC_GATE_MODEL_PATH")
+        if path:
+            try:
+                _classifier = load_classifier(path)
+                logger.info("Loaded the topic classifier from %s", path)
+            except Exception as e:
+                logger.warning("Could not load the topic classifier from %s; using vocabulary overlap only: %s", path, e)
+        _classifier_loaded = True
+    return _classifier
+
+
+def get_topic_gate(runtime, column_stats: Optional[dict] = None, semantic_layer=None) -> TopicGate:
+    """
+    Return the topic gate of a runtime (runtime.py).
+
+    The vocabulary is rebuilt when more tables have been reflected since it was built, so it
+    grows as the agent and the warm-up reflect the schema.
+    """
+    key = (runtime.data_source.name, id(runtime.db), len(runtime.db._metadata.tables))
+    with _gates_lock:
+        gate = _gates.get(runtime.data_source.name)
+        if gate is None or gate[0] != key:
+            extra_terms = [term.strip() for term in os.getenv("TOPIC_GATE_EXTRA_TERMS", "").split(",") if term.strip()]
+            vocabulary = build_vocabulary(runtime.db, column_stats, semantic_layer, extra_terms)
+            gate = (key, TopicGate(vocabulary,
+                                   min_overlap=int(os.getenv("TOPIC_GATE_MIN_OVERLAP", "1")),
+                                   classifier=_get_classifier(),
+                                   threshold=float(os.getenv("TOPIC_GATE_THRESHOLD", "0.5"))))
+            _gates[runtime.data_source.name] = gate
+        return gate[1]
+
+
+def record_verdict(verdict: TopicVerdict, mode: str) -> None:
+    metrics = get_metrics()
+    metrics.increment("topic_gate.on_topic" if verdict.on_topic else "topic_gate.off_topic")
+    if not verdict.on_topic:
+        metrics.increment("topic_gate.rejected" if mode == "enforce" else "topic_gate.would_reject")
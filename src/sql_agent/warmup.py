@@ -0,0 +1,188 @@
+import os
+import time
+import logging
+import threading
+
+from sql_agent.column_stats_tool import load_column_stats
+from sql_agent.example_store import get_example_store
+from sql_agent.question_log import get_recent_questions, replaying
+from sql_agent.runtime import get_runtime, get_runtime_pool
+from sql_agent.semantic_layer import get_semantic_layer
+from sql_agent.token_cache import COGNITIVE_SERVICES_SCOPE, get_registered_providers, get_token_provider
+
+logger = logging.getLogger(__name__)
+
+# Background warm-up scheduler, started from startup_event in main.py.
+# After a deploy or scale-out, the first requests on a new instance used to pay for opening
+# connections, reflecting the schema, acquiring tokens and loading the local caches. The
+# scheduler does that work on a background thread before traffic arrives:
+#   1. connections  open WARMUP_POOL_CONNECTIONS pooled connections on the shared engine (runtime.py)
+#   2. tokens       acquire the Entra ID tokens and start their background refresh (token_cache.py)
+#   3. schema       reflect every usable table and load column statistics, few-shot examples
+#                   and the semantic layer
+#   4. replay       run the WARMUP_REPLAY_TOP_N most frequent recent questions through the
+#                   service (question_log.py). This costs LLM calls, so it is off by default.
+# Connections and schema are required: they are retried with backoff until they succeed.
+# Tokens and replay are best effort. GET /ready in main.py reports "ready" only once all the
+# steps have finished.
+# Afterwards, every WARMUP_INTERVAL_SECONDS, the scheduler saves the recent question log (so the
+# next instance knows which questions to replay) and evicts idle data source runtimes.
+
+STEPS = ("connections", "tokens", "schema", "replay")
+
+
+class WarmupScheduler:
+    """Runs the warm-up steps once, then periodic background upkeep."""
+
+    def __init__(self, pool_connections: int = 2, replay_top_n: int = 0, interval_seconds: float = 60,
+                 max_backoff_seconds: float = 60):
+        self.pool_connections = pool_connections
+        self.replay_top_n = replay_top_n
+        self.interval_seconds = interval_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.state = "pending"
+        self.steps = {step: {"status": "pending"} for step in STEPS}
+        self.started_at = None
+        self.completed_at = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_env(cls) -> "WarmupScheduler":
+        return cls(
+            pool_connections=int(os.getenv("WARMUP_POOL_CONNECTIONS", "2")),
+            replay_top_n=int(os.getenv("WARMUP_REPLAY_TOP_N", "0")),
+            interval_seconds=float(os.getenv("WARMUP_INTERVAL_SECONDS", "60")),
+        )
+
+    def is_ready(self) -> bool:
+        return self.state == "ready"
+
+    def status(self) -> dict:
+        with self._lock:
+            return {"state": self.state, "started_at": self.started_at, "completed_at": self.completed_at,
+                    "steps": {name: dict(step) for name, step in self.steps.items()}}
+
+    def _set_step(self, name: str, **fields) -> None:
+        with self._lock:
+            self.steps[name].update(fields)
+
+    def _run_step(self, name: str, step, required: bool) -> None:
+        attempt = 0
+        while not self._stop.is_set():
+            attempt += 1
+            start = time.perf_counter()
+            self._set_step(name, status="running", attempts=attempt)
+            try:
+                detail = step()
+            except Exception as e:
+                logger.warning("Warm-up step %s failed (attempt %d): %s", name, attempt, e)
+                self._set_step(name, status="failed", error=str(e)[:500])
+                if not required:
+                    return
+                self._stop.wait(min(self.max_backoff_seconds, 2 ** attempt))
+                continue
+            seconds = round(time.perf_counter() - start, 3)
+            self._set_step(name, status="done", seconds=seconds, detail=detail, error=None)
+            logger.info("Warm-up step %s done in %.2f s: %s", name, seconds, detail)
+            return
+
+    # Warm-up steps
+    def open_connections(self) -> str:
+        runtime = get_runtime()
+        pool_size = runtime.engine.pool.size() if hasattr(runtime.engine.pool, "size") else self.pool_connections
+        count = max(1, min(self.pool_connections, pool_size))
+        # Checked out together, so the pool really opens `count` distinct connections
+        connections = [runtime.engine.connect() for _ in range(count)]
+        for connection in connections:
+            connection.close()
+        return "{} connection(s) open".format(count)
+
+    def prefetch_tokens(self) -> str:
+        if not os.getenv("AZURE_OPENAI_API_KEY"):
+            get_token_provider(COGNITIVE_SERVICES_SCOPE)
+        providers = get_registered_providers()
+        for provider in providers:
+            provider.prefetch()
+        return "{} token scope(s)".format(len(providers))
+
+    def reflect_schema(self) -> str:
+        runtime = get_runtime()
+        tables = runtime.db.get_usable_table_names()
+        runtime.db.get_table_info(tables)
+        load_column_stats(runtime.database_name)
+        get_example_store()
+        get_semantic_layer()
+        get_recent_questions().load(runtime.database_name)
+        return "{} table(s) reflected".format(len(tables))
+
+    def replay_questions(self) -> str:
+        if self.replay_top_n <= 0:
+            return "disabled"
+        # Imported here: the service module loads the LLM settings and prompts
+        from sql_agent.sql_agent_service import sql_flow_function
+        questions = get_recent_questions().top(self.replay_top_n)
+        replayed = 0
+        for question in questions:
+            if self._stop.is_set():
+                break
+            try:
+                # Not recorded again: replays must not inflate their own frequency
+                with replaying():
+                    sql_flow_function(question)
+                replayed += 1
+            except Exception as e:
+                logger.warning("Warm-up replay of %r failed: %s", question, e)
+        return "{} of {} question(s) replayed".format(replayed, len(questions))
+
+    def _run(self) -> None:
+        with self._lock:
+            self.state = "running"
+            self.started_at = time.time()
+        self._run_step("connections", self.open_connections, required=True)
+        self._run_step("tokens", self.prefetch_tokens, required=False)
+        self._run_step("schema", self.reflect_schema, required=True)
+        self._run_step("replay", self.replay_questions, required=False)
+        if self._stop.is_set():
+            return
+        with self._lock:
+            self.state = "ready"
+            self.completed_at = time.time()
+        logger.info("Warm-up complete in %.2f s", self.completed_at - self.started_at)
+
+        # Background upkeep: persist the recent questions for the next instance and release
+        # the connections of data sources nobody has asked about for a while
+        while not self._stop.wait(self.interval_seconds):
+            self.save_question_log()
+            get_runtime_pool().evict_idle()
+
+    def save_question_log(self) -> None:
+        try:
+            get_recent_questions().save(get_runtime().database_name)
+        except Exception as e:
+            logger.warning("Could not save the recent question log: %s", e)
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="warmup", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self.state == "ready":
+            self.save_question_log()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_warmup_scheduler() -> WarmupScheduler:
+    """Return the process-wide warm-up scheduler."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = WarmupScheduler.from_env()
+        return _scheduler
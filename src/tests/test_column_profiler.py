@@ -0,0 +1,36 @@
+import pytest
+from sqlalchemy import MetaData, Table, create_engine
+from sqlalchemy.dialects import mssql
+from sqlalchemy.sql import sqltypes
+
+from sql_agent.column_profiler import _is_groupable, profile_table
+
+
+def loans_table(engine):
+    with engine.begin() as connection:
+        connection.exec_driver_sql("CREATE TABLE loans (loan_id INTEGER, state TEXT, note VARCHAR, loan_amount REAL)")
+        connection.exec_driver_sql("INSERT INTO loans VALUES (1, 'TX', 'first', 100.0), (2, 'TX', 'second', 250.0), "
+                                   "(3, 'CA', 'third', 50.0), (4, NULL, 'fourth', 75.0)")
+    return Table("loans", MetaData(), autoload_with=engine)
+
+
+@pytest.mark.parametrize("url", ["sqlite://", "duckdb:///:memory:"])
+def test_unbounded_strings_get_cardinality_and_top_values(url):
+    if url.startswith("duckdb"):
+        pytest.importorskip("duckdb_engine")
+    engine = create_engine(url)
+    profile = profile_table(engine, loans_table(engine), top_k=5, max_distinct=3)
+    state = profile["columns"]["state"]
+    assert (state["null_ratio"], state["cardinality"]) == (0.25, 2)
+    assert state["top_values"] == [["TX", 2], ["CA", 1]]
+    # Four distinct notes: counted, but over max_distinct so no value dictionary
+    assert profile["columns"]["note"]["cardinality"] == 4 and "top_values" not in profile["columns"]["note"]
+    assert (profile["columns"]["loan_amount"]["min"], profile["columns"]["loan_amount"]["max"]) == (50.0, 250.0)
+
+
+def test_sql_server_large_objects_are_not_grouped():
+    assert not _is_groupable(mssql.NTEXT(), "mssql")
+    assert not _is_groupable(mssql.NVARCHAR(None), "mssql")
+    assert _is_groupable(mssql.NVARCHAR(50), "mssql")
+    assert _is_groupable(sqltypes.TEXT(), "sqlite")
+    assert not _is_groupable(sqltypes.JSON(), "postgresql")
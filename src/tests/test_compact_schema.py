@@ -0,0 +1,51 @@
+from sqlalchemy import MetaData, Table, create_engine
+
+from sql_agent.compact_schema import CompactSchemaRenderer, table_fingerprint
+from sql_agent.sql_sandbox import ReadOnlySQLDatabase
+
+
+def reflect(engine, name):
+    return Table(name, MetaData(), autoload_with=engine)
+
+
+def counting_database(engine, monkeypatch):
+    db = ReadOnlySQLDatabase(engine)
+    queries = []
+    execute = db._execute
+    def counted(command, *args, **kwargs):
+        queries.append(command)
+        return execute(command, *args, **kwargs)
+    monkeypatch.setattr(db, "_execute", counted)
+    return db, queries
+
+
+def test_unchanged_tables_are_rendered_once(tmp_path, monkeypatch):
+    engine = create_engine("sqlite:///{}".format(tmp_path / "loans.db"))
+    with engine.begin() as connection:
+        connection.exec_driver_sql("CREATE TABLE loans (loan_id INTEGER PRIMARY KEY, state VARCHAR(2))")
+        connection.exec_driver_sql("INSERT INTO loans VALUES (1, 'CA'), (2, 'TX')")
+    db, queries = counting_database(engine, monkeypatch)
+    renderer = CompactSchemaRenderer()
+
+    first = renderer.render(db, [reflect(engine, "loans")])
+    # A new reflection of the same schema has the same fingerprint: no new sample query
+    assert renderer.render(db, [reflect(engine, "loans")]) == first
+    assert first == "TABLE loans (loan_id int PK, state str)\n  e.g. state: CA | TX"
+    assert len(queries) == 1
+
+
+def test_changed_tables_are_rendered_again(tmp_path, monkeypatch):
+    engine = create_engine("sqlite:///{}".format(tmp_path / "loans.db"))
+    with engine.begin() as connection:
+        connection.exec_driver_sql("CREATE TABLE loans (loan_id INTEGER PRIMARY KEY, state VARCHAR(2))")
+    db, queries = counting_database(engine, monkeypatch)
+    renderer = CompactSchemaRenderer()
+    before = reflect(engine, "loans")
+    renderer.render(db, [before])
+
+    with engine.begin() as connection:
+        connection.exec_driver_sql("ALTER TABLE loans ADD COLUMN loan_amount NUMERIC(12, 2)")
+    after = reflect(engine, "loans")
+    assert table_fingerprint(after) != table_fingerprint(before)
+    assert renderer.render(db, [after]) == "TABLE loans (loan_id int PK, state str, loan_amount dec)"
+    assert len(queries) == 2
@@ -0,0 +1,32 @@
+import threading
+
+from sqlalchemy.pool import QueuePool, StaticPool
+
+from sql_agent.db_backends import get_backend
+
+
+def test_in_memory_sqlite_shares_one_database(monkeypatch):
+    monkeypatch.setenv("SQLITE_DATABASE_PATH", ":memory:")
+    engine = get_backend("sqlite").create_engine()
+    assert isinstance(engine.pool, StaticPool)
+    with engine.begin() as connection:
+        connection.exec_driver_sql("CREATE TABLE loans (loan_id INTEGER)")
+        connection.exec_driver_sql("INSERT INTO loans VALUES (1), (2)")
+
+    # Request threads see the table created on another connection
+    counts = []
+    def count_loans():
+        with engine.connect() as connection:
+            counts.append(connection.exec_driver_sql("SELECT COUNT(*) FROM loans").scalar())
+    thread = threading.Thread(target=count_loans)
+    thread.start()
+    thread.join()
+    assert counts == [2]
+
+
+def test_sqlite_file_keeps_the_connection_pool(tmp_path, monkeypatch):
+    monkeypatch.setenv("SQLITE_DATABASE_PATH", str(tmp_path / "loans.db"))
+    monkeypatch.setenv("DB_POOL_SIZE", "3")
+    engine = get_backend("sqlite").create_engine()
+    assert isinstance(engine.pool, QueuePool)
+    assert engine.pool.size() == 3
@@ -0,0 +1,28 @@
+import json
+
+from sql_agent.example_store import CURATED_EXAMPLES_PATH, FewShotExampleStore
+
+
+def test_curated_examples_are_retrieved_by_similarity():
+    store = FewShotExampleStore(curated_path=CURATED_EXAMPLES_PATH)
+    (score, example), *_ = store.search("total loan amount of applicants with a mortgage", k=1)
+    assert "home_ownership = 'MORTGAGE'" in example["sql"]
+
+
+def test_harvested_examples_with_answer_text_are_skipped(tmp_path):
+    harvest_path = tmp_path / "harvested.jsonl"
+    examples = [
+        {"question": "Loans per state", "sql": "SELECT state, COUNT(*) FROM loans GROUP BY state", "source": "harvested"},
+        {"question": "Loans per ownership", "sql": "SELECT home_ownership, COUNT(*) FROM loans GROUP BY home_ownership\n```\n"
+                                                  "This query groups the rows...", "source": "harvested"},
+    ]
+    harvest_path.write_text("".join(json.dumps(example) + "\n" for example in examples), encoding="utf-8")
+    store = FewShotExampleStore(curated_path=None, harvest_path=str(harvest_path))
+    assert len(store) == 1
+
+
+def test_harvest_adds_each_question_once(tmp_path):
+    store = FewShotExampleStore(curated_path=None, harvest_path=str(tmp_path / "harvested.jsonl"))
+    assert store.add("How many loans per state?", "SELECT state, COUNT(*) FROM loans GROUP BY state")
+    assert not store.add("how many loans per state", "SELECT state, COUNT(*) AS n FROM loans GROUP BY state")
+    assert len(FewShotExampleStore(curated_path=None, harvest_path=str(tmp_path / "harvested.jsonl"))) == 1
@@ -0,0 +1,55 @@
+import json
+import os
+
+import pytest
+
+from sql_agent.file_sources import _fingerprint, _manifest_path, build_file_database, file_sources_changed
+
+
+def record_build(database_path, paths):
+    # What build_file_database leaves behind, without requiring duckdb
+    database_path.write_bytes(b"")
+    with open(_manifest_path(str(database_path)), "w", encoding="utf-8") as f:
+        json.dump(_fingerprint(paths), f)
+
+
+def test_in_place_edits_are_detected(tmp_path):
+    source = tmp_path / "loans.csv"
+    source.write_text("loan_id,state\n1,TX\n", encoding="utf-8")
+    database_path = tmp_path / "file_sources.duckdb"
+    record_build(database_path, [str(source)])
+    assert not file_sources_changed([str(source)], str(database_path))
+
+    # Same modification time, different size
+    stat = os.stat(source)
+    source.write_text("loan_id,state\n1,TX\n2,CA\n", encoding="utf-8")
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert file_sources_changed([str(source)], str(database_path))
+
+
+def test_files_added_to_a_directory_are_detected(tmp_path):
+    folder = tmp_path / "data"
+    folder.mkdir()
+    (folder / "loans.csv").write_text("loan_id\n1\n", encoding="utf-8")
+    database_path = tmp_path / "file_sources.duckdb"
+    record_build(database_path, [str(folder)])
+    assert not file_sources_changed([str(folder)], str(database_path))
+    (folder / "states.csv").write_text("state\nTX\n", encoding="utf-8")
+    assert file_sources_changed([str(folder)], str(database_path))
+
+
+def test_database_is_replaced_atomically(tmp_path):
+    duckdb = pytest.importorskip("duckdb")
+    source = tmp_path / "loans.csv"
+    source.write_text("loan_id,state\n1,TX\n", encoding="utf-8")
+    database_path = str(tmp_path / "file_sources.duckdb")
+    assert build_file_database([str(source)], database_path) == ["loans"]
+    reader = duckdb.connect(database_path, read_only=True)
+    source.write_text("loan_id,state\n1,TX\n2,CA\n", encoding="utf-8")
+    assert file_sources_changed([str(source)], database_path)
+    build_file_database([str(source)], database_path)
+    # The open connection still reads the database it opened
+    assert reader.execute("SELECT COUNT(*) FROM loans").fetchone() == (1,)
+    reader.close()
+    assert not file_sources_changed([str(source)], database_path)
+    assert [name for name in os.listdir(tmp_path) if name.endswith(".tmp")] == []
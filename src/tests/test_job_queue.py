@@ -0,0 +1,77 @@
+import threading
+
+import pytest
+
+from sql_agent.job_queue import InMemoryJobStore, JobQueueFull, JobRunner, send_webhook
+
+
+def answer(prompt, session_id=None, data_source=None):
+    return {"Prompt": prompt}
+
+
+def test_webhooks_are_rejected_without_an_allowlist():
+    runner = JobRunner(answer, InMemoryJobStore())
+    with pytest.raises(ValueError, match="disabled"):
+        runner.submit("How many loans?", webhook_url="http://169.254.169.254/latest/meta-data")
+    runner.shutdown()
+
+
+@pytest.mark.parametrize("url, error", [
+    ("http://hooks.internal.example/jobs", "not allowed"),
+    ("ftp://127.0.0.1/jobs", "http"),
+    # On the allowlist, but a loopback address
+    ("http://LOCALHOST:8080/jobs", "disallowed address"),
+    ("http://127.0.0.1/jobs", "disallowed address"),
+])
+def test_webhook_urls_outside_the_allowlist_are_rejected(url, error):
+    runner = JobRunner(answer, InMemoryJobStore(), allowed_webhook_hosts=["localhost", "127.0.0.1"])
+    with pytest.raises(ValueError, match=error):
+        runner.check_webhook_url(url)
+    runner.shutdown()
+
+
+def test_allowed_webhook_hosts_are_accepted():
+    runner = JobRunner(answer, InMemoryJobStore(), allowed_webhook_hosts=["10.0.0.7"])
+    runner.check_webhook_url("https://10.0.0.7/jobs")
+    runner.shutdown()
+
+
+def test_webhook_delivery_refuses_loopback_addresses():
+    assert not send_webhook("http://127.0.0.1:9/jobs", {"job_id": "x"}, attempts=1)
+
+
+def test_submissions_beyond_the_queue_are_rejected():
+    release = threading.Event()
+
+    def slow_answer(prompt, session_id=None, data_source=None):
+        release.wait(10)
+        return {"Prompt": prompt}
+
+    store = InMemoryJobStore()
+    runner = JobRunner(slow_answer, store, max_workers=1, max_queued=1)
+    try:
+        running = runner.submit("first")
+        runner.submit("second")
+        with pytest.raises(JobQueueFull):
+            runner.submit("third")
+    finally:
+        release.set()
+        runner.shutdown()
+    assert store.get(running.job_id) is not None
+
+
+def test_queue_full_is_a_429(monkeypatch, tmp_path):
+    for name, value in {"AZURE_OPENAI_API_VERSION": "2024-02-01", "AZURE_OPENAI_API_KEY": "test",
+                        "AZURE_OPENAI_ENDPOINT": "http://127.0.0.1:9", "DB_BACKEND": "sqlite",
+                        "SQLITE_DATABASE_PATH": str(tmp_path / "loans.db"), "WARMUP_ENABLED": "false"}.items():
+        monkeypatch.setenv(name, value)
+    main = pytest.importorskip("main")
+    testclient = pytest.importorskip("fastapi.testclient")
+
+    class FullRunner:
+        def submit(self, *args, **kwargs):
+            raise JobQueueFull("Too many queued jobs; retry later.")
+
+    monkeypatch.setattr(main, "get_job_runner", lambda handler: FullRunner())
+    response = testclient.TestClient(main.app).post("/generate-sql/jobs", json={"prompt": "How many loans?"})
+    assert response.status_code == 429
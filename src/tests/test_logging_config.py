@@ -0,0 +1,46 @@
+import json
+import queue
+import logging
+
+from sql_agent.logging_config import (JsonFormatter, NonBlockingQueueHandler, RequestContextFilter,
+                                      request_id_var)
+from sql_agent.metrics import get_metrics
+
+
+def queued_logger(name, log_queue, max_field_chars=2000):
+    handler = NonBlockingQueueHandler(log_queue, max_field_chars)
+    handler.addFilter(RequestContextFilter())
+    logger = logging.getLogger(name)
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    return logger
+
+
+def dropped_records():
+    return get_metrics().snapshot()["counters"].get("logging.dropped_records", 0)
+
+
+def test_records_are_dropped_and_counted_when_the_queue_is_full():
+    log_queue = queue.Queue(maxsize=2)
+    logger = queued_logger("tests.full_queue", log_queue)
+    before = dropped_records()
+    for number in range(5):
+        # Returns at once although nothing drains the queue
+        logger.info("record %d", number)
+    assert dropped_records() - before == 3
+    assert [log_queue.get_nowait().getMessage() for _ in range(2)] == ["record 0", "record 1"]
+
+
+def test_queued_records_carry_the_request_id_and_capped_fields():
+    log_queue = queue.Queue()
+    logger = queued_logger("tests.request_id", log_queue, max_field_chars=10)
+    token = request_id_var.set("req-1")
+    try:
+        logger.info("x" * 50, extra={"sql": "SELECT " + "y" * 50})
+    finally:
+        request_id_var.reset(token)
+    entry = json.loads(JsonFormatter(max_field_chars=10).format(log_queue.get_nowait()))
+    assert entry["request_id"] == "req-1"
+    assert entry["message"] == "x" * 10 + "... [40 more chars]"
+    assert entry["sql"] == "SELECT yyy... [47 more chars]"
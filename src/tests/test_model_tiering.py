@@ -0,0 +1,47 @@
+from langchain_core.agents import AgentAction
+
+from sql_agent.model_tiering import check_agent_answer, executed_sql
+
+TABLES = ["products", "orders"]
+
+
+def query_step(sql, observation="[(3,)]", tool="sql_db_query"):
+    return (AgentAction(tool=tool, tool_input={"query": sql}, log=""), observation)
+
+
+def test_answer_citing_a_table_in_prose_is_accepted():
+    steps = [query_step("SELECT COUNT(*) FROM products")]
+    sql_in_answer = "SELECT COUNT(*) FROM products\n```\nThe count comes from the `products` table, set into the report."
+    verdict = check_agent_answer("Final Answer: There are 3 products.", sql_in_answer, steps, TABLES)
+    assert verdict.accepted, verdict.reason
+
+
+def test_unknown_table_in_the_executed_query_escalates():
+    steps = [query_step("SELECT COUNT(*) FROM customers")]
+    verdict = check_agent_answer("Final Answer: 3", "SELECT COUNT(*) FROM customers", steps, TABLES)
+    assert not verdict.accepted
+    assert verdict.reason == "unknown tables: customers"
+
+
+def test_failed_last_query_escalates():
+    steps = [query_step("SELECT COUNT(*) FROM products"), query_step("SELECT name FROM products", "Error: timeout")]
+    verdict = check_agent_answer("Final Answer: 3", "SELECT name FROM products", steps, TABLES)
+    assert (verdict.accepted, verdict.reason) == (False, "the last query failed")
+
+
+def test_answer_without_an_executed_query_escalates():
+    verdict = check_agent_answer("Final Answer: 3", "SELECT COUNT(*) FROM products", [], TABLES)
+    assert (verdict.accepted, verdict.reason) == (False, "the SQL was never executed")
+
+
+def test_low_confidence_answer_escalates():
+    steps = [query_step("SELECT COUNT(*) FROM products")]
+    verdict = check_agent_answer("Final Answer: I'm not sure.", "SELECT COUNT(*) FROM products", steps, TABLES)
+    assert (verdict.accepted, verdict.reason) == (False, "low confidence answer")
+
+
+def test_executed_sql_of_the_winning_candidate():
+    observation = "Candidate 2 succeeded.\nSQL: SELECT name FROM products\nResult: [('a',)]"
+    steps = [query_step('["SELECT nme FROM products", "SELECT name FROM products"]', observation,
+                        tool="sql_db_query_candidates")]
+    assert executed_sql(steps) == "SELECT name FROM products"
@@ -0,0 +1,67 @@
+import threading
+import contextvars
+
+import pytest
+
+from sql_agent.profiling import SamplingProfiler, _thread_stages, mark_stage, profile_request, profile_stage
+
+
+def stage_lines(profiler):
+    """The stage prefixes of the collapsed stacks."""
+    return {";".join(frame for frame in line.split(";") if frame.startswith("[stage]"))
+            for line in profiler.to_collapsed().splitlines()}
+
+
+def run_until_sampled(target, profiler):
+    """Run target on a thread that stays inside it until the profiler has taken one sample."""
+    entered, sampled = threading.Event(), threading.Event()
+    def work():
+        target(entered, sampled)
+    context = contextvars.copy_context()
+    thread = threading.Thread(target=context.run, args=(work,))
+    thread.start()
+    assert entered.wait(5)
+    profiler.sample()
+    sampled.set()
+    thread.join(5)
+
+
+def test_samples_are_tagged_with_the_current_stage():
+    profiler = SamplingProfiler(watch_all_stages=True)
+    still_tracked = []
+    def request(entered, sampled):
+        with profile_stage("sql_flow"):
+            mark_stage("connect")
+            mark_stage("agent")
+            entered.set()
+            sampled.wait(5)
+        # Leaving the outermost stage forgets the thread
+        still_tracked.append(threading.get_ident() in _thread_stages)
+
+    run_until_sampled(request, profiler)
+    # Each step replaces the previous one at the same level
+    assert stage_lines(profiler) == {"[stage] agent"}
+    assert still_tracked == [False]
+
+
+def test_worker_threads_inherit_the_request_stage():
+    def request(entered, sampled):
+        with profile_stage("sql_flow"):
+            mark_stage("agent")
+            # A tool call on a pool thread, as the agent executor runs it
+            def tool():
+                with profile_stage("tool:sql_db_query"):
+                    entered.set()
+                    sampled.wait(5)
+            worker = threading.Thread(target=contextvars.copy_context().run, args=(tool,))
+            worker.start()
+            worker.join(5)
+
+    with profile_request("test") as profiler:
+        run_until_sampled(request, profiler)
+    assert stage_lines(profiler) == {"[stage] agent", "[stage] agent;[stage] tool:sql_db_query"}
+
+
+def test_unknown_export_format_is_rejected():
+    with pytest.raises(ValueError):
+        SamplingProfiler().export("pprof")
@@ -0,0 +1,29 @@
+from sql_agent.result_aggregation import summarize_rows
+
+# Run from the src folder: python -m pytest tests
+
+
+def test_plain_listing_is_returned_unchanged():
+    rows = [{"name": "customer {}".format(i), "amount": float(i)} for i in range(40)]
+    assert summarize_rows(rows, "SELECT name, amount FROM loans", "List the customers and their loan amounts") is None
+
+
+def test_grouped_result_is_returned_unchanged():
+    rows = [{"state": "S{:02d}".format(i), "loans": i + 1} for i in range(50)]
+    sql = "SELECT state, COUNT(*) AS loans FROM loans GROUP BY state"
+    assert summarize_rows(rows, sql, "How many loans are there in each state?") is None
+
+
+def test_long_listing_for_a_total_is_summarized():
+    rows = [{"day": "2020-01-{:02d}".format(i % 28 + 1), "state": "TX", "death": 2} for i in range(50)]
+    summary = summarize_rows(rows, "SELECT day, state, death FROM covid WHERE state = 'TX' ORDER BY day",
+                             "What is the total number of deaths in Texas?")
+    assert summary.startswith("The query returned 50 rows.")
+    assert "SUM(death) = 100" in summary
+    assert "SELECT SUM(death) AS sum_death FROM (SELECT day, state, death FROM covid WHERE state = 'TX') AS t" in summary
+
+
+def test_short_listing_for_a_total_gets_the_figure():
+    rows = [{"state": "TX", "death": 3}, {"state": "TX", "death": 4}]
+    summary = summarize_rows(rows, "SELECT state, death FROM covid", "Total deaths in Texas?")
+    assert summary.endswith("Computed over these 2 rows: SUM(death) = 7. Use these figures; do not redo the arithmetic.")
@@ -0,0 +1,59 @@
+import pytest
+from sqlalchemy import create_engine
+
+from sql_agent.result_spool import ExpiredCursorError, InvalidCursorError, ResultSpool
+from sql_agent.sql_sandbox import ReadOnlySQLDatabase
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine("sqlite:///{}".format(tmp_path / "loans.db"))
+    with engine.begin() as connection:
+        connection.exec_driver_sql("CREATE TABLE loans (loan_id INTEGER, state TEXT, loan_amount REAL)")
+        connection.exec_driver_sql("INSERT INTO loans VALUES " + ", ".join(
+            "({}, 'TX', {})".format(i, i * 1.5) for i in range(1000)))
+    return ReadOnlySQLDatabase(engine)
+
+
+def test_rows_are_streamed_up_to_max_rows(db, tmp_path):
+    spool = ResultSpool(str(tmp_path / "spool"), max_rows=250, secret="test")
+    consumed = []
+
+    def write(columns, rows):
+        return spool.write(columns, (consumed.append(row) or row for row in rows))
+
+    meta = db.stream("SELECT loan_id, loan_amount FROM loans ORDER BY loan_id", write)
+    assert (meta["row_count"], meta["truncated"], meta["columns"]) == (250, True, ["loan_id", "loan_amount"])
+    # One row past the limit is read to know the result was cut, no more
+    assert len(consumed) == 251
+
+
+def test_pages_follow_the_cursor_to_the_end(db, tmp_path):
+    spool = ResultSpool(str(tmp_path / "spool"), secret="test")
+    meta = db.stream("SELECT loan_id FROM loans WHERE loan_id < 250", spool.write)
+    page = spool.read_page(meta["spool_id"], page_size=100)
+    rows = page["rows"]
+    while page["next_cursor"]:
+        page = spool.read_cursor(page["next_cursor"], page_size=100)
+        rows += page["rows"]
+    assert [row[0] for row in rows] == list(range(250))
+
+
+def test_empty_result_keeps_its_columns(db, tmp_path):
+    spool = ResultSpool(str(tmp_path / "spool"), secret="test")
+    meta = db.stream("SELECT state FROM loans WHERE loan_id < 0", spool.write)
+    page = spool.read_page(meta["spool_id"])
+    assert (page["columns"], page["rows"], page["next_cursor"]) == (["state"], [], None)
+
+
+def test_cursors_are_signed_and_expire(tmp_path):
+    spool = ResultSpool(str(tmp_path / "spool"), ttl_seconds=60, secret="test")
+    meta = spool.write(["n"], [(i,) for i in range(3)])
+    cursor = spool.read_page(meta["spool_id"], page_size=1)["next_cursor"]
+    with pytest.raises(InvalidCursorError):
+        ResultSpool(str(tmp_path / "spool"), secret="other").read_cursor(cursor)
+    with pytest.raises(InvalidCursorError):
+        spool.read_cursor("not-a-cursor")
+    (tmp_path / "spool" / (meta["spool_id"] + ".meta.json")).unlink()
+    with pytest.raises(ExpiredCursorError):
+        spool.read_cursor(cursor)
@@ -0,0 +1,51 @@
+from sqlalchemy import MetaData, create_engine
+
+from sql_agent.runtime import RuntimePool, estimate_metadata_bytes
+
+
+def reflected_metadata(tables):
+    engine = create_engine("sqlite://")
+    with engine.begin() as connection:
+        for number in range(tables):
+            connection.exec_driver_sql("CREATE TABLE t{} (id INTEGER PRIMARY KEY, name TEXT, amount REAL, "
+                                       "created_at TEXT, note VARCHAR(20))".format(number))
+    metadata = MetaData()
+    metadata.reflect(engine)
+    return metadata
+
+
+def test_schema_size_counts_the_whole_object_graph():
+    small, large = estimate_metadata_bytes(reflected_metadata(10)), estimate_metadata_bytes(reflected_metadata(40))
+    # Several kilobytes per reflected table (columns, types, constraints, names), growing with the schema
+    assert (large - small) / 30 > 4000
+
+
+def test_schema_size_is_bounded_by_the_objects_visited():
+    metadata = reflected_metadata(40)
+    assert estimate_metadata_bytes(metadata, max_objects=100) < estimate_metadata_bytes(metadata)
+
+
+class IdleRuntime:
+    """Stands in for a DatabaseRuntime; records whether the pool lock was held while disposing it."""
+
+    is_default = False
+    last_used_at = 0
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.disposed_under_lock = None
+
+    def memory_bytes(self):
+        return 0
+
+    def dispose(self):
+        self.disposed_under_lock = self.pool._lock.locked()
+
+
+def test_evicted_runtimes_are_disposed_outside_the_pool_lock():
+    pool = RuntimePool(idle_seconds=60)
+    runtimes = {name: IdleRuntime(pool) for name in ("sales", "hr")}
+    pool._runtimes.update(runtimes)
+    pool.evict_idle()
+    assert not pool._runtimes
+    assert [runtime.disposed_under_lock for runtime in runtimes.values()] == [False, False]
@@ -0,0 +1,26 @@
+from sql_agent import semantic_layer
+from sql_agent.semantic_layer import SEMANTIC_LAYER_PATH, SemanticLayer, get_semantic_layer
+
+QUESTION = "Average credit score by ownership type"
+
+
+def test_routes_to_the_pre_aggregate_when_it_exists():
+    route = SemanticLayer.from_file(SEMANTIC_LAYER_PATH).route(QUESTION, ["loans", "agg_loans_by_ownership_state"])
+    assert route.uses_pre_aggregate and route.source == "agg_loans_by_ownership_state"
+
+
+def test_falls_back_to_the_tables_that_exist():
+    layer = SemanticLayer.from_file(SEMANTIC_LAYER_PATH)
+    route = layer.route(QUESTION, ["dbo.Loans"])
+    assert (route.source, route.uses_pre_aggregate) == ("loans", False)
+    assert layer.route(QUESTION, ["customers", "orders"]) is None
+
+
+def test_disabled_unless_enabled(monkeypatch):
+    monkeypatch.setattr(semantic_layer, "_semantic_layer", None)
+    monkeypatch.setattr(semantic_layer, "_semantic_layer_loaded", False)
+    monkeypatch.delenv("SEMANTIC_LAYER_ENABLED", raising=False)
+    assert get_semantic_layer() is None
+    monkeypatch.setattr(semantic_layer, "_semantic_layer_loaded", False)
+    monkeypatch.setenv("SEMANTIC_LAYER_ENABLED", "true")
+    assert get_semantic_layer() is not None
@@ -0,0 +1,9 @@
+from sql_agent.session_store import InMemorySessionStore, SessionTurn, session_key
+
+
+def test_sessions_are_kept_per_data_source():
+    store = InMemorySessionStore()
+    store.append_turn(session_key("s1", "default"), SessionTurn("Loans per state", "SELECT state, COUNT(*) FROM loans GROUP BY state"))
+    assert len(store.get_turns(session_key("s1", "default"))) == 1
+    # The same session id on another data source starts over
+    assert store.get_turns(session_key("s1", "sales")) == []
@@ -0,0 +1,91 @@
+import threading
+import time
+
+import pytest
+
+from sql_agent.single_flight import (CancellationCallbackHandler, RequestCancelled, SingleFlight,
+                                     cancel_event_var, raise_if_cancelled)
+
+
+def run_in_thread(target):
+    outcome = {}
+    def call():
+        try:
+            outcome["result"] = target()
+        except Exception as e:
+            outcome["error"] = e
+    thread = threading.Thread(target=call)
+    thread.start()
+    return thread, outcome
+
+
+def test_identical_calls_share_one_run():
+    single_flight = SingleFlight(max_workers=2)
+    release, calls = threading.Event(), []
+    def answer():
+        calls.append(1)
+        release.wait(5)
+        return "42 loans"
+
+    leader, leader_outcome = run_in_thread(lambda: single_flight.do("q", answer))
+    while single_flight.in_flight() == 0:
+        time.sleep(0.01)
+    follower, follower_outcome = run_in_thread(lambda: single_flight.do("q", answer))
+    while single_flight._flights["q"].waiters < 2:
+        time.sleep(0.01)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert leader_outcome == follower_outcome == {"result": "42 loans"}
+    assert calls == [1]
+
+
+def test_run_is_cancelled_when_the_last_caller_leaves():
+    single_flight = SingleFlight(max_workers=1)
+    stopped = threading.Event()
+    def answer():
+        # Stands in for the agent checking the cancellation before each LLM and tool call
+        try:
+            while True:
+                raise_if_cancelled()
+                time.sleep(0.01)
+        finally:
+            stopped.set()
+
+    with pytest.raises(TimeoutError):
+        single_flight.do("q", answer, timeout=0.1)
+    assert stopped.wait(5)
+    # The next identical question starts a new run
+    assert single_flight.in_flight() == 0
+    assert single_flight.do("q", lambda: "fresh") == "fresh"
+
+
+def test_run_continues_while_a_caller_still_waits():
+    single_flight = SingleFlight(max_workers=1)
+    release = threading.Event()
+    def answer():
+        release.wait(5)
+        raise_if_cancelled()
+        return "done"
+
+    patient, outcome = run_in_thread(lambda: single_flight.do("q", answer))
+    while single_flight.in_flight() == 0:
+        time.sleep(0.01)
+    with pytest.raises(TimeoutError):
+        single_flight.do("q", answer, timeout=0.05)
+    release.set()
+    patient.join(5)
+    assert outcome == {"result": "done"}
+
+
+def test_callback_handler_stops_a_cancelled_run():
+    handler = CancellationCallbackHandler()
+    cancel_event = threading.Event()
+    token = cancel_event_var.set(cancel_event)
+    try:
+        handler.on_tool_start({}, "SELECT 1")
+        cancel_event.set()
+        with pytest.raises(RequestCancelled):
+            handler.on_chat_model_start({}, [])
+    finally:
+        cancel_event_var.reset(token)
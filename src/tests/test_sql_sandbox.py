@@ -0,0 +1,70 @@
+import pytest
+from sqlalchemy import create_engine
+
+from sql_agent.sql_sandbox import ReadOnlySQLDatabase, UnsafeSqlError, referenced_tables, validate_read_only_sql
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT [Import], Export FROM trade",
+    "SELECT load FROM t",
+    "SELECT t.set, t.use FROM t",
+    "SELECT amount load, lock FROM t WHERE copy > 1 ORDER BY kill DESC",
+    "SELECT name FROM customers WHERE note = 'drop-off; then delete'",
+    "SELECT [Update Date] FROM orders;",
+    "WITH totals AS (SELECT state, SUM(loan_amount) AS amount FROM loans GROUP BY state) SELECT * FROM totals",
+    "SELECT COUNT(*) FROM loans -- insert a comment",
+    "SELECT * FROM a JOIN copy c ON a.id = c.id",
+    "SELECT merge FROM t",
+    "SELECT DISTINCT load, set FROM export e, import i WHERE e.id = i.id",
+])
+def test_read_queries_are_accepted(sql):
+    assert validate_read_only_sql(sql) == sql.rstrip(";")
+
+
+@pytest.mark.parametrize("sql", [
+    "DELETE FROM loans",
+    "SELECT * INTO loans_copy FROM loans",
+    "SELECT 1; DROP TABLE loans",
+    "WITH x AS (SELECT 1 AS n) DELETE FROM loans",
+    "SELECT 1 EXEC xp_cmdshell 'dir'",
+    "SELECT 1 KILL 52",
+    "SELECT 1 USE master",
+    "SELECT 1 SET ROWCOUNT 0",
+    "SELECT 1 MERGE loans USING staged ON loans.id = staged.id",
+    "SELECT * FROM copy c KILL 52",
+    "SELECT * FROM loans WAITFOR DELAY '00:00:05'",
+    "SELECT * FROM loans FOR UPDATE",
+    "PRAGMA table_info(loans)",
+    "",
+])
+def test_writes_and_statements_are_rejected(sql):
+    with pytest.raises(UnsafeSqlError):
+        validate_read_only_sql(sql)
+
+
+def test_referenced_tables():
+    sql = "SELECT * FROM dbo.[Orders] o JOIN customers c ON o.customer_id = c.id WHERE note = 'from x'"
+    assert referenced_tables(sql) == ["dbo.Orders", "customers"]
+
+
+def test_sandbox_rolls_back_and_stays_read_only(tmp_path):
+    engine = create_engine("sqlite:///{}".format(tmp_path / "sandbox.db"))
+    with engine.begin() as connection:
+        connection.exec_driver_sql("CREATE TABLE loans (loan_id INTEGER, loan_amount REAL)")
+        connection.exec_driver_sql("INSERT INTO loans VALUES (1, 100.0), (2, 250.0)")
+    db = ReadOnlySQLDatabase(engine)
+    assert db.run("SELECT SUM(loan_amount) FROM loans") == "[(350.0,)]"
+    with pytest.raises(UnsafeSqlError):
+        db.run("UPDATE loans SET loan_amount = 0")
+
+
+def test_session_settings_do_not_outlive_the_sandbox(tmp_path):
+    engine = create_engine("sqlite:///{}".format(tmp_path / "sandbox.db"), pool_size=1, max_overflow=0)
+    with engine.begin() as connection:
+        connection.exec_driver_sql("CREATE TABLE loans (loan_id INTEGER)")
+    db = ReadOnlySQLDatabase(engine)
+    db.run("SELECT COUNT(*) FROM loans")
+    # Same pooled connection: PRAGMA query_only was switched off when the sandbox returned it
+    with engine.begin() as connection:
+        assert connection.exec_driver_sql("PRAGMA query_only").scalar() == 0
+        connection.exec_driver_sql("INSERT INTO loans VALUES (1)")
@@ -0,0 +1,35 @@
+import os
+
+from langchain_core.agents import AgentAction, AgentStep
+
+from sql_agent.step_retention import StepRetentionPolicy
+
+LONG_RESULT = str([(i, "customer {}".format(i)) for i in range(500)])
+
+
+def step(tool, observation):
+    return AgentStep(action=AgentAction(tool=tool, tool_input="", log=""), observation=observation)
+
+
+def test_query_results_are_truncated_with_the_row_count():
+    policy = StepRetentionPolicy(mode="truncate", max_chars=200)
+    compacted = policy.compact_step(step("sql_db_query", LONG_RESULT))
+    assert compacted.observation.startswith(LONG_RESULT[:200])
+    assert "about 500 rows in total" in compacted.observation
+    assert policy.stats["dropped_bytes"] == len(LONG_RESULT) - 200
+
+
+def test_schemas_and_table_lists_are_kept_whole():
+    policy = StepRetentionPolicy(mode="truncate", max_chars=200)
+    schema = "CREATE TABLE loans (\n" + ",\n".join("\tcolumn_{} INTEGER".format(i) for i in range(100)) + "\n)"
+    assert policy.compact_step(step("sql_db_schema", schema)).observation == schema
+    assert policy.compact_step(step("sql_db_list_tables", ", ".join("t{}".format(i) for i in range(100)))).observation.endswith("t99")
+
+
+def test_spilled_path_is_not_shown_to_the_model(tmp_path):
+    policy = StepRetentionPolicy(mode="spill", max_chars=200, spill_dir=str(tmp_path))
+    compacted = policy.compact_step(step("sql_db_query", LONG_RESULT))
+    assert str(tmp_path) not in compacted.observation
+    (spilled,) = os.listdir(tmp_path)
+    assert (tmp_path / spilled).read_text(encoding="utf-8") == LONG_RESULT
+    assert policy.stats["spilled_bytes"] == len(LONG_RESULT)
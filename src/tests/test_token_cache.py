@@ -0,0 +1,97 @@
+import threading
+from collections import namedtuple
+
+import pytest
+
+from sql_agent.token_cache import CachedTokenProvider
+
+AccessToken = namedtuple("AccessToken", ["token", "expires_on"])
+SCOPE = "https://database.windows.net/.default"
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class FakeCredential:
+    """Issues token-1, token-2, ... valid for lifetime seconds; fails while failing is set."""
+
+    def __init__(self, clock, lifetime=3600):
+        self.clock = clock
+        self.lifetime = lifetime
+        self.calls = 0
+        self.failing = False
+        self.issued = threading.Event()
+
+    def get_token(self, scope):
+        assert scope == SCOPE
+        self.calls += 1
+        if self.failing:
+            raise RuntimeError("credential unavailable")
+        self.issued.set()
+        return AccessToken("token-{}".format(self.calls), self.clock() + self.lifetime)
+
+
+def test_valid_token_is_served_from_the_cache():
+    clock = FakeClock()
+    credential = FakeCredential(clock)
+    provider = CachedTokenProvider(credential, SCOPE, background=False, clock=clock)
+    assert provider.get_token() == "token-1"
+    clock.now += 3000
+    assert provider() == "token-1"
+    assert credential.calls == 1
+
+
+def test_token_is_refreshed_in_the_background_before_it_expires():
+    clock = FakeClock()
+    credential = FakeCredential(clock)
+    provider = CachedTokenProvider(credential, SCOPE, refresh_margin_seconds=300, clock=clock)
+    try:
+        assert provider.get_token() == "token-1"
+        # Inside the refresh margin but still valid: callers keep the cached token...
+        credential.issued.clear()
+        clock.now += 3400
+        assert provider.get_token() == "token-1"
+        # ...while the refresher replaces it (it wakes up at least once a second)
+        assert credential.issued.wait(5)
+        assert provider.get_token() == "token-2"
+    finally:
+        provider.stop()
+
+
+def test_failed_refresh_falls_back_to_a_synchronous_acquisition():
+    clock = FakeClock()
+    credential = FakeCredential(clock)
+    provider = CachedTokenProvider(credential, SCOPE, refresh_margin_seconds=300, retry_seconds=0.1, clock=clock)
+    try:
+        assert provider.get_token() == "token-1"
+        credential.failing = True
+        clock.now += 3400
+        calls = credential.calls
+        # The refresher fails and retries; the current token is still served
+        for _ in range(100):
+            if credential.calls >= calls + 2:
+                break
+            threading.Event().wait(0.05)
+        assert credential.calls >= calls + 2
+        assert provider.get_token() == "token-1"
+        # Once the token expired, the caller acquires one itself
+        clock.now += 300
+        credential.failing = False
+        assert provider.get_token().startswith("token-")
+        assert provider.get_token() != "token-1"
+    finally:
+        provider.stop()
+
+
+def test_acquisition_error_reaches_the_caller_when_there_is_no_token():
+    clock = FakeClock()
+    credential = FakeCredential(clock)
+    credential.failing = True
+    provider = CachedTokenProvider(credential, SCOPE, background=False, clock=clock)
+    with pytest.raises(RuntimeError):
+        provider.get_token()
@@ -0,0 +1,64 @@
+import pytest
+
+from sql_agent.metrics import get_metrics
+from sql_agent.topic_gate import TopicGate, build_vocabulary, record_verdict, topic_gate_mode
+
+COLUMN_STATS = {"tables": {"loans": {"columns": {
+    "home_ownership": {"top_values": [["RENT", 10], ["MORTGAGE", 7]]},
+    "loan_amount": {},
+}}}}
+
+
+class StubClassifier:
+    """Scikit-learn-like classifier returning a fixed on-topic probability."""
+
+    classes_ = [0, 1]
+
+    def __init__(self, probability):
+        self.probability = probability
+
+    def predict_proba(self, questions):
+        return [[1 - self.probability, self.probability] for _ in questions]
+
+
+def counters():
+    return get_metrics().snapshot()["counters"]
+
+
+def test_schema_vocabulary_decides_the_topic():
+    gate = TopicGate(build_vocabulary(column_stats=COLUMN_STATS))
+    verdict = gate.check("Total loan amounts of mortgage owners")
+    assert verdict.on_topic and verdict.matched_terms == ["amount", "loan", "mortgage"]
+    assert not gate.check("What is the weather in Paris?").on_topic
+    assert gate.check("Show the total").reason == "no content words"
+
+
+def test_classifier_is_consulted_only_without_overlap():
+    vocabulary = build_vocabulary(column_stats=COLUMN_STATS)
+    assert TopicGate(vocabulary, classifier=StubClassifier(0.9)).check("How many people applied?").on_topic
+    assert not TopicGate(vocabulary, classifier=StubClassifier(0.1)).check("How many people applied?").on_topic
+    assert TopicGate(vocabulary, classifier=StubClassifier(0.0)).check("Loans per state").reason == "schema vocabulary"
+
+
+@pytest.mark.parametrize("mode, counted, not_counted", [
+    ("enforce", "topic_gate.rejected", "topic_gate.would_reject"),
+    ("shadow", "topic_gate.would_reject", "topic_gate.rejected"),
+])
+def test_off_topic_verdicts_are_counted_per_mode(mode, counted, not_counted):
+    verdict = TopicGate(build_vocabulary(column_stats=COLUMN_STATS)).check("Who won the cup final?")
+    before = counters()
+    record_verdict(verdict, mode)
+    after = counters()
+    assert after[counted] - before.get(counted, 0) == 1
+    assert after.get(not_counted, 0) == before.get(not_counted, 0)
+    assert after["topic_gate.off_topic"] - before.get("topic_gate.off_topic", 0) == 1
+
+
+def test_gate_mode_comes_from_the_environment(monkeypatch):
+    monkeypatch.delenv("TOPIC_GATE", raising=False)
+    assert topic_gate_mode() == "off"
+    monkeypatch.setenv("TOPIC_GATE", "Shadow")
+    assert topic_gate_mode() == "shadow"
+    monkeypatch.setenv("TOPIC_GATE", "strict")
+    with pytest.raises(ValueError):
+        topic_gate_mode()
@@ -0,0 +1,37 @@
+import sys
+import types
+
+from sql_agent import warmup
+from sql_agent.question_log import RecentQuestions, replaying
+
+
+def test_questions_are_not_recorded_while_replaying():
+    log = RecentQuestions()
+    log.record("How many providers are there?")
+    with replaying():
+        log.record("How many providers are there?")
+    log.record("Which state has the most beds?")
+    assert log.top(5) == ["How many providers are there?", "Which state has the most beds?"]
+    assert len(log._questions) == 2
+
+
+def test_replay_does_not_inflate_question_frequency(monkeypatch):
+    log = RecentQuestions()
+    for question in ["rare question", "common question", "common question"]:
+        log.record(question)
+    monkeypatch.setattr(warmup, "get_recent_questions", lambda: log)
+
+    # The service records answered questions; stand in for it without loading the LLM settings
+    replayed = []
+    def sql_flow_function(question):
+        replayed.append(question)
+        log.record(question)
+    service = types.ModuleType("sql_agent.sql_agent_service")
+    service.sql_flow_function = sql_flow_function
+    monkeypatch.setitem(sys.modules, "sql_agent.sql_agent_service", service)
+
+    scheduler = warmup.WarmupScheduler(replay_top_n=1)
+    for _ in range(3):
+        assert scheduler.replay_questions() == "1 of 1 question(s) replayed"
+    assert replayed == ["common question"] * 3
+    assert len(log._questions) == 3